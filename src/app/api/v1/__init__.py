@@ -6,3 +6,5 @@
 """
 from app.api.v1.users_count import users_count
 from app.api.v1.users_list import users_list
+from app.api.v1.posts_search import posts_search
+from app.api.v1.stats import stats
@@ -0,0 +1,35 @@
+import logging
+from flask import jsonify, request
+
+from app.api.v1.blueprint import blueprint_v1
+from app.app_init import Session, engine
+from app.logs import access
+from database.search import search_posts, SEARCH_PAGE_DEFAULT
+
+logger = logging.getLogger(__name__)
+
+
+@blueprint_v1.route("/posts/search", methods=["GET"])
+def posts_search():
+    """ Полнотекстовый поиск статей, лучшие совпадения - первыми.
+        ?q=текст&page=N&limit=M - страница N по M результатов; в ответе next - номер следующей страницы или null.
+        Сниппет - html: текст экранирован, найденные слова - в <mark>
+    """
+    api_path = request.environ['REQUEST_URI'][1:]  # путь вызова API
+    logger.debug("%s (%s) started...", api_path, posts_search.__doc__)
+
+    q = request.args.get('q', '').strip()
+    if not q:
+        response, status = {"error": "query parameter q is required"}, 400
+        logger.warning("%s, HTTP=%s ended, empty query", api_path, status, extra=access(request.endpoint))
+        return jsonify(response), status
+
+    with Session() as session:
+        response = search_posts(session, engine.dialect.name, q, page=request.args.get('page', 1, type=int),
+                                limit=request.args.get('limit', SEARCH_PAGE_DEFAULT, type=int))
+    status = 200
+
+    logger.log(logging.INFO if status == 200 else logging.ERROR, "%s, HTTP=%s ended, %s posts, next=%s",
+               api_path, status, len(response['data']), response['next'], extra=access(request.endpoint))
+
+    return jsonify(response), status
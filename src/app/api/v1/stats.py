@@ -0,0 +1,40 @@
+import logging
+from flask import jsonify, request
+
+from app.api.v1.blueprint import blueprint_v1
+from app.app_init import engine, password_hasher, log_pipeline, config_reloader
+from app import metrics
+from app.page_cache import page_cache
+from app.logs import access
+from database.services import menu_cache, user_cache
+from database.search import search_cache
+from app.api.v1.users_count import count_cache
+
+logger = logging.getLogger(__name__)
+
+
+@blueprint_v1.route("/stats", methods=["GET"])
+def stats():
+    """Статистика работы сервера: пул соединений с БД, запросы к сайту, кэши, время по роутам"""
+    api_path = request.environ['REQUEST_URI'][1:]  # путь вызова API
+    logger.debug("%s (%s) started...", api_path, stats.__doc__)
+
+    data = dict(
+        pool=engine.pool.metrics(),
+        requests=dict(total=metrics.requests_total.value, with_db=metrics.requests_with_db.value),
+        menu_cache=menu_cache.stats(),
+        user_cache=user_cache.stats(),
+        password_hashing=password_hasher.stats(),
+        page_cache=page_cache.stats(),
+        users_count_cache=count_cache.stats(),
+        search_cache=search_cache.stats(),
+        routes=metrics.routes.stats(),
+        logging=log_pipeline.stats(),
+        config_reload=config_reloader.stats(),
+    )
+    response, status = {"data": data}, 200
+
+    logger.log(logging.INFO if status == 200 else logging.ERROR, "%s, response=%s, HTTP=%s ended",
+               api_path, response, status, extra=access(request.endpoint))
+
+    return jsonify(response), status
@@ -2,25 +2,52 @@ import logging
 from flask import jsonify, request
 
 from app.api.v1.blueprint import blueprint_v1
-from app.app_init import Session
-from database.tables import users
+from app.app_init import Session, config
+from app.logs import access
+from database.cache import TTLValue
+from database.queries import users_count_query, users_count_full_query, users_estimate_query
 
 logger = logging.getLogger(__name__)
 
+count_cache = TTLValue(ttl=config.get_users_count_ttl())   # короткий кэш точного значения, ttl=0 - без кэша
+
 
 @blueprint_v1.route("/users/count", methods=["GET"])
 def users_count():
-    """Посчитать количество юзеров в базе"""
+    """ Посчитать количество юзеров в базе, не сканируя таблицу.
+        ?mode=exact (по умолчанию) - из счётчика, который ведёт триггер
+        ?mode=approx - оценка планировщика PostgreSQL, без обращения к таблице вообще
+    """
     api_path = request.environ['REQUEST_URI'][1:]  # путь вызова API
-    logger.debug(f"{api_path} ({users_count.__doc__}) started...")
-
-    with Session() as session:
-        # rows = session.query(users).all()
-        rows = session.query(users).count()
+    logger.debug("%s (%s) started...", api_path, users_count.__doc__)
 
-    response, status = {"data": rows}, 200
+    mode = request.args.get('mode', 'exact')
+    if mode not in ('exact', 'approx'):
+        response, status = {"error": f"unknown mode '{mode}', expected exact or approx"}, 400
+    else:
+        rows = _approx_count() if mode == 'approx' else count_cache.get(_exact_count)
+        response, status = {"data": rows, "mode": mode}, 200
 
-    _ll = f"{api_path}, response={response}, HTTP={status} ended"
-    logger.info(_ll) if status == 200 else logger.error(_ll)
+    logger.log(logging.INFO if status == 200 else logging.ERROR, "%s, response=%s, HTTP=%s ended",
+               api_path, response, status, extra=access(request.endpoint))
 
     return jsonify(response), status
+
+
+def _exact_count():
+    """Точное количество из счётчика; если счётчика нет - честный count(*)"""
+    with Session() as session:
+        rows = session.execute(users_count_query()).scalar()
+        if rows is None:
+            logger.warning("Users counter not found, falling back to count(*)")
+            rows = session.execute(users_count_full_query()).scalar()
+    return rows
+
+
+def _approx_count():
+    """Оценка планировщика; пока таблицу не анализировали, оценки нет - тогда точное значение"""
+    with Session() as session:
+        if session.get_bind().dialect.name != 'postgresql':     # в mock-базе оценки нет, да и count дешёвый
+            return count_cache.get(_exact_count)
+        rows = session.execute(users_estimate_query()).scalar()
+    return rows if rows is not None and rows >= 0 else count_cache.get(_exact_count)
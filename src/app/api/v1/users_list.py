@@ -1,30 +1,55 @@
 import logging
-from flask import jsonify, request
-from sqlalchemy import select
+from flask import jsonify, request, current_app, Response, stream_with_context
 
 from app.api.v1.blueprint import blueprint_v1
 from app.app_init import Session
-from database.tables import users
+from app.logs import access
+from database.queries import users_page_query, USERS_PAGE_DEFAULT, USERS_PAGE_MAX, STREAM_BATCH
 
 logger = logging.getLogger(__name__)
 
 
 @blueprint_v1.route("/users/list", methods=["GET"])
 def users_list():
-    """Возвращает список зарегистрированных юзеров"""
+    """ Возвращает список зарегистрированных юзеров, постранично.
+        ?limit=N&after=id - страница из N юзеров с id > after, в ответе next - курсор следующей страницы
+        ?stream=1&after=id - все юзеры после after одним потоковым ответом, память не зависит от числа юзеров
+    """
     api_path = request.environ['REQUEST_URI'][1:]  # путь вызова API
-    logger.debug(f"{api_path} ({users_list.__doc__}) started...")
+    logger.debug("%s (%s) started...", api_path, users_list.__doc__)
 
-    query = select(users.c.name, users.c.email)
+    after = request.args.get('after', 0, type=int)
+    if request.args.get('stream', '0').lower() in ('1', 'true', 'yes'):
+        logger.info("%s, HTTP=200 streaming started", api_path, extra=access(request.endpoint))
+        return Response(stream_with_context(_stream_users(after)), mimetype='application/json')
+
+    limit = min(max(request.args.get('limit', USERS_PAGE_DEFAULT, type=int), 1), USERS_PAGE_MAX)
     with Session() as session:
-        result = session.execute(query).mappings().all()
+        rows = session.execute(users_page_query(limit + 1, after)).all()   # лишняя строка - есть ли продолжение
 
-    list_dicts = list()
-    for item in result:
-        list_dicts.append(dict(item))  # преобразование mapping-объектов Алхимии в словари
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    list_dicts = [{'name': row.name, 'email': row.email} for row in rows[:limit]]
 
-    response, status = {"data": list_dicts}, 200
-    _ll = f"{api_path}, HTTP={status} ended\n\tresponse={response}"
-    logger.info(_ll) if status == 200 else logger.error(_ll)
+    response, status = {"data": list_dicts, "next": next_after}, 200
+    logger.log(logging.INFO if status == 200 else logging.ERROR, "%s, HTTP=%s ended, %s users, next=%s",
+               api_path, status, len(list_dicts), next_after, extra=access(request.endpoint))
 
     return jsonify(response), status
+
+
+def _stream_users(after):
+    """Ответ {"data": [...]} по кусочкам, строки идут из серверного курсора пачками по STREAM_BATCH"""
+    dumps = current_app.json.dumps
+    total = 0
+
+    yield '{"data": ['
+    with Session() as session:
+        result = session.execute(users_page_query(after=after),
+                                 execution_options={'stream_results': True, 'yield_per': STREAM_BATCH})
+        for rows in result.partitions():
+            chunk = ', '.join(dumps({'name': row.name, 'email': row.email}) for row in rows)
+            yield (', ' if total else '') + chunk
+            total += len(rows)
+    yield ']}'
+
+    logger.info("users/list streaming ended, %s users", total, extra=access('api_v1.users_list'))
@@ -1,19 +1,49 @@
-import sys
+import time
+_phase_started = time.perf_counter()     # замер фаз старта - с самого начала, включая импорты
+
 import logging
 from datetime import datetime
 import os
 
-from flask import Flask, g
+from flask import Flask, g, request
 from sys import version as python_ver
 
 from flask_login import LoginManager
 from sqlalchemy.orm import sessionmaker
 
 from app.config.simpl_config import Config
-from database.services import FDataBase
-from app.site.user_login import UserLogin
+from database.services import FDataBase, menu_cache, user_cache, set_avatar_store, set_unique_indexes
+from database.avatars import make_avatar_store
+from database.connection import LazyConnection
+from database.search import search_cache
+from app import metrics
+from app.passwords import PasswordHasher
+from app.page_cache import page_cache
+from app.timing import RequestTimer
+from app.sql_monitor import QueryMonitor
+from app.profiler import ProfilerMiddleware
+from app.logs import LogPipeline
+from app.reloader import ConfigReloader
 import database.init
 
+try:
+    import resource                     # пиковая память процесса - только в unix
+except ImportError:
+    resource = None
+
+startup = dict()                        # длительность фаз старта, мс - в итоги загрузки
+
+
+def _phase(name):
+    """Закончилась фаза старта name: запоминаем её длительность"""
+    global _phase_started
+    now = time.perf_counter()
+    startup[name] = 1000 * (now - _phase_started)
+    _phase_started = now
+
+
+_phase('imports')
+
 # --------------------------------------------- настройка логирования -------------------------------------------------
 logger = logging.getLogger(__name__)
 logger.fatal(f"EDUCATION-server started at {datetime.now().strftime('%d-%m-%Y %H:%M:%S, %A')}...")
@@ -23,7 +53,8 @@ config = Config()   # чтение конфигов ----------------------------
 
 log_level_chr = config.get_loglevel()
 log_level_int = logging.getLevelName(log_level_chr)
-logging.basicConfig(level=log_level_int, format=log_format, handlers=[logging.StreamHandler(sys.stderr)])
+log_pipeline = LogPipeline(log_level_int, log_format, **config.get_logging()).start()   # пишет в stderr свой поток
+_phase('config')
 
 # -------------------------------- запуск Flask-а, компоненты web-сайта прячем поглубже -------------------------------
 app = Flask(__name__,
@@ -34,34 +65,38 @@ app = Flask(__name__,
 app.config.from_object(__name__)
 app.secret_key = 'super secret key'
 app.config['DEBUG'] = config.get_flask_debug()
+app.config['USE_X_SENDFILE'] = config.get_avatar_sendfile() == 'x-sendfile'
 logger.info('Flask started')
-
-
-# --------------------------------------------- логирование итогов загрузки -------------------------------------------
-summary = dict(
-    python=str(python_ver),
-    loglevel=f"{log_level_chr} ({log_level_int})",
-    base_path=os.path.join(os.environ.get('SRC_PATH')),
-    flask_path=app.root_path,
-    templates=app.template_folder,
-    static=f"{app.static_folder}, url_path={app.static_url_path}",
-    registered_routes=len([rout for rout in app.url_map.iter_rules()]),
-    flask_debug=app.debug,
-)
-_ll = 'main parameters:' + ''.join([f'\n\t{k:<25} \t= {v}' for k, v in summary.items()])
-logger.fatal(f'{_ll}')
+_phase('flask')
 
 # --------------------------------------------- инициализация базы данных ---------------------------------------------
 engine, all_db_tables, db_conf = database.init.db_connection(config)      # связываемся с базой
 Session = sessionmaker(bind=engine)  # запоминаем параметры сессии (фабрика сессий session = Session(); session.close())
-
-if len(all_db_tables.metadata.sorted_tables) < 3:       # а не мало ли таблиц, может надо сделать demo-наполнение БД?
+menu_cache.ttl = config.get_menu_cache_ttl()
+user_cache.maxsize, user_cache.ttl = config.get_user_cache_size(), config.get_user_cache_ttl()
+page_cache.max_bytes, page_cache.ttl = config.get_page_cache_mb() * 1024 * 1024, config.get_page_cache_ttl()
+search_cache.maxsize, search_cache.ttl = config.get_search_cache_size(), config.get_search_cache_ttl()
+set_avatar_store(make_avatar_store(config))
+password_hasher = PasswordHasher(**config.get_hashing(), log_format=log_format)   # pbkdf2 - в отдельных процессах
+request_timer = RequestTimer(config.get_timing_threshold_ms(), config.get_timing())
+request_timer.init_app(app, engine)                         # время запросов по роутам и /metrics
+query_monitor = QueryMonitor(**config.get_sql_monitor())
+query_monitor.init_app(app, engine)                         # запросы к БД: сколько, медленные, N+1
+if config.get_profiler():                                   # выключен - приложение не оборачиваем совсем
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, **config.get_profiler())
+config_reloader = ConfigReloader(config)                    # запускается в main.py - в процессах, обслуживающих запросы
+_phase('database')
+
+if database.init.missing_tables(engine):                # нет основных таблиц - надо сделать demo-наполнение БД
     conn = engine.connect()                             # присоединяемся к базе через коннект
     database.init.upload_demo(engine, all_db_tables, conn)
     conn.close()
+set_unique_indexes(database.init.upgrade_schema(engine))   # новые колонки и индексы; без уникальных - дубли ловит SELECT
+_phase('schema')
 
 # --------------------------------------------- регистрация blueprint-ов ----------------------------------------------
-from app.site.blueprint import blueprint_pages
+from app.site.blueprint import blueprint_pages       # роуты сайта берут config из app_init - импорт только здесь
+from app.site.user_login import UserLogin
 from app.api.v1.blueprint import blueprint_v1
 app.register_blueprint(blueprint_pages)
 app.register_blueprint(blueprint_v1, url_prefix='/api/v1')
@@ -71,6 +106,25 @@ login_manager = LoginManager(app)
 login_manager.login_view = 'pages.login'
 login_manager.login_message = "Авторизуйтесь для доступа к закрытым страницам"
 login_manager.login_message_category = "success"
+_phase('blueprints')
+
+# --------------------------------------------- логирование итогов загрузки -------------------------------------------
+summary = dict(
+    python=str(python_ver),
+    loglevel=f"{log_level_chr} ({log_level_int})",
+    base_path=os.path.join(os.environ.get('SRC_PATH')),
+    flask_path=app.root_path,
+    templates=app.template_folder,
+    static=f"{app.static_folder}, url_path={app.static_url_path}",
+    registered_routes=len([rout for rout in app.url_map.iter_rules()]),
+    flask_debug=app.debug,
+    startup=f"{sum(startup.values()):.0f} ms: " + ', '.join(f'{k} {v:.0f}' for k, v in startup.items()),
+)
+if resource is not None:
+    summary['max_rss'] = f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} Mb"
+
+_ll = 'main parameters:' + ''.join([f'\n\t{k:<25} \t= {v}' for k, v in summary.items()])
+logger.fatal(f'{_ll}')
 
 
 # --------------------------------------------------------------------------------------------------------------
@@ -78,14 +132,15 @@ login_manager.login_message_category = "success"
 # --------------------------------------------------------------------------------------------------------------
 @login_manager.user_loader
 def load_user(user_id):
-    logger.debug(f"Loading user id={user_id}")
-    return UserLogin().fromDB(user_id, g.dbase)
+    logger.debug("Loading user id=%s", user_id)
+    return UserLogin().fromDB(user_id, get_dbase())
 
 
 def connect_db():
     """Создаем соединение с базой"""
     conn = engine.connect()
-    logger.debug(f"DB connection created, valid is {conn.connection.is_valid}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("DB connection created, valid is %s", conn.connection.is_valid)
     return conn
 
 
@@ -93,14 +148,26 @@ def get_db():
     """Соединение с БД, если оно еще не установлено"""
     if not hasattr(g, 'link_db'):
         g.link_db = connect_db()
+        metrics.requests_with_db.inc()
     return g.link_db
 
 
+def get_dbase():
+    """FDataBase запроса на ленивом соединении: из пула соединение возьмёт только первый запрос к базе"""
+    if 'dbase' not in g:
+        g.dbase = FDataBase(LazyConnection(get_db, engine.dialect.name))
+    return g.dbase
+
+
 @app.before_request
 def before_request():
-    """Установление соединения с БД перед выполнением запроса"""
-    db = get_db()
-    g.dbase = FDataBase(db)
+    """Подготовка доступа к БД перед выполнением запроса.
+        Статика и /metrics базу не трогают, а api работает через свои сессии Session().
+    """
+    if request.endpoint in ('static', 'metrics') or request.blueprint == 'api_v1':
+        return
+    metrics.requests_total.inc()
+    get_dbase()
 
 
 @app.teardown_appcontext
@@ -110,5 +177,46 @@ def close_db(error):
         g.link_db.close()
 
 
+# --------------------------------------------------------------------------------------------------------------
+# ПРИМЕНЕНИЕ ПЕРЕЧИТАННОГО КОНФИГА
+# --------------------------------------------------------------------------------------------------------------
+RESTART_REQUIRED = {'db.db_schema', 'db.user', 'db.password', 'db.host', 'db.port', 'db.name', 'db.type',
+                    'db.sslmode', 'db.sslrootcert', 'db.sslcert', 'db.sslkey', 'db.mock_users', 'db.mock_posts',
+                    'app.flask_debug', 'app.log_format', 'app.avatars', 'app.hashing', 'app.profiler'}
+POOL_SETTINGS = {'db.minconn', 'db.maxconn', 'db.pool_timeout', 'db.pool_recycle', 'db.pool_pre_ping'}
+
+
+@config_reloader.on_reload
+def apply_settings(config, changed):
+    """Применить на ходу то, что можно: уровень лога, пул соединений, кэши, пороги замеров и логирования"""
+    if 'app.loglevel' in changed:
+        logging.getLogger().setLevel(config.get_loglevel())
+
+    if changed & POOL_SETTINGS:
+        minconn, maxconn = config.get_db_minconn(), config.get_db_maxconn()
+        engine.pool.resize(minconn, max(maxconn - minconn, 0), timeout=config.get_db_pool_timeout(),
+                           recycle=config.get_db_pool_recycle(), pre_ping=config.get_db_pool_pre_ping())
+
+    from app.api.v1.users_count import count_cache     # api импортирует app_init - только здесь
+    menu_cache.ttl = config.get_menu_cache_ttl()
+    user_cache.maxsize, user_cache.ttl = config.get_user_cache_size(), config.get_user_cache_ttl()
+    page_cache.max_bytes, page_cache.ttl = config.get_page_cache_mb() * 1024 * 1024, config.get_page_cache_ttl()
+    search_cache.maxsize, search_cache.ttl = config.get_search_cache_size(), config.get_search_cache_ttl()
+    count_cache.ttl = config.get_users_count_ttl()
+
+    request_timer.threshold_ms, request_timer.level = config.get_timing_threshold_ms(), config.get_timing()
+    for name, value in config.get_sql_monitor().items():
+        setattr(query_monitor, name, value)
+    logs = config.get_logging()
+    log_pipeline.handler.max_length = logs['max_length']
+    log_pipeline.sampler.default, log_pipeline.sampler.routes = logs['access_sample'], dict(logs['routes'])
+
+    restart = changed & RESTART_REQUIRED
+    if 'app.logging' in changed and logs['queue_size'] != log_pipeline.queue_size:
+        restart.add('app.logging.queue_size')
+    if restart:
+        logger.warning(f'Config changes applied only after restart: {", ".join(sorted(restart))}')
+
+
 if __name__ == "__main__":
     pass
@@ -26,6 +26,11 @@ class DatabaseConfig(BaseModel):
     sslrootcert: FilePath = ''                              # путь существует и является файлом
     sslcert: FilePath = ''
     sslkey: FilePath = ''
+    pool_pre_ping: bool = True                              # проверять соединение перед выдачей из пула
+    pool_recycle: Annotated[int, Field(ge=-1, le=86400)] = 1800     # пересоздавать соединения старше N сек, -1 никогда
+    pool_timeout: Annotated[int, Field(ge=1, le=600)] = 30  # сколько ждать свободного соединения, сек
+    mock_users: Annotated[int, Field(ge=0, le=10000000)] = 1000     # для type: mock - сколько синтетических юзеров
+    mock_posts: Annotated[int, Field(ge=0, le=1000000)] = 200       # и статей залить в базу в памяти
 
 
 class Server(BaseModel):
@@ -33,7 +38,59 @@ class Server(BaseModel):
     # все параметры необязательные
     host: IPvAnyAddress = None
     port: PositiveInt = None
-    numthreads: Annotated[int, Field(ge=1, le=1024)] = 20
+    numthreads: Annotated[int, Field(ge=1, le=1024)] = 20     # потоков в каждом процессе сервера
+    workers: Annotated[int, Field(ge=1, le=256)] = 1         # процессов сервера, > 1 - prefork-режим
+
+
+class Avatars(BaseModel):
+    """ Описание параметра avatars в app[_dev].yml - где хранить картинки аватаров """
+    model_config = ConfigDict(extra='forbid')
+    # все параметры необязательные
+    storage: Literal['db', 'fs'] = 'db'                     # в колонке users.avatar или файлами
+    path: StrictStr = ''                                    # каталог файлового хранилища, по умолчанию SRC_PATH/avatars
+    thumb_size: Annotated[int, Field(ge=0, le=1024)] = 128  # сторона миниатюры, пикс; 0 - без миниатюр
+    sendfile: Literal['none', 'x-sendfile', 'x-accel'] = 'none'     # кто отдаёт файл: сам сервер или фронт (Apache/nginx)
+    x_accel_location: StrictStr = '/avatars/'               # internal-location nginx, смотрящий в path
+
+
+class Hashing(BaseModel):
+    """ Описание параметра hashing в app[_dev].yml - пул процессов для хэширования паролей """
+    model_config = ConfigDict(extra='forbid')
+    # все параметры необязательные
+    workers: Annotated[int, Field(ge=0, le=64)] = 2             # процессов, 0 - хэшировать в потоке запроса
+    max_pending: Annotated[int, Field(ge=1, le=10000)] = 16     # хэшей в работе и в очереди одновременно
+    queue_timeout: Annotated[float, Field(gt=0, le=60)] = 2.0   # ожидание места в очереди, сек, потом 503
+
+
+class SqlMonitor(BaseModel):
+    """ Описание параметра sql в app[_dev].yml - наблюдение за запросами к БД """
+    model_config = ConfigDict(extra='forbid')
+    # все параметры необязательные
+    slow_ms: Annotated[int, Field(ge=0, le=600000)] = 200       # медленный запрос - от N мс, в лог; 0 - не логировать
+    explain: bool = False                                       # к медленным SELECT - план запроса
+    n_plus_one: Annotated[int, Field(ge=0, le=100000)] = 10     # один запрос > N раз за запрос к сайту - в лог; 0 - нет
+    params_max: Annotated[int, Field(ge=0, le=100000)] = 200    # длина параметров запроса в логе, символов
+
+
+class Profiler(BaseModel):
+    """ Описание параметра profiler в app[_dev].yml - профилирование отдельных запросов """
+    model_config = ConfigDict(extra='forbid')
+    # все параметры необязательные
+    sample_rate: Annotated[float, Field(ge=0, le=1)] = 0.0      # доля случайно профилируемых запросов
+    secret: StrictStr = ''                                      # ключ подписи X-Profile; пусто - заголовок не работает
+    token_max_age: Annotated[int, Field(ge=1, le=30 * 86400)] = 3600    # срок годности токена, сек
+    path: StrictStr = ''                                        # каталог профилей, по умолчанию SRC_PATH/profiles
+    max_files: Annotated[int, Field(ge=1, le=100000)] = 100     # хранить последних профилей
+
+
+class Logging(BaseModel):
+    """ Описание параметра logging в app[_dev].yml - очередь записи лога """
+    model_config = ConfigDict(extra='forbid')
+    # все параметры необязательные
+    queue_size: Annotated[int, Field(ge=1, le=1000000)] = 10000     # записей в очереди, сверх - теряются
+    max_length: Annotated[int, Field(ge=0, le=1000000)] = 2000      # сообщение длиннее - обрезается; 0 - не обрезать
+    access_sample: Annotated[float, Field(ge=0, le=1)] = 1.0        # доля строк доступа к роутам, попадающих в лог
+    routes: dict[StrictStr, Annotated[float, Field(ge=0, le=1)]] = {}   # своя доля для роутов: endpoint -> доля
 
 
 class AppConfig(BaseModel):
@@ -43,8 +100,23 @@ class AppConfig(BaseModel):
 
     # все параметры необязательные
     loglevel: LogTypes = 'DEBUG'
-    timing: LogTypes = 'CRITICAL'
+    timing: LogTypes = 'CRITICAL'               # с каким уровнем логировать медленные запросы
+    timing_threshold_ms: Annotated[int, Field(ge=0, le=600000)] = 1000  # медленный запрос - от N мс; 0 - все
     flask_debug: bool = False
     log_format: StrictStr = ''                  # строгое StrictStr вместо str - чтобы избежать приведения типов
     reload_settings_period: Annotated[int, Field(ge=0, le=3600)] = None
     server: Server = None                       # параметр конфига server - это словарь
+    menu_cache_ttl: Annotated[int, Field(ge=0, le=86400)] = 300     # время жизни кэша меню, сек; 0 - без кэша
+    posts_per_page: Annotated[int, Field(ge=1, le=1000)] = 20       # статей на странице главной
+    users_count_ttl: Annotated[int, Field(ge=0, le=3600)] = 0       # кэш точного числа юзеров, сек; 0 - без кэша
+    user_cache_size: Annotated[int, Field(ge=0, le=1000000)] = 10000  # кэш юзеров для flask-login, записей; 0 - без кэша
+    user_cache_ttl: Annotated[int, Field(ge=0, le=3600)] = 60       # и время жизни записи в нём, сек
+    page_cache_mb: Annotated[int, Field(ge=0, le=4096)] = 16        # кэш страниц для анонимов, Мб; 0 - без кэша
+    page_cache_ttl: Annotated[int, Field(ge=1, le=86400)] = 60      # и время жизни страницы в нём, сек
+    search_cache_size: Annotated[int, Field(ge=0, le=1000000)] = 1000  # кэш ответов поиска, запросов; 0 - без кэша
+    search_cache_ttl: Annotated[int, Field(ge=0, le=86400)] = 300   # и время жизни ответа в нём, сек
+    avatars: Avatars = None
+    hashing: Hashing = None
+    sql: SqlMonitor = None
+    profiler: Profiler = None
+    logging: Logging = None
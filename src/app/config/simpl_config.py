@@ -27,13 +27,35 @@ class Config:
         """Получение уровня логирования"""
         return self.app.get('loglevel', 'DEBUG')
 
+    def get_timing(self):
+        """Уровень логирования медленных запросов"""
+        return self.app.get('timing', 'CRITICAL')
+
+    def get_timing_threshold_ms(self):
+        """С какой длительности запрос считается медленным, мс"""
+        return self.app.get('timing_threshold_ms', 1000)
+
+    def get_logging(self):
+        """Параметры очереди лога: queue_size, max_length, access_sample, routes"""
+        conf = dict(queue_size=10000, max_length=2000, access_sample=1.0, routes={})
+        conf.update(self.app.get('logging', {}))
+        return conf
+
+    def get_reload_settings_period(self):
+        """Как часто перечитывать конфиги, сек; 0 - только по сигналу SIGHUP"""
+        return self.app.get('reload_settings_period') or 0
+
     def get_flask_debug(self):
         """В каком режиме запустить flask-приложение"""
         return self.app.get('flask_debug', False)
 
     def get_threads(self):
-        """Получение количества разрешённых потоков"""
-        return self.app.get('server', {}).get('threads', 8)
+        """Получение количества разрешённых потоков (в каждом процессе сервера)"""
+        return self.app.get('server', {}).get('numthreads', 20)
+
+    def get_workers(self):
+        """Получение количества процессов сервера"""
+        return self.app.get('server', {}).get('workers', 1)
 
     def get_app_host(self):
         """Получение адреса хоста приложения"""
@@ -43,7 +65,97 @@ class Config:
         """Получение номера порта, который слушает приложение"""
         return self.app.get('server', {}).get('port', 5050)
 
+    def get_menu_cache_ttl(self):
+        """Время жизни кэша главного меню, сек"""
+        return self.app.get('menu_cache_ttl', 300)
+
+    def get_posts_per_page(self):
+        """Сколько статей показывать на странице главной"""
+        return self.app.get('posts_per_page', 20)
+
+    def get_users_count_ttl(self):
+        """Время жизни кэша точного количества юзеров, сек"""
+        return self.app.get('users_count_ttl', 0)
+
+    def get_user_cache_size(self):
+        """Размер кэша юзеров для flask-login, записей"""
+        return self.app.get('user_cache_size', 10000)
+
+    def get_user_cache_ttl(self):
+        """Время жизни записи кэша юзеров, сек"""
+        return self.app.get('user_cache_ttl', 60)
+
+    def get_page_cache_mb(self):
+        """Размер кэша страниц для анонимов, Мб"""
+        return self.app.get('page_cache_mb', 16)
+
+    def get_page_cache_ttl(self):
+        """Время жизни страницы в кэше, сек"""
+        return self.app.get('page_cache_ttl', 60)
+
+    def get_search_cache_size(self):
+        """Размер кэша ответов поиска статей, запросов"""
+        return self.app.get('search_cache_size', 1000)
+
+    def get_search_cache_ttl(self):
+        """Время жизни ответа поиска в кэше, сек"""
+        return self.app.get('search_cache_ttl', 300)
+
+    def get_hashing(self):
+        """Параметры пула хэширования паролей: workers, max_pending, queue_timeout"""
+        hashing = dict(workers=2, max_pending=16, queue_timeout=2.0)
+        hashing.update(self.app.get('hashing', {}))
+        return hashing
+
+    def get_sql_monitor(self):
+        """Параметры наблюдения за запросами к БД: slow_ms, explain, n_plus_one, params_max"""
+        sql = dict(slow_ms=200, explain=False, n_plus_one=10, params_max=200)
+        sql.update(self.app.get('sql', {}))
+        return sql
+
+    def get_profiler(self):
+        """Параметры профилировщика запросов; None - профилировщик выключен"""
+        profiler = self.app.get('profiler') or {}
+        if not profiler.get('sample_rate') and not profiler.get('secret'):
+            return None
+        conf = dict(sample_rate=0.0, secret='', token_max_age=3600, max_files=100)
+        conf.update(profiler)
+        conf['spool'] = conf.pop('path', '') or os.path.join(os.environ.get('SRC_PATH'), 'profiles')
+        return conf
+
+    def get_avatar_storage(self):
+        """Где хранить аватары: db - в БД, fs - файлами"""
+        return self.app.get('avatars', {}).get('storage', 'db')
+
+    def get_avatar_path(self):
+        """Каталог файлового хранилища аватаров"""
+        return self.app.get('avatars', {}).get('path') or os.path.join(os.environ.get('SRC_PATH'), 'avatars')
+
+    def get_avatar_thumb_size(self):
+        """Сторона миниатюры аватара, пикселей"""
+        return self.app.get('avatars', {}).get('thumb_size', 128)
+
+    def get_avatar_sendfile(self):
+        """Кто отдаёт файлы аватаров: none - сам сервер, x-sendfile/x-accel - фронтовой веб-сервер"""
+        return self.app.get('avatars', {}).get('sendfile', 'none')
+
+    def get_avatar_x_accel_location(self):
+        """internal-location nginx для X-Accel-Redirect"""
+        return self.app.get('avatars', {}).get('x_accel_location', '/avatars/')
+
     # ----------------------------------- функции выдачи параметров базы ----------------------------------------------
+    def get_db_type(self):
+        """Тип БД: postgresql или mock (SQLite в памяти процесса)"""
+        return self.db.get('type', 'postgresql').lower()
+
+    def get_db_mock_users(self):
+        """Сколько синтетических юзеров залить в mock-базу"""
+        return self.db.get('mock_users', 1000)
+
+    def get_db_mock_posts(self):
+        """Сколько синтетических статей залить в mock-базу"""
+        return self.db.get('mock_posts', 200)
+
     def get_db_host(self):
         """Получение хоста БД"""
         return self.db.get('host', '127.0.0.1')
@@ -68,8 +180,36 @@ class Config:
         """Получение пароля БД"""
         return self.db.get('password', 'qRjCuQhx87Nb')
 
+    def get_db_minconn(self):
+        """Сколько соединений пул держит открытыми постоянно"""
+        return self.db.get('minconn', 5)
+
+    def get_db_maxconn(self):
+        """Максимум одновременно открытых соединений пула"""
+        return self.db.get('maxconn', 40)
+
+    def get_db_sslmode(self):
+        """Режим SSL соединения с БД"""
+        return self.db.get('sslmode', 'disable')
+
+    def get_db_ssl_files(self):
+        """Пути к сертификатам и ключу SSL, только заданные"""
+        return {k: self.db[k] for k in ('sslrootcert', 'sslcert', 'sslkey') if self.db.get(k)}
+
+    def get_db_pool_pre_ping(self):
+        """Проверять ли соединение перед выдачей из пула"""
+        return self.db.get('pool_pre_ping', True)
+
+    def get_db_pool_recycle(self):
+        """Через сколько секунд пересоздавать соединение пула"""
+        return self.db.get('pool_recycle', 1800)
+
+    def get_db_pool_timeout(self):
+        """Сколько секунд ждать свободного соединения пула"""
+        return self.db.get('pool_timeout', 30)
+
     # ----------------------------------- внутренние сервисные функции класса -----------------------------------------
-    def fs_load_db(self):
+    def fs_load_db(self, verbose=True):
         """ Читаем из файла настройки базы
             Если есть конфиг разработчика, продуктовый конфиг игнорируется
         """
@@ -78,7 +218,8 @@ class Config:
             db_yaml_path = os.path.join(os.environ.get('SRC_PATH'), 'config', 'db.yml')
             if not os.path.isfile(db_yaml_path):
                 raise FileNotFoundError(f'DB config not found: {db_yaml_path}')
-        logger.fatal(db_yaml_path.split("\\")[-1] + ' found and will be used for database connect')
+        if verbose:
+            logger.fatal(db_yaml_path.split("\\")[-1] + ' found and will be used for database connect')
 
         with open(db_yaml_path) as f:  # создаём конфиг-словарь базы
             db_dict = yaml.safe_load(f).get('db')
@@ -86,7 +227,7 @@ class Config:
 
         return db_dict
 
-    def fs_load_app(self):
+    def fs_load_app(self, verbose=True):
         """ Читаем из файла настройки приложения
             Если есть конфиг разработчика, продуктовый конфиг игнорируется
         """
@@ -95,7 +236,8 @@ class Config:
             app_yaml_path = os.path.join(os.environ.get('SRC_PATH'), 'config', 'app.yml')
             if not os.path.isfile(app_yaml_path):
                 raise FileNotFoundError(f'APP config not found: {app_yaml_path}')
-        logger.fatal(app_yaml_path.split("\\")[-1] + ' found and will be used for web-application')
+        if verbose:
+            logger.fatal(app_yaml_path.split("\\")[-1] + ' found and will be used for web-application')
 
         with open(app_yaml_path) as f:  # создаём конфиг-словарь приложения
             app_dict = yaml.safe_load(f).get('app')
@@ -110,7 +252,7 @@ class Config:
         return settings
 
     def check_settings(self):
-        """Проверка конфигов Пидантиком-бантиком"""
+        """Проверка конфигов Пидантиком-бантиком при старте: с негодным конфигом не запускаемся"""
         try:
             _db_cfg = DatabaseConfig(**self.db)
         except ValidationError as e:
@@ -126,3 +268,24 @@ class Config:
             exit(-4)
         else:
             logger.fatal(f'App config checked... ok')
+
+    def reload(self):
+        """ Перечитать конфиги на ходу. Негодный конфиг (не читается, не проходит проверку) отвергается целиком,
+            работаем дальше со старым.
+            :return: множество изменившихся параметров верхнего уровня ('db.maxconn', 'app.loglevel', ...)
+                     или None, если конфиг отвергнут
+        """
+        try:
+            db = self.fs_load_db(verbose=False)
+            app = self.fs_load_app(verbose=False)
+            app.update(self.db_load_app())
+            DatabaseConfig(**db)
+            AppConfig(**app)
+        except (OSError, ValueError, yaml.YAMLError) as e:     # ValidationError пидантика - тоже ValueError
+            logger.error(f'Config reload rejected, keeping the current one:\n{e}')
+            return None
+
+        changed = {f'db.{k}' for k in db.keys() | self.db.keys() if db.get(k) != self.db.get(k)}
+        changed |= {f'app.{k}' for k in app.keys() | self.app.keys() if app.get(k) != self.app.get(k)}
+        self.db, self.app = db, app     # подмена целиком - потоки видят либо старый конфиг, либо новый
+        return changed
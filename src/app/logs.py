@@ -0,0 +1,104 @@
+"""
+    Логирование через очередь: потоки сервера только кладут запись в очередь и сразу идут дальше,
+    а в stderr её пишет отдельный поток (QueueListener). Под нагрузкой потоки больше не выстраиваются
+    в очередь на блокировке обработчика и на медленной записи в stderr.
+    Длинные сообщения (ответы api и т.п.) обрезаются до max_length символов ещё в потоке запроса.
+    Строки доступа к роутам (extra=access(endpoint)) можно прореживать: access_sample - доля для всех роутов,
+    routes - своя доля для отдельных роутов. Предупреждения и ошибки не прореживаются никогда.
+    Если очередь переполнена, запись теряется, а не тормозит запрос; потери считает metrics.log_dropped.
+"""
+import sys
+import copy
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from app import metrics
+
+ROUTE_ATTR = 'route'        # атрибут записи лога: это строка доступа к роуту с таким endpoint
+
+
+def access(endpoint):
+    """extra для строки доступа: logger.info('...', extra=access(request.endpoint))"""
+    return {ROUTE_ATTR: endpoint}
+
+
+class AccessSampler(logging.Filter):
+    """ Прореживание строк доступа по роутам; настройки можно менять на лету """
+    def __init__(self, default=1.0, routes=None):
+        super().__init__()
+        self.default = default
+        self.routes = dict(routes or {})
+
+    def filter(self, record):
+        route = getattr(record, ROUTE_ATTR, None)
+        if route is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.routes.get(route, self.default)
+        return rate >= 1 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """ Кладёт запись в очередь без ожидания; сообщение собирается (и обрезается) здесь,
+        а форматирование строки лога и запись в поток - уже в потоке QueueListener
+    """
+    def __init__(self, log_queue, max_length=2000):
+        super().__init__(log_queue)
+        self.max_length = max_length
+
+    def prepare(self, record):
+        message = record.getMessage()
+        if self.max_length and len(message) > self.max_length:
+            message = f'{message[:self.max_length]}... ({len(message) - self.max_length} chars truncated)'
+        record = copy.copy(record)
+        record.msg, record.args = message, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_dropped.inc()
+
+
+class LogPipeline:
+    """ Очередь записей лога и поток, который пишет их в stderr """
+    def __init__(self, level, fmt, queue_size=10000, max_length=2000, access_sample=1.0, routes=None):
+        self.level = level
+        self.formatter = logging.Formatter(fmt)
+        self.queue_size = queue_size
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size), max_length)
+        self.sampler = AccessSampler(access_sample, routes)
+        self.handler.addFilter(self.sampler)
+        self.listener = None
+
+    def start(self):
+        """Подключить очередь к корневому логгеру вместо обычных обработчиков и запустить поток записи"""
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(self.formatter)
+        self.listener = QueueListener(self.handler.queue, stream)
+        self.listener.start()
+        logging.basicConfig(level=self.level, handlers=[self.handler], force=True)
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Дописать всё, что осталось в очереди, и остановить поток записи"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def after_fork(self):
+        """ В процессе после fork потока записи нет, а очередь могла остаться запертой потоком родителя:
+            заводим новую очередь и новый поток
+        """
+        self.listener = None
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.start()
+
+    def stats(self):
+        return dict(queued=self.handler.queue.qsize(), queue_size=self.queue_size, dropped=metrics.log_dropped.value,
+                    max_length=self.handler.max_length, access_sample=self.sampler.default,
+                    routes=self.sampler.routes)
@@ -0,0 +1,175 @@
+import bisect
+import threading
+
+
+class Counter:
+    """ Потокобезопасный счётчик """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Timing:
+    """ Накопленное время этапа: количество, сумма и максимум """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def stats(self):
+        with self._lock:
+            return dict(count=self.count,
+                        avg_ms=round(1000 * self.total / self.count, 3) if self.count else 0.0,
+                        max_ms=round(1000 * self.max, 3))
+
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75,
+           1.0, 2.5, 5.0, 10.0)     # границы корзин, сек
+
+
+class Histogram:
+    """ Гистограмма длительностей по корзинам, как в Prometheus: памяти - константа при любом числе запросов,
+        квантили (p50/p95/p99) оцениваются линейной интерполяцией внутри корзины, но не больше максимума
+    """
+    def __init__(self, buckets=BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # последняя корзина - всё, что больше buckets[-1] (+Inf)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Оценка квантиля q (0..1), сек"""
+        with self._lock:
+            counts, count, top = list(self.counts), self.count, self.max
+        rank, seen = q * count, 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):      # за последней границей корзин - только максимум и известен
+                    return top
+                lower = self.buckets[i - 1] if i else 0.0
+                return min(lower + (self.buckets[i] - lower) * (rank - seen) / n, top)
+            seen += n
+        return top
+
+    def cumulative(self):
+        """Накопленные счётчики по корзинам (le=граница), сумма и количество - для экспорта в Prometheus"""
+        with self._lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        acc, cumulative = 0, []
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            acc += n
+            cumulative.append((bound, acc))
+        return cumulative, total, count
+
+    def stats(self):
+        count, total = self.count, self.total
+        return dict(count=count,
+                    avg_ms=round(1000 * total / count, 3) if count else 0.0,
+                    max_ms=round(1000 * self.max, 3),
+                    p50_ms=round(1000 * self.quantile(0.50), 3),
+                    p95_ms=round(1000 * self.quantile(0.95), 3),
+                    p99_ms=round(1000 * self.quantile(0.99), 3))
+
+
+class RouteMetrics:
+    """ Метрики запросов по роутам (endpoint Flask): гистограммы времени по этапам и ответы по HTTP-статусам
+        wall - весь запрос, db - курсоры БД, render - шаблоны Jinja, serialize - json-ответы
+    """
+    STAGES = ('wall', 'db', 'render', 'serialize')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = dict()      # endpoint -> {этап: Histogram}
+        self._statuses = dict()     # (endpoint, статус) -> Counter
+        self._queries = dict()      # endpoint -> Counter запросов к БД, ведёт app.sql_monitor
+
+    def observe(self, endpoint, status, **stages):
+        timings, counter = self._timings.get(endpoint), self._statuses.get((endpoint, status))
+        if timings is None or counter is None:
+            with self._lock:
+                timings = self._timings.setdefault(endpoint, {stage: Histogram() for stage in self.STAGES})
+                counter = self._statuses.setdefault((endpoint, status), Counter())
+        for stage, seconds in stages.items():
+            timings[stage].observe(seconds)
+        counter.inc()
+
+    def add_queries(self, endpoint, count):
+        counter = self._queries.get(endpoint)
+        if counter is None:
+            with self._lock:
+                counter = self._queries.setdefault(endpoint, Counter())
+        counter.inc(count)
+
+    def stats(self):
+        with self._lock:
+            timings, statuses, queries = dict(self._timings), dict(self._statuses), dict(self._queries)
+        result = {endpoint: {stage: h.stats() for stage, h in stages.items()} for endpoint, stages in timings.items()}
+        for (endpoint, status), counter in statuses.items():
+            result[endpoint].setdefault('responses', {})[status] = counter.value
+        for endpoint, counter in queries.items():
+            requests = timings[endpoint]['wall'].count if endpoint in timings else 0
+            result.setdefault(endpoint, {}).update(
+                queries=counter.value, queries_per_request=round(counter.value / requests, 2) if requests else None)
+        return result
+
+    def prometheus(self):
+        """Строки метрик в текстовом формате Prometheus"""
+        with self._lock:
+            timings, statuses, queries = dict(self._timings), dict(self._statuses), dict(self._queries)
+        lines = ['# HELP http_requests_total Responses by route and HTTP status',
+                 '# TYPE http_requests_total counter']
+        for (endpoint, status), counter in sorted(statuses.items()):
+            lines.append(f'http_requests_total{{route="{endpoint}",status="{status}"}} {counter.value}')
+
+        lines += ['# HELP http_request_queries_total Database queries by route',
+                  '# TYPE http_request_queries_total counter']
+        for endpoint, counter in sorted(queries.items()):
+            lines.append(f'http_request_queries_total{{route="{endpoint}"}} {counter.value}')
+
+        lines += ['# HELP http_request_duration_seconds Request time by route and stage',
+                  '# TYPE http_request_duration_seconds histogram']
+        quantiles = ['# HELP http_request_duration_quantile_seconds Estimated p50/p95/p99 of request time',
+                     '# TYPE http_request_duration_quantile_seconds gauge']
+        for endpoint, stages in sorted(timings.items()):
+            for stage, h in stages.items():
+                labels = f'route="{endpoint}",stage="{stage}"'
+                cumulative, total, count = h.cumulative()
+                for bound, acc in cumulative:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{le}"}} {acc}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {count}')
+                for q in (0.5, 0.95, 0.99):
+                    quantiles.append(f'http_request_duration_quantile_seconds{{{labels},quantile="{q}"}} '
+                                     f'{h.quantile(q):.6f}')
+        return lines + quantiles
+
+
+requests_total = Counter()      # запросы, которым готовилось соединение с БД (всё, кроме static и api)
+requests_with_db = Counter()    # из них те, которым соединение действительно понадобилось
+routes = RouteMetrics()         # время и статусы ответов по роутам, ведёт app.timing
+log_dropped = Counter()         # записи лога, потерянные из-за переполненной очереди (app.logs)
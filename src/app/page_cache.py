@@ -0,0 +1,128 @@
+"""
+    Кэш готовых html-страниц для анонимных посетителей.
+    Страница рендерится один раз, дальше отдаются готовые байты, а браузеру, у которого
+    страница уже есть (If-None-Match / If-Modified-Since), - просто 304 Not Modified.
+    Кэш сбрасывается сигналами posts_changed и menu_changed из database.services,
+    а ttl ограничивает устаревание в других процессах (prefork), до которых сигнал не доходит.
+"""
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session, make_response, Response
+from flask_login import current_user
+
+from database.services import posts_changed, menu_changed
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPage:
+    """ Готовая страница """
+    __slots__ = ('body', 'mimetype', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, body, mimetype, ttl):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.md5(body).hexdigest()
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.expires = time.monotonic() + ttl
+
+
+class PageCache:
+    """ LRU-кэш страниц с ограничением по суммарному размеру, max_bytes=0 - кэш выключен """
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._pages = OrderedDict()     # (состояние авторизации, путь с параметрами) -> CachedPage
+        self._bytes = 0
+        self._generation = 0            # растёт при каждом сбросе кэша
+        self._lock = threading.Lock()
+
+    def cached(self, view):
+        """Декоратор роута: GET анонимного посетителя отдаётся из кэша"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._cacheable():
+                return view(*args, **kwargs)
+
+            key = ('anonymous', request.full_path)
+            page = self._get(key)
+            if page is None:
+                self.misses += 1
+                generation = self._generation   # до рендера: сброс во время рендера - страница уже устарела
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or 'Set-Cookie' in response.headers:
+                    return response
+                page = self._put(key, CachedPage(response.get_data(), response.mimetype, self.ttl), generation)
+            else:
+                self.hits += 1
+
+            response = Response(page.body, mimetype=page.mimetype)
+            response.set_etag(page.etag)
+            response.last_modified = page.last_modified
+            response.cache_control.no_cache = True      # хранить можно, но перед показом - сверяться с сервером
+            response.make_conditional(request.environ)
+            if response.status_code == 304:
+                self.not_modified += 1
+            return response
+        return wrapper
+
+    def _cacheable(self):
+        """Кэшируем только GET анонимов без ждущих показа flash-сообщений"""
+        return (self.max_bytes > 0 and request.method == 'GET'
+                and not current_user.is_authenticated and '_flashes' not in session)
+
+    def _get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                return None
+            if page.expires <= time.monotonic():
+                self._drop(key)
+                return None
+            self._pages.move_to_end(key)
+            return page
+
+    def _put(self, key, page, generation):
+        """Положить страницу, если с начала её рендера (generation) кэш не сбрасывали"""
+        size = len(page.body)
+        if size > self.max_bytes:
+            return page
+        with self._lock:
+            if generation != self._generation:
+                return page
+            if key in self._pages:
+                self._drop(key)
+            self._pages[key] = page
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._pages)))
+        return page
+
+    def _drop(self, key):
+        self._bytes -= len(self._pages.pop(key).body)
+
+    def clear(self, sender=None, **kwargs):
+        """Сбросить все страницы; годится и как получатель сигналов"""
+        with self._lock:
+            self._generation += 1
+            self._pages.clear()
+            self._bytes = 0
+        logger.debug('Page cache cleared by %s', sender)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, not_modified=self.not_modified,
+                    pages=len(self._pages), bytes=self._bytes, max_bytes=self.max_bytes, ttl=self.ttl)
+
+
+page_cache = PageCache()        # размер и ttl настраиваются из конфига в app_init
+posts_changed.connect(page_cache.clear)
+menu_changed.connect(page_cache.clear)
@@ -0,0 +1,107 @@
+"""
+    Хэширование и проверка паролей в отдельных процессах.
+    pbkdf2 на 600000 итераций - это сотни миллисекунд чистого CPU под GIL-ом: в потоке cheroot
+    всплеск входов останавливает все остальные роуты. Поэтому считаем в пуле процессов,
+    а очередь к нему ограничиваем: кто не дождался места за queue_timeout - получает PasswordQueueFull (503).
+"""
+import sys
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.metrics import Counter, Timing
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordQueueFull(Exception):
+    """Очередь к пулу хэширования переполнена"""
+
+
+def _init_worker(log_format):
+    """ Процесс пула после fork: очередь лога унаследована от родителя, а поток, который её разбирает, - нет,
+        и её мьютекс мог быть захвачен в момент fork. Корневому логгеру - обычный обработчик stderr вместо очереди
+    """
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter(log_format))
+    logging.getLogger().handlers = [stream]     # без close() старого обработчика: он держит ту самую очередь
+
+
+class PasswordHasher:
+    """ Пул процессов для pbkdf2.
+        workers     - процессов в пуле, 0 - считать в текущем потоке, как раньше
+        max_pending - сколько хэшей одновременно в работе и в очереди
+        queue_timeout - сколько секунд ждать места в очереди
+        log_format  - формат лога в процессах пула
+        Процессы пула - форки, поэтому пул надо запускать start() до старта потоков сервера,
+        пока процесс однопоточный (в prefork-режиме - в каждом рабочем процессе). Иначе пул
+        запустится при первом хэше. Поток записи лога (app.logs) к этому времени уже работает,
+        поэтому в процессах пула лог переключается на обычный обработчик stderr (_init_worker).
+    """
+    def __init__(self, workers=2, max_pending=16, queue_timeout=2.0, log_format=logging.BASIC_FORMAT):
+        self.workers = workers
+        self.log_format = log_format
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.queue_wait = Timing()          # ожидание места в очереди
+        self.hashing = Timing()             # сам хэш, вместе с передачей в процесс и обратно
+        self.rejected = Counter()           # отказы по переполнению очереди
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def start(self):
+        """Запуск пула процессов сразу, а не при первом хэше"""
+        if self.workers:
+            executor = self._executor()
+            for _ in executor.map(abs, range(self.workers)):     # прогрев - форкнуть все процессы прямо сейчас
+                pass
+
+    def _executor(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # fork, а не spawn: spawn заново импортирует main.py, а с ним - всё приложение
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('fork'),
+                                                     initializer=_init_worker, initargs=(self.log_format,))
+                    logger.info(f'Password hashing pool started, {self.workers} processes')
+        return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected.inc()
+            raise PasswordQueueFull(f'{self.max_pending} password hashes already pending')
+        queued = time.perf_counter()
+        self.queue_wait.add(queued - started)
+        try:
+            return self._executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+            self.hashing.add(time.perf_counter() - queued)
+
+    def generate(self, password):
+        """Хэш пароля для записи в users.psw"""
+        return self._run(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        """Совпадает ли пароль с хэшем"""
+        return self._run(check_password_hash, pwhash, password)
+
+    def shutdown(self):
+        """Остановить процессы пула и дождаться их: после os._exit рабочего процесса их уже некому остановить"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return dict(workers=self.workers, max_pending=self.max_pending, rejected=self.rejected.value,
+                    queue_wait=self.queue_wait.stats(), hashing=self.hashing.stats())
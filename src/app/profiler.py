@@ -0,0 +1,130 @@
+"""
+    Профилирование отдельных запросов в работающем сервере - чтобы увидеть, на что уходит время
+    внутри Flask, Jinja и Алхимии на медленном роуте.
+    Запрос профилируется, если у него есть заголовок X-Profile с подписанным токеном (python manage.py profile-token),
+    или случайно, с вероятностью sample_rate. Результат - файл pstats на каждый такой запрос в каталоге spool,
+    где хранятся только max_files последних файлов. Смотреть: python -m pstats <файл>, snakeviz, gprof2dot.
+    Выключенный профилировщик (profiler в app.yml не задан) приложение не оборачивает вовсе.
+"""
+import os
+import re
+import time
+import random
+import cProfile
+import logging
+import threading
+
+from itsdangerous import TimestampSigner, BadSignature
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_X_PROFILE'       # заголовок X-Profile в окружении WSGI
+SALT = 'request-profiler'
+TOKEN_VALUE = 'profile'
+
+
+def make_token(secret):
+    """Подписанный токен для заголовка X-Profile; срок годности проверяет сервер (token_max_age)"""
+    return TimestampSigner(secret, salt=SALT).sign(TOKEN_VALUE).decode()
+
+
+class ProfilerMiddleware:
+    """ WSGI-обёртка вокруг приложения. Одновременно профилируется не больше одного запроса:
+        профилировщик сам замедляет запрос в разы, а остальные запросы в это время идут как обычно.
+    """
+    def __init__(self, wsgi_app, spool, sample_rate=0.0, secret='', token_max_age=3600, max_files=100):
+        self.wsgi_app = wsgi_app
+        self.spool = spool
+        self.sample_rate = sample_rate
+        self.signer = TimestampSigner(secret, salt=SALT) if secret else None
+        self.token_max_age = token_max_age
+        self.max_files = max_files
+        self._busy = threading.Lock()
+        os.makedirs(spool, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        if not self._wanted(environ) or not self._busy.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        profile = ProfiledRequest(self, environ)
+        try:
+            body = profile.run(self.wsgi_app, environ, start_response)
+        except BaseException:
+            profile.finish()
+            raise
+        return ProfiledBody(body, profile)
+
+    def _wanted(self, environ):
+        token = environ.get(HEADER)
+        if token is not None and self.signer is not None:
+            try:
+                return self.signer.unsign(token, max_age=self.token_max_age) == TOKEN_VALUE.encode()
+            except BadSignature:
+                logger.warning(f'Bad or expired X-Profile token from {environ.get("REMOTE_ADDR")}')
+                return False
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def save(self, profiler, environ, elapsed):
+        """Записать профиль в spool и удалить самые старые файлы сверх max_files"""
+        path = re.sub(r'[^A-Za-z0-9_.-]+', '_', environ.get('PATH_INFO', '/')).strip('_')[:80] or 'root'
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{environ.get("REQUEST_METHOD")}-{path}' \
+               f'-{1000 * elapsed:.0f}ms.prof'
+        try:
+            profiler.dump_stats(os.path.join(self.spool, name))
+            files = sorted((entry for entry in os.scandir(self.spool) if entry.name.endswith('.prof')),
+                           key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:max(len(files) - self.max_files, 0)]:
+                os.remove(entry.path)
+        except OSError as e:
+            logger.error(f'Profile {name} not saved: {e}')
+            return
+        logger.info(f'Request profiled: {name}')
+
+
+class ProfiledRequest:
+    """ Профиль одного запроса: и вызов приложения, и отдачу тела ответа (для потоковых ответов это основное) """
+    def __init__(self, middleware, environ):
+        self.middleware = middleware
+        self.environ = environ
+        self.profiler = cProfile.Profile()
+        self.elapsed = 0.0
+        self.done = False
+
+    def run(self, func, *args):
+        start = time.perf_counter()
+        self.profiler.enable()
+        try:
+            return func(*args)
+        finally:
+            self.profiler.disable()
+            self.elapsed += time.perf_counter() - start
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        try:
+            self.middleware.save(self.profiler, self.environ, self.elapsed)
+        finally:
+            self.middleware._busy.release()
+
+
+class ProfiledBody:
+    """ Тело ответа: каждый кусок вычисляется под профилировщиком, профиль сохраняется в close() """
+    def __init__(self, body, profile):
+        self.body = body
+        self.profile = profile
+        self.chunks = iter(body)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.profile.run(next, self.chunks)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.profile.run(self.body.close)
+        finally:
+            self.profile.finish()
@@ -0,0 +1,77 @@
+"""
+    Перечитывание конфигов на ходу, без перезапуска сервера и без остывания кэшей.
+    Фоновый поток раз в reload_settings_period секунд (или сразу по сигналу SIGHUP) перечитывает app.yml и db.yml,
+    проверяет их теми же моделями пидантика, что и при старте, и отдаёт изменившиеся параметры обработчикам
+    (on_reload), которые применяют то, что можно применить на ходу. Негодный конфиг отвергается целиком.
+"""
+import signal
+import logging
+import threading
+
+from app.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigReloader:
+    """ Поток перечитывания конфига; запускается в каждом процессе, который обслуживает запросы """
+    def __init__(self, config):
+        self.config = config
+        self.handlers = []                  # обработчики handler(config, changed)
+        self.reloads = Counter()            # принятые перечитывания с изменениями
+        self.rejected = Counter()           # отвергнутые
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def on_reload(self, handler):
+        """Добавить обработчик изменений; годится и как декоратор"""
+        self.handlers.append(handler)
+        return handler
+
+    def start(self, sighup=True):
+        """Запустить поток; SIGHUP можно поставить только из главного потока процесса"""
+        if sighup and hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.wakeup)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='ConfigReloader', daemon=True)
+        self._thread.start()
+        logger.info(f'Config reloader started, period={self.config.get_reload_settings_period() or "SIGHUP only"}')
+
+    def wakeup(self, signum=None, frame=None):
+        """Перечитать конфиг сейчас, не дожидаясь периода (это и обработчик SIGHUP)"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.config.get_reload_settings_period() or None)    # период - тоже из конфига
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            self.reload()
+
+    def reload(self):
+        """Перечитать конфиг и применить изменения; :return: изменившиеся параметры или None, если конфиг отвергнут"""
+        changed = self.config.reload()
+        if changed is None:
+            self.rejected.inc()
+            return None
+        if not changed:
+            return changed
+
+        self.reloads.inc()
+        logger.warning(f'Config reloaded, changed: {", ".join(sorted(changed))}')
+        for handler in self.handlers:
+            try:
+                handler(self.config, changed)
+            except Exception:
+                logger.exception(f'Config change not applied by {handler.__name__}')
+        return changed
+
+    def stats(self):
+        return dict(period=self.config.get_reload_settings_period(), reloads=self.reloads.value,
+                    rejected=self.rejected.value)
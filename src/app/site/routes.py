@@ -1,28 +1,33 @@
+import os
 import logging
-from flask import render_template, g, request, flash, abort, redirect, url_for, make_response
+from flask import render_template, g, request, flash, abort, redirect, url_for, make_response, send_file
 
 from flask_login import login_required, current_user, login_user, logout_user
-from werkzeug.security import check_password_hash, generate_password_hash
 
 from app.site.blueprint import blueprint_pages
 from app.site.forms import LoginForm, RegisterForm
 from app.site.user_login import UserLogin
+from app.app_init import config, password_hasher
+from app.passwords import PasswordQueueFull
+from app.page_cache import page_cache
 
 logger = logging.getLogger(__name__)
 
 
 @blueprint_pages.route('/')
+@page_cache.cached
 def index():
     """Роут Главной страницы"""
-    logger.debug(f'{index.__doc__} started...')
-    return render_template('index.html', menu=g.dbase.getMenu(), posts=g.dbase.getPostsAnonce())
+    logger.debug('%s started...', index.__doc__)
+    posts, next_page = g.dbase.getPostsAnonce(request.args.get('after'), config.get_posts_per_page())
+    return render_template('index.html', menu=g.dbase.getMenu(), posts=posts, next_page=next_page)
 
 
 @blueprint_pages.route("/add_post", methods=["POST", "GET"])
 @login_required
 def addPost():
     """Добавление статьи"""
-    logger.debug(f'{addPost.__doc__} started...')
+    logger.debug('%s started...', addPost.__doc__)
     if request.method == "POST":
         if len(request.form['name']) > 4 and len(request.form['post']) > 10:
             res = g.dbase.addPost(request.form['name'], request.form['post'], request.form['url'])
@@ -40,7 +45,7 @@ def addPost():
 @login_required
 def showPost(alias):
     """Показать статью"""
-    logger.debug(f'{showPost.__doc__} started...')
+    logger.debug('%s started...', showPost.__doc__)
     title, post = g.dbase.getPost(alias)
     if not title:
         abort(404)
@@ -48,17 +53,26 @@ def showPost(alias):
     return render_template('post.html', menu=g.dbase.getMenu(), title=title, post=post)
 
 
+@blueprint_pages.route('/search')
+def search():
+    """Поиск статей"""
+    logger.debug('%s started...', search.__doc__)
+    q = request.args.get('q', '').strip()
+    found = g.dbase.searchPosts(q, request.args.get('page', 1, type=int)) if q else None
+    return render_template('search.html', menu=g.dbase.getMenu(), title="Поиск", q=q, found=found)
+
+
 @blueprint_pages.route("/login", methods=["POST", "GET"])
 def login():
     """Авторизация"""
-    logger.debug(f'{login.__doc__} started...')
+    logger.debug('%s started...', login.__doc__)
     if current_user.is_authenticated:
         return redirect(url_for('pages.profile'))
 
     form = LoginForm()
     if form.validate_on_submit():
         user = g.dbase.getUserByEmail(form.email.data)
-        if user and check_password_hash(user['psw'], form.psw.data):
+        if user and _hashing(password_hasher.check, user['psw'], form.psw.data):
             userlogin = UserLogin().create(user)
             rm = form.remember.data
             login_user(userlogin, remember=rm)
@@ -69,11 +83,20 @@ def login():
     return render_template("login.html", menu=g.dbase.getMenu(), title="Авторизация", form=form)
 
 
+def _hashing(func, *args):
+    """Хэширование через пул процессов; если очередь к нему переполнена - 503, пусть клиент повторит позже"""
+    try:
+        return func(*args)
+    except PasswordQueueFull as e:
+        logger.warning('Password hashing rejected: %s', e)
+        abort(make_response("Сервер перегружен, повторите попытку позже", 503, {'Retry-After': '1'}))
+
+
 @blueprint_pages.route('/logout')
 @login_required
 def logout():
     """Выход из профиля"""
-    logger.debug(f'{logout.__doc__} started...')
+    logger.debug('%s started...', logout.__doc__)
     logout_user()
     flash("Вы вышли из аккаунта", "success")
     return redirect(url_for('pages.login'))
@@ -82,10 +105,10 @@ def logout():
 @blueprint_pages.route("/register", methods=["POST", "GET"])
 def register():
     """Страница регистрации"""
-    logger.debug(f'{register.__doc__} started...')
+    logger.debug('%s started...', register.__doc__)
     form = RegisterForm()
     if form.validate_on_submit():
-            hash = generate_password_hash(request.form['psw'])
+            hash = _hashing(password_hasher.generate, request.form['psw'])
             res = g.dbase.addUser(form.name.data, form.email.data, hash)
             if res:
                 flash("Вы успешно зарегистрированы", "success")
@@ -100,7 +123,7 @@ def register():
 @login_required
 def profile():
     """Страница профиля"""
-    logger.debug(f'{profile.__doc__} started...')
+    logger.debug('%s started...', profile.__doc__)
     return render_template("profile.html", menu=g.dbase.getMenu(), title="Профиль")
 
 
@@ -108,21 +131,44 @@ def profile():
 @login_required
 def userava():
     """Загрузка аватара"""
-    logger.debug(f'{userava.__doc__} started...')
-    img = current_user.getAvatar()
-    if not img:
-        return ""
-
-    h = make_response(img)
-    h.headers['Content-Type'] = 'image/png'
+    logger.debug('%s started...', userava.__doc__)
+    etag = current_user.getAvatarTag()
+    if etag in request.if_none_match:               # картинка у браузера уже есть - в базу за ней не ходим
+        h = make_response('', 304)
+    elif etag != 'default' and (path := g.dbase.getAvatarFile(etag)):
+        h = _send_avatar_file(path)
+    else:
+        img = current_user.getAvatar(g.dbase)
+        if not img:
+            return ""
+        h = make_response(img)
+        h.headers['Content-Type'] = 'image/png'
+
+    h.set_etag(etag)
+    h.cache_control.private = True                  # аватар свой у каждого юзера, общим кэшам его не отдаём
+    h.cache_control.no_cache = True                 # браузер хранит, но каждый раз сверяет ETag
     return h
 
 
+def _send_avatar_file(path):
+    """ Отдача файла аватара. Саму отдачу (sendfile без копирования через Питон) можно поручить фронтовому
+        веб-серверу: Apache/lighttpd - заголовком X-Sendfile, nginx - X-Accel-Redirect.
+    """
+    sendfile = config.get_avatar_sendfile()
+    if sendfile == 'x-accel':
+        h = make_response('')
+        h.headers['Content-Type'] = 'image/png'
+        rel_path = os.path.relpath(path, config.get_avatar_path()).replace(os.sep, '/')
+        h.headers['X-Accel-Redirect'] = config.get_avatar_x_accel_location().rstrip('/') + '/' + rel_path
+        return h
+    return send_file(path, mimetype='image/png', conditional=False, etag=False)
+
+
 @blueprint_pages.route("/upload", methods=["POST", "GET"])
 @login_required
 def upload():
     """Обновление аватара"""
-    logger.debug(f'{upload.__doc__} started...')
+    logger.debug('%s started...', upload.__doc__)
     if request.method == 'POST':
         file = request.files['file']
         if file and current_user.verifyExt(file.filename):
@@ -140,7 +186,8 @@ def upload():
     return redirect(url_for('pages.profile'))
 
 @blueprint_pages.route('/donate')
+@page_cache.cached
 def donate():
     """Собрать денюжку"""
-    logger.debug(f'{donate.__doc__} started...')
+    logger.debug('%s started...', donate.__doc__)
     return render_template("donate.html", menu=g.dbase.getMenu(), title="Пода-а-айте бедномуслепомукотуБазилио.")
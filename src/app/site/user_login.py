@@ -23,19 +23,26 @@ class UserLogin(UserMixin):
     def getEmail(self):
         return self.__user['email'] if self.__user else "Без email"
 
-    def getAvatar(self):
-        """Чтение аватара из файла"""
-        logger.debug(f"Чтение аватара из файла...")
+    def getAvatarTag(self):
+        """ETag аватара: хэш картинки, а для аватара по умолчанию - 'default'. Саму картинку не читает."""
+        if isinstance(self.__user, bool) or not self.__user['avatar_hash']:
+            return 'default'
+        return self.__user['avatar_hash']
+
+    def getAvatar(self, db):
+        """Чтение аватара из БД, а если его нет - из файла по умолчанию"""
+        logger.debug("Чтение аватара...")
         img = None
 
-        if isinstance(self.__user, bool) or not self.__user['avatar']:
+        if self.getAvatarTag() != 'default':
+            img = db.getAvatar(self.__user['id'])
+
+        if not img:
             try:
                 with open(os.path.join(os.environ.get('APP_PATH'), 'site', 'static', 'images', 'default.png'), "rb") as f:
                     img = f.read()
             except FileNotFoundError as e:
-                logger.error(f"Не найден аватар по умолчанию: {str(e)}")
-        else:
-            img = self.__user['avatar']
+                logger.error("Не найден аватар по умолчанию: %s", e)
 
         return img
 
@@ -0,0 +1,111 @@
+"""
+    Наблюдение за SQL-запросами через события движка Алхимии.
+    Каждый запрос к базе приписывается текущему запросу к сайту: сколько их было и какие повторялись.
+    Медленные запросы (от slow_ms) пишутся в лог с параметрами и, если включено, с планом EXPLAIN.
+    Один и тот же запрос (одинаковый текст SQL, разные параметры) больше n_plus_one раз за запрос к сайту -
+    это похоже на N+1 (запрос в цикле вместо одного общего), о таком - предупреждение.
+"""
+import time
+import logging
+from collections import Counter
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_PARAMS = ('psw', 'password')     # такие параметры в лог не пишем
+EXPLAIN_SAVEPOINT = 'query_monitor_explain'
+
+
+class QueryMonitor:
+    """ Подключается к приложению и к движку БД через init_app; настройки можно менять на лету """
+    def __init__(self, slow_ms=200, explain=False, n_plus_one=10, params_max=200):
+        self.slow_ms = slow_ms              # медленный запрос - от N мс; 0 - не логировать
+        self.explain = explain              # к медленным SELECT дописывать план запроса
+        self.n_plus_one = n_plus_one        # предупреждать, если запрос повторился больше N раз; 0 - не следить
+        self.params_max = params_max        # параметры в логе обрезаем до N символов
+
+    def init_app(self, app, engine):
+        event.listen(engine, 'before_cursor_execute', self._query_started)
+        event.listen(engine, 'after_cursor_execute', self._query_ended)
+        app.teardown_request(self._finish)
+
+    # ----------------------------------- события движка --------------------------------------------------------------
+    @staticmethod
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        context.monitor_start = time.perf_counter()
+
+    def _query_ended(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.monitor_start
+
+        if has_request_context():
+            shapes = g.get('sql_shapes')
+            if shapes is None:
+                shapes = g.sql_shapes = Counter()
+            shapes[statement] += 1
+
+        if self.slow_ms and 1000 * elapsed >= self.slow_ms:
+            plan = self._explain(conn, statement, parameters) if self.explain and not executemany else ''
+            where = f' in {request.method} {request.path}' if has_request_context() else ''
+            logger.warning(f'Slow query {1000 * elapsed:.1f} ms{where}: {statement}\n\tparams: '
+                           f'{self._params(context, parameters)}{plan}')
+
+    def _finish(self, error):
+        """Конец запроса к сайту: число запросов к БД - в метрики роута, повторы - в лог"""
+        shapes = g.pop('sql_shapes', None)
+        if shapes is None:
+            return
+        endpoint = request.endpoint or 'not_found'
+        metrics.routes.add_queries(endpoint, sum(shapes.values()))
+        if self.n_plus_one:
+            for statement, count in shapes.items():
+                if count > self.n_plus_one:
+                    logger.warning(f'Possible N+1 in {request.method} {request.path} ({endpoint}): '
+                                   f'same query {count} times: {statement[:300]}')
+
+    # ----------------------------------- оформление ------------------------------------------------------------------
+    def _params(self, context, parameters):
+        """Параметры для лога: по именам, без паролей, двоичные данные - только размером, всё - не длиннее params_max"""
+        if context.compiled is not None and context.compiled_parameters:
+            parameters = context.compiled_parameters[0]
+        if isinstance(parameters, dict):
+            parameters = {k: '***' if k in SECRET_PARAMS else
+                          f'<{len(v)} bytes>' if isinstance(v, (bytes, memoryview)) else v
+                          for k, v in parameters.items()}
+        text = repr(parameters)
+        return text if len(text) <= self.params_max else text[:self.params_max] + '...'
+
+    @staticmethod
+    def _explain(conn, statement, parameters):
+        """ План медленного SELECT: отдельным курсором того же соединения, мимо событий Алхимии.
+            EXPLAIN без ANALYZE запрос не выполняет, только планирует. В PostgreSQL ошибка внутри транзакции
+            ломает всю транзакцию запроса к сайту, поэтому EXPLAIN там - внутри SAVEPOINT, и при ошибке
+            откатывается только он.
+        """
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return ''
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        try:
+            dbapi_connection = conn.connection.dbapi_connection
+            savepoint = conn.dialect.name == 'postgresql' and not getattr(dbapi_connection, 'autocommit', False)
+            cursor = dbapi_connection.cursor()
+            try:
+                if savepoint:
+                    cursor.execute(f'SAVEPOINT {EXPLAIN_SAVEPOINT}')
+                try:
+                    cursor.execute(prefix + statement, parameters)
+                    rows = cursor.fetchall()
+                except Exception:
+                    if savepoint:
+                        cursor.execute(f'ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}')
+                    raise
+                if savepoint:
+                    cursor.execute(f'RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}')
+            finally:
+                cursor.close()
+        except Exception as e:
+            return f'\n\tplan: not available ({e})'
+        return '\n\tplan:' + ''.join(f'\n\t\t{" ".join(str(col) for col in row)}' for row in rows)
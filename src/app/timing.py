@@ -0,0 +1,130 @@
+"""
+    Замер времени каждого запроса к сайту и api: весь запрос (wall) и его составляющие -
+    курсоры БД (db), рендер шаблонов Jinja (render) и сериализация json-ответов (serialize).
+    Время копится в гистограммах по роутам (app.metrics.routes), наружу отдаётся на /metrics
+    в текстовом формате Prometheus, а запросы дольше порога пишутся в лог с уровнем timing из app.yml.
+"""
+import time
+import logging
+
+from flask import g, request, has_app_context, before_render_template, template_rendered, Response
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """ Время одного запроса по этапам, сек; живёт в g.timing """
+    __slots__ = ('start', 'db', 'render', 'serialize', 'status', 'render_start')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = self.render = self.serialize = 0.0
+        self.status = 200
+        self.render_start = None
+
+
+def _add(stage, seconds):
+    """Добавить время этапа текущему запросу; вне запроса (старт приложения, фоновые потоки) - ничего"""
+    if has_app_context():
+        timing = g.get('timing')
+        if timing is not None:
+            setattr(timing, stage, getattr(timing, stage) + seconds)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """ json-провайдер Flask, который засекает время сериализации ответов jsonify """
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        _add('serialize', time.perf_counter() - start)
+        return response
+
+
+class RequestTimer:
+    """ Подключается к приложению и к движку БД через init_app; порог и уровень лога можно менять на лету """
+    def __init__(self, threshold_ms=1000, level='CRITICAL'):
+        self.threshold_ms = threshold_ms        # запросы не быстрее порога - в лог; 0 - все запросы
+        self.level = level
+        self.engine = None
+
+    def init_app(self, app, engine):
+        self.engine = engine
+        app.json = TimedJSONProvider(app)
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start)  # первым - до подготовки БД
+        app.after_request(self._response)
+        app.teardown_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_ended, app)
+        event.listen(engine, 'before_cursor_execute', self._query_started)
+        event.listen(engine, 'after_cursor_execute', self._query_ended)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    # ----------------------------------- обработчики запроса ---------------------------------------------------------
+    @staticmethod
+    def _start():
+        g.timing = RequestTiming()
+
+    @staticmethod
+    def _response(response):
+        timing = g.get('timing')
+        if timing is not None:
+            timing.status = response.status_code
+        return response
+
+    def _finish(self, error):
+        """Конец запроса (для потоковых ответов - после отдачи последнего куска): записываем замеры"""
+        timing = g.pop('timing', None)
+        if timing is None:
+            return
+        wall = time.perf_counter() - timing.start
+        endpoint = request.endpoint or 'not_found'      # без роута - одна метка на всех, а не по url
+        status = 500 if error is not None else timing.status
+        metrics.routes.observe(endpoint, status,
+                               wall=wall, db=timing.db, render=timing.render, serialize=timing.serialize)
+
+        if 1000 * wall >= self.threshold_ms:
+            logger.log(logging.getLevelName(self.level),
+                       f'{request.method} {request.path} ({endpoint}) HTTP={status}: {1000 * wall:.1f} ms, '
+                       f'db {1000 * timing.db:.1f} ms, render {1000 * timing.render:.1f} ms, '
+                       f'serialize {1000 * timing.serialize:.1f} ms')
+
+    # ----------------------------------- этапы: шаблоны и БД ---------------------------------------------------------
+    @staticmethod
+    def _render_started(sender, template, context, **kwargs):
+        timing = g.get('timing')
+        if timing is not None:
+            timing.render_start = time.perf_counter()
+
+    @staticmethod
+    def _render_ended(sender, template, context, **kwargs):
+        timing = g.get('timing')
+        if timing is not None and timing.render_start is not None:
+            timing.render += time.perf_counter() - timing.render_start
+            timing.render_start = None
+
+    @staticmethod
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        context.timing_start = time.perf_counter()
+
+    @staticmethod
+    def _query_ended(conn, cursor, statement, parameters, context, executemany):
+        _add('db', time.perf_counter() - context.timing_start)
+
+    # ----------------------------------- экспорт ---------------------------------------------------------------------
+    def metrics_view(self):
+        """Все метрики сервера в текстовом формате Prometheus"""
+        lines = ['# TYPE app_requests_total counter',
+                 f'app_requests_total {metrics.requests_total.value}',
+                 '# TYPE app_requests_with_db_total counter',
+                 f'app_requests_with_db_total {metrics.requests_with_db.value}',
+                 '# TYPE app_log_dropped_total counter',
+                 f'app_log_dropped_total {metrics.log_dropped.value}']
+        for name, value in self.engine.pool.metrics().items():
+            lines.append(f'# TYPE db_pool_{name} gauge')
+            lines.append(f'db_pool_{name} {value}')
+        lines += metrics.routes.prometheus()
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,165 @@
+"""
+    Асинхронная точка входа для JSON-API v1 (ASGI), рядом с основным WSGI-сайтом.
+    Запуск: uvicorn asgi:app --host 0.0.0.0 --port 5051
+    Каждый запрос к api - это корутина, а не поток cheroot: тысячи одновременных клиентов ждут базу
+    в одном цикле событий, а база - через asyncpg и асинхронные сессии Алхимии.
+    Конфиги (app.yml, db.yml) и SQL-запросы - те же, что у WSGI-версии api.
+"""
+import os
+os.environ.setdefault('SRC_PATH', os.path.join(os.getcwd()))            # путь к корню - в переменные окружения
+os.environ.setdefault('APP_PATH', os.path.join(os.getcwd(), 'app'))     # путь к приложению
+
+import json
+import time
+import logging
+from urllib.parse import parse_qs
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.config.simpl_config import Config
+from app.logs import LogPipeline, access
+import database.init
+from database.queries import (users_page_query, users_count_query, users_count_full_query, users_estimate_query,
+                              USERS_PAGE_DEFAULT, USERS_PAGE_MAX, STREAM_BATCH)
+
+logger = logging.getLogger(__name__)
+log_format = f"%(levelname).1s:(%(threadName)-10s): %(filename)s: %(funcName)s: %(lineno)s: %(message)s "
+
+config = Config()   # чтение конфигов - тех же, что у WSGI-сайта
+log_pipeline = LogPipeline(logging.getLevelName(config.get_loglevel()), log_format, **config.get_logging()).start()
+
+engine = database.init.async_db_connection(config)
+Session = async_sessionmaker(engine)
+
+_count_cache = (0.0, None)      # (годен до, значение) - короткий кэш точного числа юзеров, как в WSGI-версии
+
+
+# --------------------------------------------------------------------------------------------------------------
+# ОБРАБОТЧИКИ API, каждый возвращает (HTTP-статус, словарь ответа) или асинхронный генератор кусков ответа
+# --------------------------------------------------------------------------------------------------------------
+async def users_count(params):
+    """Посчитать количество юзеров в базе: ?mode=exact (по умолчанию) или ?mode=approx"""
+    mode = params.get('mode', 'exact')
+    if mode not in ('exact', 'approx'):
+        return 400, {"error": f"unknown mode '{mode}', expected exact or approx"}
+
+    rows = None
+    if mode == 'approx':
+        async with Session() as session:
+            rows = await session.scalar(users_estimate_query())
+    if rows is None or rows < 0:
+        rows = await _exact_count()
+    return 200, {"data": rows, "mode": mode}
+
+
+async def _exact_count():
+    """Точное количество из счётчика; если счётчика нет - честный count(*)"""
+    global _count_cache
+    expires, rows = _count_cache
+    if rows is not None and expires > time.monotonic():
+        return rows
+
+    async with Session() as session:
+        rows = await session.scalar(users_count_query())
+        if rows is None:
+            logger.warning("Users counter not found, falling back to count(*)")
+            rows = await session.scalar(users_count_full_query())
+
+    ttl = config.get_users_count_ttl()
+    if ttl:
+        _count_cache = (time.monotonic() + ttl, rows)
+    return rows
+
+
+async def users_list(params):
+    """Список юзеров: ?limit=N&after=id - страница, ?stream=1&after=id - все после after потоком"""
+    try:
+        after = int(params.get('after', 0))
+        limit = min(max(int(params.get('limit', USERS_PAGE_DEFAULT)), 1), USERS_PAGE_MAX)
+    except ValueError:
+        return 400, {"error": "after and limit must be integers"}
+
+    if params.get('stream', '0').lower() in ('1', 'true', 'yes'):
+        return 200, _stream_users(after)
+
+    async with Session() as session:
+        rows = (await session.execute(users_page_query(limit + 1, after))).all()
+
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return 200, {"data": [{'name': row.name, 'email': row.email} for row in rows[:limit]], "next": next_after}
+
+
+async def _stream_users(after):
+    """Ответ {"data": [...]} по кусочкам, строки идут из серверного курсора пачками по STREAM_BATCH"""
+    total = 0
+    yield '{"data": ['
+    async with Session() as session:
+        result = await session.stream(users_page_query(after=after), execution_options={'yield_per': STREAM_BATCH})
+        async for rows in result.partitions():
+            chunk = ', '.join(json.dumps({'name': row.name, 'email': row.email}) for row in rows)
+            yield (', ' if total else '') + chunk
+            total += len(rows)
+    yield ']}'
+    logger.info("users/list streaming ended, %s users", total, extra=access('api_v1.users_list'))
+
+
+ROUTES = {
+    '/api/v1/users/count': users_count,
+    '/api/v1/users/list': users_list,
+}
+
+
+# --------------------------------------------------------------------------------------------------------------
+# ASGI-ПРИЛОЖЕНИЕ
+# --------------------------------------------------------------------------------------------------------------
+async def app(scope, receive, send):
+    """Точка входа ASGI: маршрутизация по пути, ответы - JSON"""
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get(scope['path'].rstrip('/'))
+    if handler is None:
+        return await _send_json(send, 404, {"error": "not found"})
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await _send_json(send, 405, {"error": "method not allowed"})
+
+    params = {k: v[-1] for k, v in parse_qs(scope['query_string'].decode('latin-1')).items()}
+    try:
+        status, body = await handler(params)
+    except Exception:
+        logger.exception(f"{scope['path']} failed")
+        return await _send_json(send, 500, {"error": "internal server error"})
+
+    if isinstance(body, dict):
+        logger.log(logging.INFO if status == 200 else logging.ERROR, "%s, HTTP=%s ended", scope['path'][1:], status,
+                   extra=access(f'api_v1.{handler.__name__}'))     # метки роутов - как у endpoint-ов Flask
+        return await _send_json(send, status, body)
+
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    async for chunk in body:
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _send_json(send, status, response):
+    payload = json.dumps(response).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _lifespan(receive, send):
+    """Старт и остановка сервера: при остановке закрываем пул соединений"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            logger.fatal(f'ASGI api started')
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            logger.fatal(f'ASGI api stopped')
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,9 @@
+"""
+    Нагрузочные тесты сервера: запуск main.py отдельным процессом на mock-базе или на своём PostgreSQL,
+    смешанная нагрузка на все роуты из многих потоков, итоги (запросов в секунду, p50/p99 по роутам) - в json,
+    который можно сравнить с прошлым прогоном.
+        python -m bench run --users 5000 --posts 1000 --duration 30 --clients 32 --out bench/results/base.json
+        python -m bench run --mix write --out bench/results/write.json     # регистрации и новые статьи
+        python -m bench compare bench/results/base.json bench/results/new.json
+    Подробности: python -m bench run -h
+"""
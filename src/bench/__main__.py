@@ -0,0 +1,105 @@
+"""
+    Нагрузочные тесты сервера, запуск из каталога src: python -m bench <команда> [параметры]
+        run      - поднять сервер, прогнать смешанную нагрузку, вывести и сохранить итоги в json
+        compare  - сравнить два сохранённых прогона
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+import yaml
+
+from bench.server import BenchServer
+from bench.workloads import Workload, DEFAULT_MIX, MIXES, OPERATIONS, parse_mix
+from bench import report
+
+logger = logging.getLogger(__name__)
+
+
+def _yml_section(path, section):
+    """Секция db/app из yml-файла - то, что доливается в конфиг сервера прогона"""
+    if not path:
+        return None
+    with open(path) as f:
+        return (yaml.safe_load(f) or {}).get(section) or {}
+
+
+def cmd_run(args):
+    """Поднять сервер и прогнать нагрузку"""
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench-')
+    server = BenchServer(workdir, db=_yml_section(args.db_yml, 'db'), app=_yml_section(args.app_yml, 'app'),
+                         users=args.users, posts=args.posts, threads=args.threads, workers=args.workers,
+                         port=args.port)
+    params = dict(clients=args.clients, duration=args.duration, warmup=args.warmup, mix=mix, burst=args.burst,
+                  burst_every=args.burst_every, threads=args.threads, workers=args.workers,
+                  db='mock' if server.mock else 'postgresql', seed=args.seed)
+
+    with server:
+        workload = Workload(server.host, server.port, server.users, server.posts, mix=mix, clients=args.clients,
+                            duration=args.duration, warmup=args.warmup, burst=args.burst,
+                            burst_every=args.burst_every, seed=args.seed)
+        logger.info(f'Load started: {args.clients} clients, {args.warmup} s warmup + {args.duration} s, mix {mix}')
+        recorder = workload.run()
+        server_stats = server.fetch_json('/api/v1/stats')
+
+    params.update(users=server.users, posts=server.posts)
+    result = dict(name=args.name or time.strftime('%Y%m%d-%H%M%S'), params=params, environment=report.environment(),
+                  **report.summarize(recorder, args.duration), server=server_stats)
+    print(report.format_summary(result))
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        report.save(args.out, result)
+        logger.info(f'Results saved to {args.out}, server log {os.path.join(workdir, "server.log")}')
+    if result['total']['errors']:
+        logger.warning(f'{result["total"]["errors"]} requests failed, see statuses in the results')
+
+
+def cmd_compare(args):
+    """Сравнить два прогона: old и new"""
+    print(report.compare(report.load(args.old), report.load(args.new)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('run', help=cmd_run.__doc__)
+    cmd.add_argument('--db-yml', help='db.yml с PostgreSQL для прогона; по умолчанию - mock-база')
+    cmd.add_argument('--app-yml', help='app.yml, параметры которого доливаются в конфиг сервера прогона')
+    cmd.add_argument('--users', type=int, default=1000, help='синтетических юзеров в базе')
+    cmd.add_argument('--posts', type=int, default=200, help='синтетических статей в базе')
+    cmd.add_argument('--threads', type=int, default=20, help='server.numthreads')
+    cmd.add_argument('--workers', type=int, default=1, help='server.workers')
+    cmd.add_argument('--port', type=int, help='порт сервера, по умолчанию - любой свободный')
+    cmd.add_argument('--clients', type=int, default=16, help='потоков нагрузки (виртуальных пользователей)')
+    cmd.add_argument('--duration', type=float, default=30, help='сколько секунд мерить')
+    cmd.add_argument('--warmup', type=float, default=5, help='секунд разогрева перед замером')
+    cmd.add_argument('--mix', help=f'веса операций ({", ".join(OPERATIONS)}) или готовая смесь '
+                                   f'({", ".join(MIXES)}), по умолчанию '
+                                   f'{",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items())}')
+    cmd.add_argument('--burst', type=int, default=0, help='одновременных логинов во всплеске, 0 - без всплесков')
+    cmd.add_argument('--burst-every', type=float, default=10, help='период всплесков логинов, сек')
+    cmd.add_argument('--seed', type=int, default=1, help='зерно случайных чисел нагрузки')
+    cmd.add_argument('--name', help='имя прогона в json')
+    cmd.add_argument('--out', help='куда сохранить итоги, json')
+    cmd.add_argument('--workdir', help='каталог конфигов и лога сервера, по умолчанию - временный')
+    cmd.set_defaults(func=cmd_run)
+
+    cmd = commands.add_parser('compare', help=cmd_compare.__doc__)
+    cmd.add_argument('old')
+    cmd.add_argument('new')
+    cmd.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname).1s: %(filename)s: %(funcName)s: %(message)s",
+                        handlers=[logging.StreamHandler(sys.stderr)])
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
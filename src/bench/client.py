@@ -0,0 +1,75 @@
+"""
+    Простейший http-клиент нагрузочных тестов: одно keep-alive соединение на клиента, свои куки (сессия Flask,
+    remember_token), редиректы не разворачиваются - 302 после логина это уже ответ.
+    Только стандартная библиотека: клиент не должен сам стать узким местом и тянуть зависимости.
+"""
+import re
+import time
+import http.client
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+class HttpClient:
+    """ Клиент одного виртуального пользователя; не потокобезопасен - у каждого потока свой """
+    def __init__(self, host, port, timeout=30):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.cookies = dict()
+        self.etags = dict()             # path -> ETag: повторный запрос идёт с If-None-Match, как у браузера
+        self.conn = None
+
+    def request(self, method, path, form=None, headers=None):
+        """:return: (статус, тело, секунд на запрос вместе с чтением ответа, заголовки ответа)"""
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+
+        for attempt in (1, 2):          # сервер мог закрыть простаивавшее keep-alive соединение - один повтор
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            start = time.perf_counter()
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt == 2:
+                    raise
+        elapsed = time.perf_counter() - start
+
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                if morsel.value and morsel['expires'] != 'Thu, 01 Jan 1970 00:00:00 GMT':
+                    self.cookies[name] = morsel.value
+                else:
+                    self.cookies.pop(name, None)
+        if response.will_close:
+            self.close()
+        return response.status, data, elapsed, response.headers
+
+    def get(self, path, cached=False):
+        """GET; cached=True - с If-None-Match по ETag прошлого ответа на этот путь"""
+        headers = {'If-None-Match': self.etags[path]} if cached and path in self.etags else None
+        status, data, elapsed, response_headers = self.request('GET', path, headers=headers)
+        if cached and response_headers.get('ETag'):
+            self.etags[path] = response_headers['ETag']
+        return status, data, elapsed
+
+    def csrf_token(self, path):
+        """Токен CSRF из формы страницы path (Flask-WTF кладёт его в сессию - куки запоминаются)"""
+        status, data, elapsed = self.get(path)
+        match = CSRF_RE.search(data.decode('utf-8', 'replace'))
+        return match.group(1) if match else '', status, elapsed
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,111 @@
+"""
+    Итоги прогона: сводка по роутам (запросов в секунду, ошибки, перцентили латентности), json-файл прогона
+    и сравнение двух прогонов - что стало быстрее или медленнее и насколько.
+"""
+import os
+import json
+import math
+import time
+import platform
+import subprocess
+
+PERCENTILES = (50, 90, 99)
+NOISE = 0.05            # разница меньше 5% - в пределах шума, в сравнении не помечается
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированным values (ближайший ранг)"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def route_summary(latencies, statuses, errors, duration):
+    values = sorted(latencies)
+    summary = dict(requests=len(values), errors=errors, rps=round(len(values) / duration, 1),
+                   mean_ms=round(1000 * sum(values) / len(values), 2) if values else 0.0)
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = round(1000 * percentile(values, p), 2)
+    summary['max_ms'] = round(1000 * values[-1], 2) if values else 0.0
+    summary['statuses'] = dict(sorted(statuses.items()))
+    return summary
+
+
+def summarize(recorder, duration):
+    """Recorder прогона -> {'total': {...}, 'routes': {роут: {...}}}"""
+    routes = {route: route_summary(recorder.latencies[route], recorder.statuses[route], recorder.errors[route],
+                                   duration)
+              for route in sorted(recorder.latencies)}
+    everything = [value for values in recorder.latencies.values() for value in values]
+    statuses = dict()
+    for route_statuses in recorder.statuses.values():
+        for status, count in route_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    total = route_summary(everything, statuses, sum(recorder.errors.values()), duration)
+    return dict(total=total, routes=routes)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment():
+    return dict(python=platform.python_version(), platform=platform.platform(), cpus=os.cpu_count(),
+                git=git_revision(), time=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def save(path, result):
+    with open(path, 'w') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_summary(result):
+    lines = [f'{"route":<16} {"requests":>9} {"errors":>7} {"rps":>9} {"mean ms":>9} '
+             + ' '.join(f'{f"p{p} ms":>9}' for p in PERCENTILES) + f' {"max ms":>9}']
+    for route, s in list(result['routes'].items()) + [('TOTAL', result['total'])]:
+        lines.append(f'{route:<16} {s["requests"]:>9} {s["errors"]:>7} {s["rps"]:>9} {s["mean_ms"]:>9} '
+                     + ' '.join(f'{s[f"p{p}_ms"]:>9}' for p in PERCENTILES) + f' {s["max_ms"]:>9}')
+    return '\n'.join(lines)
+
+
+def _change(old, new, higher_is_better):
+    if not old:
+        return f'{old} -> {new}'
+    delta = (new - old) / old
+    mark = ''
+    if abs(delta) >= NOISE:
+        mark = ' +' if (delta > 0) == higher_is_better else ' -'       # + лучше, - хуже
+    return f'{old} -> {new} ({100 * delta:+.0f}%){mark}'
+
+
+def compare(old, new):
+    """Текстовое сравнение двух прогонов по общим роутам: rps и перцентили; '+' - стало лучше, '-' - хуже"""
+    lines = []
+    for key in ('clients', 'duration', 'mix', 'users', 'posts', 'threads', 'workers', 'db'):
+        if old['params'].get(key) != new['params'].get(key):
+            lines.append(f'! {key} differs: {old["params"].get(key)} vs {new["params"].get(key)}')
+    lines.append(f'old: {old["environment"].get("git")} {old["environment"].get("time")}, '
+                 f'new: {new["environment"].get("git")} {new["environment"].get("time")}')
+
+    routes = [route for route in old['routes'] if route in new['routes']] + ['TOTAL']
+    for route in routes:
+        o = old['total'] if route == 'TOTAL' else old['routes'][route]
+        n = new['total'] if route == 'TOTAL' else new['routes'][route]
+        lines.append(f'{route}:')
+        lines.append(f'    rps     {_change(o["rps"], n["rps"], True)}')
+        for p in PERCENTILES:
+            lines.append(f'    p{p:<6} {_change(o[f"p{p}_ms"], n[f"p{p}_ms"], False)}')
+        if o['errors'] or n['errors']:
+            lines.append(f'    errors  {o["errors"]} -> {n["errors"]}')
+    for route in sorted(set(old['routes']) ^ set(new['routes'])):
+        lines.append(f'{route}: only in {"old" if route in old["routes"] else "new"}')
+    return '\n'.join(lines)
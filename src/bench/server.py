@@ -0,0 +1,137 @@
+"""
+    Сервер под нагрузкой: main.py отдельным процессом со своим каталогом конфигов (SRC_PATH),
+    чтобы нагрузочный клиент и сервер не делили GIL, а рабочие конфиги разработчика не трогались.
+    База - mock (SQLite в памяти сервера, наполняется им самим при старте) или PostgreSQL из своего db.yml;
+    в Postgres синтетические юзеры и статьи (как у mock) доливаются отсюда через COPY, если их там меньше, чем нужно.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import logging
+import subprocess
+import urllib.request
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))   # каталог main.py
+START_TIMEOUT = 300         # сек на старт сервера: mock-база с миллионом юзеров заливается не мгновенно
+
+
+def free_port(host='127.0.0.1'):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class BenchServer:
+    """ Запуск и остановка сервера; with BenchServer(...) as server: ... """
+    def __init__(self, workdir, db=None, app=None, users=1000, posts=200, threads=20, workers=1,
+                 host='127.0.0.1', port=None):
+        """ workdir - каталог прогона: config/ сервера и его лог server.log
+            db, app - словари, которые доливаются поверх db.yml и app.yml прогона (из --db-yml, --app-yml);
+            без db - mock-база на users юзеров и posts статей
+        """
+        self.workdir = workdir
+        self.host, self.port = host, port or free_port(host)
+        self.users, self.posts = users, posts
+        self.db = dict(db_schema='public', user='bench', password='bench', host='127.0.0.1', port=5432,
+                       name='bench', type='mock', mock_users=users, mock_posts=posts)
+        self.db.update(db or {})
+        self.app = dict(loglevel='WARNING', flask_debug=False, timing='DEBUG')
+        self.app.update(app or {})
+        self.app['server'] = dict(self.app.get('server', {}), host=host, port=self.port, numthreads=threads,
+                                  workers=workers)
+        self.process = None
+        self.log = None
+
+    @property
+    def mock(self):
+        return str(self.db.get('type', 'postgresql')).lower() == 'mock'
+
+    def write_config(self):
+        os.makedirs(os.path.join(self.workdir, 'config'), exist_ok=True)
+        for name, conf in (('db', self.db), ('app', self.app)):
+            with open(os.path.join(self.workdir, 'config', f'{name}.yml'), 'w') as f:
+                yaml.safe_dump({name: conf}, f, allow_unicode=True)
+
+    def start(self):
+        self.write_config()
+        if not self.mock:
+            self.seed_postgres()
+        env = dict(os.environ, SRC_PATH=self.workdir, APP_PATH=os.path.join(SRC_DIR, 'app'),
+                   PYTHONPATH=SRC_DIR, PYTHONUNBUFFERED='1')
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.process = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, 'main.py')], cwd=SRC_DIR, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        started = time.monotonic()
+        while not self.ready():
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited with code {self.process.returncode}, '
+                                   f'see {os.path.join(self.workdir, "server.log")}')
+            if time.monotonic() - started > START_TIMEOUT:
+                self.stop()
+                raise RuntimeError(f'Server did not start in {START_TIMEOUT} s')
+            time.sleep(0.2)
+        logger.info(f'Server pid={self.process.pid} ready on {self.host}:{self.port} '
+                    f'in {time.monotonic() - started:.1f} s')
+        return self
+
+    def ready(self):
+        try:
+            with urllib.request.urlopen(self.url('/metrics'), timeout=2) as response:
+                return response.status == 200
+        except OSError:
+            return False
+
+    def url(self, path):
+        return f'http://{self.host}:{self.port}{path}'
+
+    def fetch_json(self, path):
+        """json с сервера (итоговая статистика /api/v1/stats); не вышло - None, прогон это не портит"""
+        try:
+            with urllib.request.urlopen(self.url(path), timeout=10) as response:
+                return json.loads(response.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f'{path} not fetched: {e}')
+            return None
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            logger.error(f'Server pid={self.process.pid} did not stop, killing')
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.log.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def seed_postgres(self):
+        """Синтетические юзеры и статьи в Postgres - те же, что у mock-базы; доливаются только недостающие"""
+        os.environ['SRC_PATH'] = self.workdir
+        os.environ.setdefault('APP_PATH', os.path.join(SRC_DIR, 'app'))
+        from app.config.simpl_config import Config
+        import database.init
+        from database.generate import generate, next_number
+
+        engine, all_db_tables, _db_conf = database.init.db_connection(Config())
+        if database.init.missing_tables(engine):
+            with engine.connect() as conn:
+                database.init.upload_demo(engine, all_db_tables, conn)
+        database.init.upgrade_schema(engine)
+        next_user, next_post = next_number(engine)
+        generate(engine, max(self.users - next_user + 1, 0), max(self.posts - next_post + 1, 0))
+        engine.dispose()
@@ -0,0 +1,259 @@
+"""
+    Смешанная нагрузка. Каждый поток - виртуальный пользователь: залогинен (для статей и аватара),
+    а анонимные запросы шлёт вторым, безкуковым клиентом. Операцию на каждом шаге выбирает случайно по весам mix.
+    Отдельно можно включить всплески логинов: каждые burst_every сек burst одновременных логинов (pbkdf2 - дорого).
+    Замеры каждый поток копит у себя и без блокировок, сводятся они после прогона.
+"""
+import time
+import uuid
+import random
+import itertools
+import threading
+from collections import Counter
+from urllib.parse import quote
+
+from bench.client import HttpClient
+from database.mock import MOCK_PASSWORD, MOCK_DOMAIN
+from database.generate import WORDS
+
+DEFAULT_MIX = dict(index=30, post=25, api_list=15, api_count=10, avatar=15, login=5)
+MIXES = dict(read=DEFAULT_MIX,
+             write=dict(register=1, add_post=4, register_dup=1, add_post_dup=1))    # пропускная способность записи
+
+RUN_ID = uuid.uuid4().hex[:8]       # email и url новых юзеров и статей уникальны и между прогонами на одной базе
+_serial = itertools.count(1)        # и между потоками; next() у count под GIL атомарен
+
+
+def parse_mix(text):
+    """ 'index=30,post=25' -> {'index': 30, 'post': 25}; операции, не названные в строке, не выполняются.
+        Или имя готовой смеси из MIXES: read, write
+    """
+    if text in MIXES:
+        return dict(MIXES[text])
+    mix = dict()
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f'unknown operation {name}, known: {", ".join(OPERATIONS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    """ Замеры одного потока: латентности и статусы по роутам """
+    def __init__(self):
+        self.latencies = dict()         # роут -> [сек]
+        self.statuses = dict()          # роут -> Counter статусов
+        self.errors = Counter()         # роут -> неожиданных статусов и исключений
+
+    def add(self, route, status, elapsed, ok):
+        self.latencies.setdefault(route, []).append(elapsed)
+        self.statuses.setdefault(route, Counter())[str(status)] += 1
+        if not ok:
+            self.errors[route] += 1
+
+    def merge(self, other):
+        for route, values in other.latencies.items():
+            self.latencies.setdefault(route, []).extend(values)
+        for route, statuses in other.statuses.items():
+            self.statuses.setdefault(route, Counter()).update(statuses)
+        self.errors.update(other.errors)
+
+
+class VirtualUser:
+    """ Операции нагрузки; каждая - один или два http-запроса с замером """
+    def __init__(self, host, port, users, posts, rnd):
+        self.host, self.port = host, port
+        self.users, self.posts = users, posts
+        self.rnd = rnd
+        self.anonymous = HttpClient(host, port)
+        self.client = HttpClient(host, port)
+
+    def _call(self, recorder, route, expected, client, method, path, **kwargs):
+        try:
+            if method == 'GET':
+                status, data, elapsed = client.get(path, **kwargs)
+            else:
+                status, data, elapsed, _headers = client.request(method, path, **kwargs)
+        except OSError as e:
+            recorder.add(route, type(e).__name__, 0.0, False)
+            return None
+        recorder.add(route, status, elapsed, status in expected)
+        return status
+
+    def login(self, recorder, client=None, route='login'):
+        """Форма логина (за CSRF-токеном) и сам логин случайным синтетическим юзером"""
+        client = client or HttpClient(self.host, self.port)
+        try:
+            token, status, elapsed = client.csrf_token('/login')
+        except OSError as e:
+            recorder.add(f'{route}_form', type(e).__name__, 0.0, False)
+            return False
+        recorder.add(f'{route}_form', status, elapsed, status == 200 and bool(token))
+        email = f'user{self.rnd.randint(1, self.users)}@{MOCK_DOMAIN}'
+        form = dict(csrf_token=token, email=email, psw=MOCK_PASSWORD)
+        return self._call(recorder, route, {302}, client, 'POST', '/login', form=form) == 302
+
+    def fresh_login(self, recorder):
+        """Логин с нуля - новый клиент без куков и соединения, как новый посетитель"""
+        client = HttpClient(self.host, self.port)
+        try:
+            self.login(recorder, client)
+        finally:
+            client.close()
+
+    def index(self, recorder):
+        self._call(recorder, 'index', {200}, self.anonymous, 'GET', '/')
+
+    def post(self, recorder):
+        self._call(recorder, 'post', {200}, self.client, 'GET', f'/post/mock-{self.rnd.randint(1, self.posts)}')
+
+    def api_list(self, recorder):
+        after = self.rnd.randint(0, self.users)
+        self._call(recorder, 'api_list', {200}, self.anonymous, 'GET', f'/api/v1/users/list?limit=50&after={after}')
+
+    def api_count(self, recorder):
+        self._call(recorder, 'api_count', {200}, self.anonymous, 'GET', '/api/v1/users/count')
+
+    def search(self, recorder):
+        q = ' '.join(self.rnd.choices(WORDS[:21], k=self.rnd.randint(1, 2)))    # слова синтетических статей
+        self._call(recorder, 'search', {200}, self.anonymous, 'GET', f'/api/v1/posts/search?q={quote(q)}')
+
+    def avatar(self, recorder):
+        self._call(recorder, 'avatar', {200, 304}, self.client, 'GET', '/userava', cached=True)
+
+    # ----------------------------------- запись ------------------------------------------------------------------------
+    def register(self, recorder, email=None, route='register'):
+        """Регистрация нового юзера: форма (за CSRF-токеном) и её отправка; успех - редирект на логин"""
+        client = HttpClient(self.host, self.port)
+        try:
+            try:
+                token, status, elapsed = client.csrf_token('/register')
+            except OSError as e:
+                recorder.add(f'{route}_form', type(e).__name__, 0.0, False)
+                return
+            recorder.add(f'{route}_form', status, elapsed, status == 200 and bool(token))
+            email = email or f'bench-{RUN_ID}-{next(_serial)}@{MOCK_DOMAIN}'
+            form = dict(csrf_token=token, name=email.split('@')[0][:100], email=email, psw=MOCK_PASSWORD,
+                        psw2=MOCK_PASSWORD)
+            expected = {302} if route == 'register' else {200}     # дубль - снова форма, с ошибкой
+            self._call(recorder, route, expected, client, 'POST', '/register', form=form)
+        finally:
+            client.close()
+
+    def register_dup(self, recorder):
+        """Регистрация с уже занятым email: ответ - снова форма (200) с ошибкой"""
+        self.register(recorder, f'user{self.rnd.randint(1, self.users)}@{MOCK_DOMAIN}', route='register_dup')
+
+    def add_post(self, recorder, url=None, route='add_post'):
+        """Новая статья; сайт отвечает страницей (200) в любом случае, успех - по сообщению на ней"""
+        url = url or f'bench-{RUN_ID}-{next(_serial)}'
+        text = ' '.join(self.rnd.choices(('статья', 'нагрузка', 'запись', 'база', 'индекс'), k=50))
+        try:
+            status, data, elapsed, _headers = self.client.request('POST', '/add_post',
+                                                                  form=dict(name=f'Статья {url}', url=url, post=text))
+        except OSError as e:
+            recorder.add(route, type(e).__name__, 0.0, False)
+            return
+        added = b'flash success' in data
+        recorder.add(route, status, elapsed, status == 200 and added == (route == 'add_post'))
+
+    def add_post_dup(self, recorder):
+        """Статья с уже занятым url: ответ - та же страница с ошибкой"""
+        self.add_post(recorder, f'mock-{self.rnd.randint(1, self.posts)}', route='add_post_dup')
+
+    def close(self):
+        self.anonymous.close()
+        self.client.close()
+
+
+OPERATIONS = dict(index=VirtualUser.index, post=VirtualUser.post, api_list=VirtualUser.api_list,
+                  api_count=VirtualUser.api_count, search=VirtualUser.search, avatar=VirtualUser.avatar,
+                  login=VirtualUser.fresh_login,
+                  register=VirtualUser.register, register_dup=VirtualUser.register_dup,
+                  add_post=VirtualUser.add_post, add_post_dup=VirtualUser.add_post_dup)
+
+
+class Workload:
+    """ Прогон: clients потоков в течение duration сек после warmup сек разогрева (его замеры отбрасываются) """
+    def __init__(self, host, port, users, posts, mix=None, clients=16, duration=30, warmup=5,
+                 burst=0, burst_every=10, seed=1):
+        self.host, self.port = host, port
+        self.users, self.posts = max(users, 1), max(posts, 1)
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.clients, self.duration, self.warmup = clients, duration, warmup
+        self.burst, self.burst_every = burst, burst_every
+        self.seed = seed
+        self.recorders = []
+        self._started = threading.Event()
+        self.measure_from = self.deadline = None
+
+    def run(self):
+        """:return: Recorder со всеми замерами"""
+        barrier = threading.Barrier(self.clients, action=self._start_clock)   # часы пойдут, когда все залогинятся
+        threads = []
+        for n in range(self.clients):
+            recorder = Recorder()
+            self.recorders.append(recorder)
+            threads.append(threading.Thread(target=self._client, args=(n, recorder, barrier), name=f'bench-{n}',
+                                            daemon=True))
+        if self.burst:
+            self.recorders.append(Recorder())
+            threads.append(threading.Thread(target=self._bursts, args=(self.recorders[-1],), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        total = Recorder()
+        for recorder in self.recorders:
+            total.merge(recorder)
+        return total
+
+    def _start_clock(self):
+        self.measure_from = time.monotonic() + self.warmup
+        self.deadline = self.measure_from + self.duration
+        self._started.set()
+
+    def _client(self, n, recorder, barrier):
+        rnd = random.Random(self.seed * 1000 + n)
+        user = VirtualUser(self.host, self.port, self.users, self.posts, rnd)
+        operations, weights = zip(*((OPERATIONS[name], weight) for name, weight in self.mix.items()))
+        try:
+            user.login(Recorder(), user.client)     # вход для залогиненных операций в замеры не идёт
+            barrier.wait()
+            warmup = Recorder()
+            while (now := time.monotonic()) < self.deadline:
+                operation = rnd.choices(operations, weights)[0]
+                operation(user, recorder if now >= self.measure_from else warmup)
+        finally:
+            user.close()
+
+    def _bursts(self, recorder):
+        """Каждые burst_every сек - burst логинов одновременно; замеры под роутом login_burst"""
+        rnd = random.Random(self.seed)
+        self._started.wait()
+        next_burst = self.measure_from
+        while next_burst < self.deadline:
+            time.sleep(max(next_burst - time.monotonic(), 0))
+            recorders = [Recorder() for _ in range(self.burst)]
+            users = [VirtualUser(self.host, self.port, self.users, self.posts, random.Random(rnd.random()))
+                     for _ in range(self.burst)]
+            start = threading.Barrier(self.burst)
+            threads = [threading.Thread(target=self._burst_login, args=(u, r, start), daemon=True)
+                       for u, r in zip(users, recorders)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for r in recorders:
+                recorder.merge(r)
+            next_burst += self.burst_every
+
+    @staticmethod
+    def _burst_login(user, recorder, start):
+        start.wait()
+        try:
+            user.login(recorder, route='login_burst')
+        finally:
+            user.close()
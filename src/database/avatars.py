@@ -0,0 +1,128 @@
+"""
+    Хранилища картинок аватаров.
+        DBAvatarStore   - картинка лежит в колонке users.avatar (исходное поведение)
+        FileAvatarStore - картинка лежит файлом, имя файла - sha256 картинки (content-addressed),
+                          в users остаётся только avatar_hash. Одинаковые картинки хранятся один раз.
+"""
+import os
+import io
+import logging
+import hashlib
+import tempfile
+
+from sqlalchemy import select, update, or_
+
+from database.tables import users
+
+try:
+    from PIL import Image           # необязательная зависимость - только для миниатюр
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+_UMASK = os.umask(0)    # узнать umask можно только сменив его - один раз при импорте, пока нет потоков
+os.umask(_UMASK)
+
+
+class DBAvatarStore:
+    """ Аватары в БД, файлов нет """
+    external = False
+
+    def put(self, avatar_hash, avatar):
+        return None
+
+    def path(self, avatar_hash):
+        return None
+
+
+class FileAvatarStore:
+    """ Аватары файлами в каталоге root: root/ab/abcdef..., миниатюра рядом - root/ab/abcdef..._128.png """
+    external = True
+
+    def __init__(self, root, thumb_size=128):
+        self.root = root
+        self.thumb_size = thumb_size
+        os.makedirs(root, exist_ok=True)
+        if thumb_size and Image is None:
+            logger.warning(f'Pillow not installed, avatar thumbnails will not be created')
+
+    def _file(self, avatar_hash, suffix=''):
+        return os.path.join(self.root, avatar_hash[:2], avatar_hash + suffix)
+
+    def put(self, avatar_hash, avatar):
+        """Записать картинку и её миниатюру; если такая картинка уже есть - ничего не делаем"""
+        original = self._file(avatar_hash)
+        if not os.path.isfile(original):
+            _write_atomic(original, avatar)
+
+        thumb = self._file(avatar_hash, f'_{self.thumb_size}.png')
+        if self.thumb_size and Image is not None and not os.path.isfile(thumb):
+            try:
+                with Image.open(io.BytesIO(avatar)) as img:
+                    img.thumbnail((self.thumb_size, self.thumb_size))
+                    buf = io.BytesIO()
+                    img.save(buf, format='PNG')
+                _write_atomic(thumb, buf.getvalue())
+            except (OSError, ValueError) as e:     # не картинка или битая картинка - отдаём оригинал
+                logger.warning(f'Avatar thumbnail not created for {avatar_hash}: {str(e)}')
+        return original
+
+    def path(self, avatar_hash):
+        """Путь к файлу для отдачи: миниатюра, если есть, иначе оригинал; None - файла нет"""
+        for name in (self._file(avatar_hash, f'_{self.thumb_size}.png'), self._file(avatar_hash)):
+            if os.path.isfile(name):
+                return name
+        return None
+
+
+def _write_atomic(path, data):
+    """Запись через временный файл и переименование - читатели никогда не увидят недописанный файл"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        # mkstemp создаёт файл с правами 0600 - веб-сервер (x-sendfile, x-accel) под своим юзером его не прочтёт
+        os.fchmod(fd, 0o644 & ~_UMASK)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def make_avatar_store(config):
+    """Хранилище аватаров по конфигу приложения"""
+    if config.get_avatar_storage() == 'fs':
+        return FileAvatarStore(config.get_avatar_path(), config.get_avatar_thumb_size())
+    return DBAvatarStore()
+
+
+def migrate_avatars(engine, store, batch=100):
+    """ Перенос картинок из users.avatar в файловое хранилище, пачками по batch юзеров.
+        Юзер, успевший за это время сменить аватар, пропускается - его новая картинка не затирается.
+        :return: сколько аватаров перенесено
+    """
+    logger.info(f'Avatars migration to {store.root} started')
+    moved, last_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select(users.c.id, users.c.avatar)
+                                .where(users.c.id > last_id, users.c.avatar.is_not(None))
+                                .order_by(users.c.id).limit(batch)).all()
+            for row in rows:
+                avatar = bytes(row.avatar)
+                avatar_hash = hashlib.sha256(avatar).hexdigest()
+                store.put(avatar_hash, avatar)
+                res = conn.execute(update(users)
+                                   .where(users.c.id == row.id,
+                                          or_(users.c.avatar_hash == avatar_hash, users.c.avatar_hash.is_(None)))
+                                   .values(avatar=None, avatar_hash=avatar_hash))
+                moved += res.rowcount
+        if not rows:
+            break
+        last_id = rows[-1].id
+        logger.info(f'Avatars migrated: {moved}, last user id={last_id}')
+
+    logger.fatal(f'Avatars migration ended, {moved} avatars moved. Run VACUUM FULL users to give the space back')
+    return moved
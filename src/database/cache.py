@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLValue:
+    """ Одно закэшированное значение с временем жизни ttl секунд.
+        Чтение идёт без блокировок: значение и срок его годности лежат в одном кортеже,
+        а замена ссылки на кортеж в Питоне атомарна. Блокировка берётся только на перезагрузку,
+        чтобы по истечении ttl в базу сходил один поток, а не все сразу.
+        Счётчики попаданий/промахов тоже без блокировок, поэтому приблизительные.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entry = None              # (годен до, значение)
+        self._lock = threading.Lock()
+
+    def get(self, loader):
+        """Значение из кэша, а если его нет или оно протухло - из loader(). При ttl=0 кэш выключен."""
+        if self.ttl <= 0:
+            self.misses += 1
+            return loader()
+
+        entry = self._entry
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            entry = self._entry                 # пока ждали блокировку, значение мог загрузить другой поток
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            value = loader()
+            self._entry = (time.monotonic() + self.ttl, value)
+            return value
+
+    def invalidate(self):
+        """Сбросить значение, следующее чтение пойдёт в loader().
+            Блокировка - чтобы идущая прямо сейчас загрузка не вернула в кэш старое значение.
+        """
+        with self._lock:
+            self._entry = None
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, ttl=self.ttl, cached=self._entry is not None)
+
+
+class LRUCache:
+    """ Кэш на maxsize последних использованных ключей, каждое значение живёт ttl секунд.
+        Загрузка значения идёт вне блокировки, чтобы медленная база не тормозила чтения других ключей.
+        Пустые значения (None, False) не кэшируются. maxsize=0 или ttl=0 - кэш выключен.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()          # ключ -> (годен до, значение), в конце - самые свежие
+        self._version = 0                   # растёт при каждом сбросе ключа
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Значение по ключу из кэша, а если его нет или оно протухло - из loader()"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            version = self._version
+
+        value = loader()
+        if not value or self.maxsize <= 0 or self.ttl <= 0:
+            return value
+
+        with self._lock:
+            if version == self._version:    # пока грузили, ключи не сбрасывали - значит, значение не устарело
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        """Сбросить значение по ключу"""
+        with self._lock:
+            self._version += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Сбросить все значения"""
+        with self._lock:
+            self._version += 1
+            self._data.clear()
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_ratio=round(self.hits / requests, 4) if requests else 0.0,
+                    size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
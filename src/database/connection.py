@@ -0,0 +1,43 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LazyConnection:
+    """ Ленивое соединение с БД для FDataBase.
+        Соединение берётся из пула функцией connect только при первом запросе к базе,
+        поэтому запросы, которым база не понадобилась, пул не трогают.
+    """
+    def __init__(self, connect, dialect=None):
+        self._connect = connect
+        self._conn = None
+        self._dialect = dialect     # имя диалекта движка - чтобы строить запросы под базу, не беря соединение
+
+    @property
+    def dialect(self):
+        """Имя диалекта базы: 'postgresql', 'sqlite'"""
+        return self._dialect or self.connection().dialect.name
+
+    @property
+    def connected(self):
+        """Было ли соединение реально получено"""
+        return self._conn is not None
+
+    def connection(self):
+        """Соединение, если его ещё нет - берём из пула"""
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def execute(self, *args, **kwargs):
+        return self.connection().execute(*args, **kwargs)
+
+    def commit(self):
+        """Коммит имеет смысл, только если соединение уже было"""
+        if self._conn is not None:
+            self._conn.commit()
+
+    def rollback(self):
+        """Откат после ошибки, чтобы соединением можно было пользоваться дальше"""
+        if self._conn is not None:
+            self._conn.rollback()
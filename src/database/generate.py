@@ -0,0 +1,253 @@
+"""
+    Синтетические данные в объёмах продуктовой базы: миллионы юзеров и статей.
+    Строки генерируются на лету и уходят в базу пачками по batch строк, каждая пачка - своя транзакция,
+    так что память не зависит от объёма. В PostgreSQL пачка льётся одной командой COPY (поток строк прямо в таблицу),
+    в остальных базах (mock) и по желанию (method='insert') - многострочными INSERT.
+    Юзеры - user<N>@MOCK_DOMAIN с паролем MOCK_PASSWORD (их и логинит нагрузочный тест bench), статьи - mock-<N>;
+    номера продолжают уже залитые, так что генерацию можно доливать: последний выданный номер хранится
+    в counters (SYNTHETIC_COUNTERS).
+    Запуск: python manage.py generate --users 1000000 --posts 200000 --defer-indexes
+"""
+import io
+import re
+import math
+import time
+import zlib
+import struct
+import random
+import hashlib
+import logging
+import datetime
+
+from sqlalchemy import insert, select, update, func, text, cast, BigInteger
+from werkzeug.security import generate_password_hash
+
+from database.tables import posts, users, counters
+from database.services import make_anonce, posts_changed
+from database.mock import MOCK_PASSWORD, MOCK_DOMAIN
+from database.migrate import migrate
+
+logger = logging.getLogger(__name__)
+
+BATCH = 10000               # строк в одной транзакции
+AVATAR_SHARE = 0.3          # у какой доли юзеров есть аватар
+AVATAR_MEDIAN = 24 * 1024   # медиана размера аватара, байт; распределение логнормальное, хвост до AVATAR_MAX
+AVATAR_MAX = 512 * 1024
+POST_WORDS_MEDIAN = 300     # медиана длины статьи в словах; тоже логнормальное, от 20 до POST_WORDS_MAX
+POST_WORDS_MAX = 5000
+SPREAD_DAYS = 3 * 365       # юзеры и статьи появлялись равномерно за последние SPREAD_DAYS дней
+SYNTHETIC_COUNTERS = ('synthetic_users', 'synthetic_posts')     # строки counters: последний выданный номер
+
+WORDS = ('flask', 'python', 'база', 'запрос', 'индекс', 'сервер', 'поток', 'процесс', 'кэш', 'шаблон', 'страница',
+         'пул', 'соединение', 'таблица', 'строка', 'нагрузка', 'задержка', 'память', 'ядро', 'очередь', 'данные',
+         'и', 'в', 'на', 'не', 'что', 'это', 'как', 'для', 'по', 'из', 'при', 'так', 'или', 'уже', 'если',
+         'быстро', 'медленно', 'всегда', 'иногда', 'работает', 'считает', 'пишет', 'читает', 'ждёт', 'отдаёт',
+         'транзакция', 'блокировка', 'журнал', 'реплика', 'ответ', 'клиент', 'сеть', 'диск', 'план', 'статья')
+
+
+# ----------------------------------- генерация строк -----------------------------------------------------------------
+def noise_png(rnd, size):
+    """ Настоящая PNG-картинка из шума, размером около size байт: шум не сжимается,
+        так что размер файла задаётся размером картинки
+    """
+    side = max(int(math.sqrt(size / 3)), 1)
+    raw = b''.join(b'\x00' + rnd.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 0)) + chunk(b'IEND', b''))
+
+
+class Synthetic:
+    """ Генератор строк users и posts; с одним и тем же seed данные одни и те же """
+    def __init__(self, seed=1, avatars=AVATAR_SHARE, now=None):
+        self.seed = seed
+        self.avatars = avatars
+        self.now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        self.psw = generate_password_hash(MOCK_PASSWORD)   # один хэш на всех - pbkdf2 считается долго
+
+    def _random(self, kind, start):
+        return random.Random(f'{self.seed}-{kind}-{start}')     # своё зерно у каждой пачки
+
+    def _time(self, rnd):
+        return self.now - datetime.timedelta(seconds=rnd.randrange(SPREAD_DAYS * 86400))
+
+    def users(self, start, count):
+        """Юзеры с номерами start..start+count-1"""
+        rnd = self._random('users', start)
+        for i in range(start, start + count):
+            avatar = avatar_hash = None
+            if rnd.random() < self.avatars:
+                avatar = noise_png(rnd, min(int(rnd.lognormvariate(math.log(AVATAR_MEDIAN), 0.8)), AVATAR_MAX))
+                avatar_hash = hashlib.sha256(avatar).hexdigest()
+            yield dict(name=f'user{i}', email=f'user{i}@{MOCK_DOMAIN}', psw=self.psw, avatar=avatar,
+                       avatar_hash=avatar_hash, time=self._time(rnd))
+
+    def posts(self, start, count):
+        """Статьи с номерами start..start+count-1: абзацы html, анонс - как у статей с сайта"""
+        rnd = self._random('posts', start)
+        for i in range(start, start + count):
+            words = min(max(int(rnd.lognormvariate(math.log(POST_WORDS_MEDIAN), 0.9)), 20), POST_WORDS_MAX)
+            paragraphs = []
+            while words > 0:
+                n = min(rnd.randint(20, 120), words)
+                paragraphs.append(' '.join(rnd.choices(WORDS, k=n)).capitalize() + '.')
+                words -= n
+            body = '<p>' + '</p><p>'.join(paragraphs) + '</p>'
+            title = ' '.join(rnd.choices(WORDS, k=rnd.randint(2, 8))).capitalize()
+            yield dict(title=f'{title} №{i}', url=f'mock-{i}', text=body, anonce=make_anonce(body),
+                       time=self._time(rnd))
+
+
+# ----------------------------------- заливка ---------------------------------------------------------------------------
+def _copy_value(value):
+    """Значение в текстовом формате COPY: NULL - \\N, спецсимволы экранируются, bytea - в hex"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyStream(io.RawIOBase):
+    """ Файл для cursor.copy_expert: строки COPY собираются по мере того, как драйвер читает файл """
+    def __init__(self, rows, columns):
+        self.lines = ('\t'.join(_copy_value(row[c]) for c in columns).encode() + b'\n' for row in rows)
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def copy_batch(engine, table, rows):
+    """Пачка строк в PostgreSQL одной командой COPY, своей транзакцией"""
+    columns = [column.name for column in table.columns if not column.primary_key]
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN', CopyStream(rows, columns),
+                               size=1024 * 1024)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def insert_batch(engine, table, rows):
+    """Пачка строк многострочными INSERT, своей транзакцией"""
+    with engine.begin() as conn:
+        conn.execute(insert(table), list(rows))
+
+
+def _max_numbers(conn):
+    """ Наибольшие номера уже залитых синтетических юзеров и статей - по суффиксу, а не count(*):
+        после удаления строк count(*) + 1 попал бы на существующий номер. Это полный просмотр таблиц,
+        поэтому считается один раз - пока в counters нет SYNTHETIC_COUNTERS
+    """
+    if conn.dialect.name == 'postgresql':
+        user_n = func.substring(users.c.email, rf'^user(\d+)@{re.escape(MOCK_DOMAIN)}$')
+        post_n = func.substring(posts.c.url, r'^mock-(\d+)$')
+    else:                           # SQLite: CAST не-числа даёт 0
+        user_n = func.replace(func.substr(users.c.email, 5), f'@{MOCK_DOMAIN}', '')
+        post_n = func.substr(posts.c.url, 6)
+    max_user = conn.execute(select(func.max(cast(user_n, BigInteger)))
+                            .where(users.c.email.like(f'user%@{MOCK_DOMAIN}'))).scalar()
+    max_post = conn.execute(select(func.max(cast(post_n, BigInteger))).where(posts.c.url.like('mock-%'))).scalar()
+    return max_user or 0, max_post or 0
+
+
+def next_number(engine):
+    """С каких номеров продолжать: после последних выданных синтетических юзеров и статей"""
+    counters.create(engine, checkfirst=True)        # mock-база наполняется раньше upgrade_schema
+    with engine.connect() as conn:
+        rows = dict(conn.execute(select(counters.c.name, counters.c.value)
+                                 .where(counters.c.name.in_(SYNTHETIC_COUNTERS))).all())
+        if len(rows) < len(SYNTHETIC_COUNTERS):
+            rows = dict(zip(SYNTHETIC_COUNTERS, _max_numbers(conn)))
+    return rows[SYNTHETIC_COUNTERS[0]] + 1, rows[SYNTHETIC_COUNTERS[1]] + 1
+
+
+def reserve_numbers(engine, last_user, last_post):
+    """ Записать последние выданные номера заранее, до заливки: заливка, упавшая на середине,
+        оставит пропуск в номерах, но не повтор
+    """
+    with engine.begin() as conn:
+        for name, value in zip(SYNTHETIC_COUNTERS, (last_user, last_post)):
+            if not conn.execute(update(counters).where(counters.c.name == name).values(value=value)).rowcount:
+                conn.execute(insert(counters).values(name=name, value=value))
+
+
+def load(engine, table, rows_func, start, count, batch=BATCH, method='copy'):
+    """Залить count строк rows_func(start, n) пачками по batch строк"""
+    load_batch = copy_batch if method == 'copy' else insert_batch
+    started = time.monotonic()
+    for offset in range(0, count, batch):
+        load_batch(engine, table, rows_func(start + offset, min(batch, count - offset)))
+        done = min(offset + batch, count)
+        if done < count:
+            logger.info(f'{table.name}: {done} of {count}, {done / (time.monotonic() - started):.0f} rows/s')
+    elapsed = time.monotonic() - started
+    logger.info(f'{table.name}: {count} rows loaded in {elapsed:.1f} s, {count / max(elapsed, 1e-9):.0f} rows/s')
+
+
+def generate(engine, users_count, posts_count, batch=BATCH, method=None, defer_indexes=False,
+             avatars=AVATAR_SHARE, seed=1):
+    """ Сгенерировать и залить users_count юзеров и posts_count статей.
+        method: 'copy' (только PostgreSQL) или 'insert'; по умолчанию - copy, где он есть.
+        defer_indexes: неуникальные индексы users и posts снести перед заливкой и построить после -
+        один проход сортировки вместо обновления индекса на каждую строку. Уникальные остаются: по ним работают
+        ON CONFLICT запущенного сайта. Строит индексы migrate - CONCURRENTLY, с проверкой дублей.
+        В PostgreSQL триггер счётчика юзеров на время заливки выключается, а счётчик потом пересчитывается:
+        иначе каждая строка - это ещё и UPDATE одной и той же строки counters.
+    """
+    postgres = engine.dialect.name == 'postgresql'
+    method = method or ('copy' if postgres else 'insert')
+    if method == 'copy' and not postgres:
+        raise ValueError(f'COPY is available only in PostgreSQL, not in {engine.dialect.name}')
+
+    user_start, post_start = next_number(engine)
+    reserve_numbers(engine, user_start + users_count - 1, post_start + posts_count - 1)
+    logger.info(f'Generation started: {users_count} users from user{user_start}, {posts_count} posts '
+                f'from mock-{post_start}, method={method}, batch={batch}, defer_indexes={defer_indexes}')
+    synthetic = Synthetic(seed, avatars)
+    indexes = [index for table in (users, posts) for index in table.indexes
+               if not index.unique] if defer_indexes else []
+    for index in indexes:
+        index.drop(engine, checkfirst=True)
+    if postgres and users_count:
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE users DISABLE TRIGGER users_count'))
+    try:
+        load(engine, users, synthetic.users, user_start, users_count, batch, method)
+        load(engine, posts, synthetic.posts, post_start, posts_count, batch, method)
+    finally:
+        if postgres and users_count:
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE users ENABLE TRIGGER users_count'))
+                conn.execute(text("UPDATE counters SET value = (SELECT count(*) FROM users) WHERE name = 'users'"))
+        if indexes and (failed := migrate(engine)):
+            logger.error(f'Indexes not built: {", ".join(failed)}; run python manage.py migrate')
+    if postgres:
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('ANALYZE users'))
+            conn.execute(text('ANALYZE posts'))
+    posts_changed.send('posts')
+    logger.info(f'Generation ended')
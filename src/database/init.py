@@ -1,42 +1,246 @@
 import os
 import logging
 import datetime
+import hashlib
 
-from sqlalchemy import create_engine, URL, delete, insert
+from sqlalchemy import create_engine, URL, delete, insert, text, inspect
 
-from database.tables import metadata, main_menu, posts, users, all_db_tables
+from database.pool import MeteredQueuePool
+import database.mock
+import database.migrate
+import database.search
+from database.generate import SYNTHETIC_COUNTERS
+from database.tables import metadata, main_menu, posts, users, counters, all_db_tables, DDL_LOCK_TIMEOUT
+from database.services import invalidate_menu, make_anonce, posts_changed, UNIQUE_INDEXES
 
 logger = logging.getLogger(__name__)
 
+DEMO_TABLES = (main_menu, posts, users)     # без них сайт не работает - если хоть одной нет, заливаем демо-данные
+
 
 def db_connection(config):
     """ Инициализация базы и отзеркаливание (автоматическое построение описаний) уже имеющихся таблиц.
         :return: объект БД, объект всех таблиц, конфиг БД
     """
     logger.info(f'Database initialization started')
+    mock = config.get_db_type() == 'mock'
 
-    db_conf = URL.create('postgresql',
-                         database=config.get_db_name(),
-                         username=config.get_db_user(),
-                         password=config.get_db_pass(),
-                         host=config.get_db_host()
-                         )
-    engine = create_engine(db_conf)  # объект базы
-    all_db_tables.metadata.reflect(engine)  # наполняем его из базы именами всех таблиц и колонок с их свойствами
+    if mock:
+        db_conf = database.mock.mock_url(config)     # SQLite в памяти процесса
+    else:
+        db_conf = URL.create('postgresql',
+                             database=config.get_db_name(),
+                             username=config.get_db_user(),
+                             password=config.get_db_pass(),
+                             host=config.get_db_host(),
+                             port=config.get_db_port(),
+                             query=dict(sslmode=config.get_db_sslmode(), **config.get_db_ssl_files()),
+                             )
+
+    # пул: minconn соединений держим всегда, ещё (maxconn - minconn) открываем на пиках нагрузки
+    minconn, maxconn = config.get_db_minconn(), config.get_db_maxconn()
+    if maxconn < minconn:
+        logger.warning(f'maxconn={maxconn} < minconn={minconn}, pool will not grow above minconn')
+    pool_conf = dict(poolclass=MeteredQueuePool,
+                     pool_size=minconn,
+                     max_overflow=max(maxconn - minconn, 0),
+                     pool_pre_ping=config.get_db_pool_pre_ping(),
+                     pool_recycle=config.get_db_pool_recycle(),
+                     pool_timeout=config.get_db_pool_timeout(),
+                     )
+    if mock:
+        pool_conf['connect_args'] = dict(check_same_thread=False)   # соединения пула ходят по потокам cheroot
+    engine = create_engine(db_conf, **pool_conf)  # объект базы
+
+    if mock:
+        database.mock.keep_alive(engine)
+        with engine.connect() as conn:
+            upload_demo(engine, all_db_tables, conn)
+        database.mock.seed(engine, config.get_db_mock_users(), config.get_db_mock_posts())
+
+    found = len(metadata.tables) - len(missing_tables(engine, metadata.sorted_tables))  # только свои таблицы
 
     # красивое логирование параметров базы
     db_conf_dict = db_conf._asdict()
-    db_conf_dict.pop('query')
-    db_conf_dict['password'] = len(db_conf_dict['password']) * '*'
+    db_conf_dict['sslmode'] = db_conf_dict.pop('query').get('sslmode')
+    db_conf_dict['password'] = len(db_conf_dict['password'] or '') * '*'
     db_conf_dict['driver'] = engine.driver
     db_conf_dict['dialect'] = engine.dialect.name
-    db_conf_dict['total tables found'] = len(all_db_tables.metadata.sorted_tables)
+    db_conf_dict.update(pool_conf)
+    db_conf_dict['poolclass'] = MeteredQueuePool.__name__
+    db_conf_dict['own tables found'] = f'{found} of {len(metadata.tables)}'
+    if mock:
+        db_conf_dict['mock users/posts'] = f'{config.get_db_mock_users()}/{config.get_db_mock_posts()}'
     _ll = ''.join([f'\n\t{k:<25} \t= {v}' for k, v in db_conf_dict.items()])
     logger.fatal(f'Database initialized successfully: {_ll}')
 
     return engine, all_db_tables, db_conf
 
 
+def missing_tables(engine, tables=DEMO_TABLES):
+    """ Каких из таблиц tables нет в базе - по одному запросу к каталогу на таблицу, без отзеркаливания
+        всех таблиц базы со всеми колонками (на большой базе это секунды при каждом старте)
+        :return: список имён отсутствующих таблиц
+    """
+    inspector = inspect(engine)
+    return [table.name for table in tables if not inspector.has_table(table.name)]
+
+
+def async_db_connection(config):
+    """ Асинхронный движок базы (драйвер asyncpg) для асинхронной точки входа api, те же параметры из db.yml.
+        Таблицы не отзеркаливает и демо-данные не заливает - это делает основное приложение.
+        :return: асинхронный объект БД
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine     # asyncio-часть Алхимии нужна только здесь
+
+    if config.get_db_type() == 'mock':     # база в памяти чужого процесса отсюда не видна
+        raise RuntimeError('Mock database is available only in the WSGI server (main.py)')
+
+    db_conf = URL.create('postgresql+asyncpg',
+                         database=config.get_db_name(),
+                         username=config.get_db_user(),
+                         password=config.get_db_pass(),
+                         host=config.get_db_host(),
+                         port=config.get_db_port(),
+                         )
+    minconn, maxconn = config.get_db_minconn(), config.get_db_maxconn()
+    engine = create_async_engine(db_conf,
+                                 connect_args=dict(ssl=_asyncpg_ssl(config)),
+                                 pool_size=minconn,
+                                 max_overflow=max(maxconn - minconn, 0),
+                                 pool_pre_ping=config.get_db_pool_pre_ping(),
+                                 pool_recycle=config.get_db_pool_recycle(),
+                                 pool_timeout=config.get_db_pool_timeout(),
+                                 )
+    logger.fatal(f'Async database engine created: {engine.url.render_as_string(hide_password=True)}, '
+                 f'pool {minconn}..{maxconn}')
+    return engine
+
+
+def _asyncpg_ssl(config):
+    """ sslmode из db.yml в параметр ssl asyncpg: режим строкой, а если заданы сертификаты - SSL-контекст """
+    sslmode, files = config.get_db_sslmode(), config.get_db_ssl_files()
+    if sslmode == 'disable':
+        return False
+    if not files:
+        return sslmode
+
+    import ssl
+    context = ssl.create_default_context(cafile=files.get('sslrootcert'))
+    if sslmode != 'verify-full':
+        context.check_hostname = False
+    if sslmode not in ('verify-ca', 'verify-full'):
+        context.verify_mode = ssl.CERT_NONE
+    if files.get('sslcert'):
+        context.load_cert_chain(files['sslcert'], files.get('sslkey'))
+    return context
+
+
+# счётчик пользователей в counters ведёт триггер: +1 на INSERT, -1 на DELETE, 0 на TRUNCATE
+USERS_COUNT_FUNCTION = """
+CREATE OR REPLACE FUNCTION users_count_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE counters SET value = value - 1 WHERE name = 'users';
+    ELSE
+        UPDATE counters SET value = 0 WHERE name = 'users';
+    END IF;
+    RETURN NULL;
+END $$
+"""
+USERS_COUNT_TRIGGERS = (
+    'CREATE TRIGGER users_count AFTER INSERT OR DELETE ON users '
+    'FOR EACH ROW EXECUTE FUNCTION users_count_trg()',
+    'CREATE TRIGGER users_count_truncate AFTER TRUNCATE ON users '
+    'FOR EACH STATEMENT EXECUTE FUNCTION users_count_trg()',
+)
+
+USERS_COUNT_TRIGGERS_SQLITE = (
+    'CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users '
+    "BEGIN UPDATE counters SET value = value + 1 WHERE name = 'users'; END",
+    'CREATE TRIGGER IF NOT EXISTS users_count_delete AFTER DELETE ON users '
+    "BEGIN UPDATE counters SET value = value - 1 WHERE name = 'users'; END",
+)
+
+
+def upgrade_schema(engine, batch=1000):
+    """ Доведение уже существующих таблиц до описаний в tables.py: новые колонки, их наполнение, индексы.
+        Свежесозданные таблицы не меняет. Что уже есть - проверяется по каталогу базы заранее:
+        ALTER TABLE берёт ACCESS EXCLUSIVE даже с IF NOT EXISTS и встал бы в очередь за любым долгим запросом
+        к таблице, а за ним - весь сайт. Поэтому DDL и заполнение новых колонок - только один раз, когда колонки нет.
+        :return: имена индексов из tables.py, которых в базе нет
+    """
+    logger.info(f'Schema upgrade started')
+
+    postgres = engine.dialect.name == 'postgresql'
+    inspector = inspect(engine)
+    columns = {table: {column['name'] for column in inspector.get_columns(table)} for table in ('posts', 'users')}
+    new_anonce = 'anonce' not in columns['posts']
+    if postgres:    # mock-база (SQLite) всегда свежая, ей доводить нечего
+        if new_anonce or 'avatar_hash' not in columns['users']:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'"))    # не ждать долгие запросы
+                if new_anonce:
+                    conn.execute(text('ALTER TABLE posts ADD COLUMN anonce VARCHAR(256)'))
+                if 'avatar_hash' not in columns['users']:
+                    conn.execute(text('ALTER TABLE users ADD COLUMN avatar_hash VARCHAR(64)'))
+                    conn.execute(text("UPDATE users SET avatar_hash = encode(sha256(avatar), 'hex') "
+                                      "WHERE avatar IS NOT NULL"))
+        database.search.install(engine, 'search' in columns['posts'])  # новые статьи - в поиск сразу, старые - migrate
+
+    # анонсы старых статей считаем тем же кодом, что и при записи новых, пачками - только когда колонка новая;
+    # недозаполненное (старт прервали) дозаполнит python manage.py migrate
+    filled = database.migrate.fill_anonces(engine, batch) if new_anonce else 0
+
+    # индексы в Postgres строит manage.py migrate (CONCURRENTLY): обычный CREATE INDEX при старте
+    # заблокировал бы запись в большую таблицу на всё время построения
+    if postgres:
+        missing = database.migrate.missing_indexes(engine)
+        if missing:
+            logger.warning(f'Indexes missing or invalid: {", ".join(missing)} - run python manage.py migrate')
+        unchecked = [name for name in missing if name in UNIQUE_INDEXES]
+        if unchecked:
+            logger.error(f'Unique indexes {", ".join(unchecked)} missing: duplicates are checked by SELECT '
+                         f'and can race until python manage.py migrate is run and the server restarted')
+    else:
+        missing = database.migrate.migrate(engine)
+
+    counters.create(engine, checkfirst=True)
+    if postgres:
+        _users_count_trigger(engine)
+    else:
+        _users_count_trigger_sqlite(engine)
+
+    logger.info(f'Schema upgrade ended, {filled} post anonces filled')
+    return missing
+
+
+def _users_count_trigger(engine):
+    """Триггер счётчика юзеров в PostgreSQL, если его ещё нет"""
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname = 'users_count'")).first():
+            # триггера нет - ставим его и пересчитываем счётчик; блокировка users на запись держится до коммита,
+            # поэтому между подсчётом и триггером ни одна вставка не потеряется
+            conn.execute(text('LOCK TABLE users IN SHARE ROW EXCLUSIVE MODE'))
+            conn.execute(text(USERS_COUNT_FUNCTION))
+            for trigger in USERS_COUNT_TRIGGERS:
+                conn.execute(text(trigger))
+            conn.execute(text("INSERT INTO counters (name, value) SELECT 'users', count(*) FROM users "
+                              "ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value"))
+            logger.info(f'Users count trigger created')
+
+
+def _users_count_trigger_sqlite(engine):
+    """Те же триггеры для mock-базы: в SQLite нет TRUNCATE и функций, тело триггера пишется прямо в нём"""
+    with engine.begin() as conn:
+        for trigger in USERS_COUNT_TRIGGERS_SQLITE:
+            conn.execute(text(trigger))
+        conn.execute(text("INSERT INTO counters (name, value) SELECT 'users', count(*) FROM users WHERE true "
+                          "ON CONFLICT (name) DO UPDATE SET value = excluded.value"))
+
+
 def upload_demo(engine, all_db_tables, conn, force=False):
     """
     Заполнение таблиц демо-данными
@@ -46,7 +250,7 @@ def upload_demo(engine, all_db_tables, conn, force=False):
     """
     logger.info(f'Upload demo data started, force={force}')
 
-    if force: all_db_tables.metadata.drop_all(engine)  # удалить все таблицы из БД
+    if force: metadata.drop_all(engine)  # удалить все наши таблицы из БД
 
     # Заполняем таблицы БД (двумя способами в учебных целях) ----------------------------------------------------------
     # Способ 1 current alchemy release через коннект и выполнение sql-запроса
@@ -66,70 +270,51 @@ def upload_demo(engine, all_db_tables, conn, force=False):
             {'title': 'Донаты', 'url': '/donate'},
         ]
     )
-    conn.commit()  # запись в базу
-
     query = delete(posts)
     _cursor = conn.execute(query)
-    _cursor = conn.execute(
-        insert(posts),
-        [
-            {'title': 'Про Flask', 'url': 'framework-flask-intro', 'time': datetime.datetime.now(),
+    now = datetime.datetime.now()
+    demo_posts = [
+            {'title': 'Про Flask', 'url': 'framework-flask-intro', 'time': now,
              'text': '<p>Flask — это легковесный веб-фреймворк для языка Python, который предоставляет минимальный '
                      'набор инструментов для создания веб-приложений. <br>На нём можно сделать и лендинг, и '
                      'многостраничный сайт с кучей плагинов и сервисов. <br>Не фреймворк, а мечта!'},
-            {'title': 'Про SQLAlchemy', 'url': 'framework-sqlalchemy-intro', 'time': datetime.datetime.now(),
+            {'title': 'Про SQLAlchemy', 'url': 'framework-sqlalchemy-intro', 'time': now,
              'text': 'Сила SQLAlchemy — в её ORM. Расшифровывается как object relational mapper, или '
                      '«объектно-реляционное отображение». <br>ORM позволяет управлять базами данных с помощью '
                      'методов объектов в коде и при этом не использовать SQL-запросы. <br>На самом деле это очень удобно, '
                      'так как позволяет писать привычный код, не переключаясь на SQL.'},
-            {'title': 'Про Python', 'url': 'python-intro', 'time': datetime.datetime.now(),
+            {'title': 'Про Python', 'url': 'python-intro', 'time': now,
              'text': 'Python — это скриптовый язык программирования.     <br>Он универсален, поэтому подходит для '
                      'решения разнообразных задач и для многих платформ: начиная с iOS и Android и заканчивая '
                      'серверными операционными системами. <br>Это интерпретируемый язык, а не компилируемый, '
                      'как C++ или Java. Программа на Python представляет собой обычный текстовый файл.'},
-            {'title': 'Про API', 'url': 'about_api', 'time': datetime.datetime.now(),
+            {'title': 'Про API', 'url': 'about_api', 'time': now,
              'text': 'К этому сайту можно обращаться через api:<br>'
                      '/api/v1/users/count<br>'
                      '/api/v1/users/list<br>'
                      'Это неплохой пример, т.к. любое api в конце концов сводится к вычислениями над базой.'},
         ]
-    )
-    conn.commit()
+    for post in demo_posts:
+        post['anonce'] = make_anonce(post['text'])
+    _cursor = conn.execute(insert(posts), demo_posts)
 
     query = delete(users)
     _cursor = conn.execute(query)
+    _cursor = conn.execute(delete(counters).where(counters.c.name.in_(SYNTHETIC_COUNTERS)))  # номера - заново
 
-    _cursor = conn.execute(
-        insert(users),
-        [
-            {'name': 'Lee Ji-Eun', 'email': 'iu@ya.ru', 'time': datetime.datetime.now(),
-             'psw': 'pbkdf2:sha256:600000$E6zeNcWAdMGRxtAs$7dde9af9ea97e3b978e5e40a89d0e40536f7e199079f29b9be85986a1608aaa8'},
-            {'name': 'Uam12345', 'email': 'u@ya.ru', 'time': datetime.datetime.now(),
-             'psw': 'pbkdf2:sha256:600000$E6zeNcWAdMGRxtAs$7dde9af9ea97e3b978e5e40a89d0e40536f7e199079f29b9be85986a1608aaa8'},
-            {'name': 'Sil12345', 'email': 's@ya.ru', 'time': datetime.datetime.now(),
-             'psw': 'pbkdf2:sha256:600000$E6zeNcWAdMGRxtAs$7dde9af9ea97e3b978e5e40a89d0e40536f7e199079f29b9be85986a1608aaa8'}
-        ]
-    )
-    # дописываем (UPDATE) аватарку Сила - Знайку
-    with open(os.path.join(os.environ.get('APP_PATH'), 'site', 'static', 'images', 'znaika.jpg'), "rb") as f:
-        avatar = f.read()
-        query = users.update().where(users.c.name == 'Sil12345').values(avatar=avatar)
-        conn.execute(query)
-    conn.commit()
-
-    # дописываем мою аватарку
-    with open(os.path.join(os.environ.get('APP_PATH'), 'site', 'static', 'images', 'admin.jpg'), "rb") as f:
-        avatar = f.read()
-        query = users.update().where(users.c.name == 'Uam12345').values(avatar=avatar)
-        conn.execute(query)
-    conn.commit()
-
-    # и аватарку дорогой IU
-    with open(os.path.join(os.environ.get('APP_PATH'), 'site', 'static', 'images', 'iu.jpg'), "rb") as f:
-        avatar = f.read()
-        query = users.update().where(users.c.name == 'Lee Ji-Eun').values(avatar=avatar)
-        conn.execute(query)
-    conn.commit()
+    # аватарки - сразу в строках юзеров: Сил - Знайка, моя, и дорогой IU
+    psw = 'pbkdf2:sha256:600000$E6zeNcWAdMGRxtAs$7dde9af9ea97e3b978e5e40a89d0e40536f7e199079f29b9be85986a1608aaa8'
+    demo_users = [
+        {'name': 'Lee Ji-Eun', 'email': 'iu@ya.ru', 'time': now, 'psw': psw, 'avatar': _demo_image('iu.jpg')},
+        {'name': 'Uam12345', 'email': 'u@ya.ru', 'time': now, 'psw': psw, 'avatar': _demo_image('admin.jpg')},
+        {'name': 'Sil12345', 'email': 's@ya.ru', 'time': now, 'psw': psw, 'avatar': _demo_image('znaika.jpg')},
+    ]
+    for user in demo_users:
+        user['avatar_hash'] = hashlib.sha256(user['avatar']).hexdigest()
+    _cursor = conn.execute(insert(users), demo_users)
+    conn.commit()  # запись в базу - всё демо-наполнение одной транзакцией
+    invalidate_menu()
+    posts_changed.send('posts')
 
     # Способ 2 через сессию ------------------------------------------------------------------------------------
     # all_db_tables.metadata.create_all(engine)           # по описанию создать пустые таблицы
@@ -141,7 +326,12 @@ def upload_demo(engine, all_db_tables, conn, force=False):
     # session.add_all([u_1, u_2, u_3])                    # добавляем три строки
     # session.commit()                                    # записываем в базу
 
-    all_db_tables.metadata.reflect(engine)      # для логирования - перечитываем, сколько сейчас есть таблиц
-    logger.info(f'Upload demo data ended, {len(all_db_tables.metadata.sorted_tables)} tables (re)created')
+    logger.info(f'Upload demo data ended, {len(metadata.tables)} tables (re)created')
 
     return None
+
+
+def _demo_image(name):
+    """Картинка из статики сайта - аватар демо-юзера"""
+    with open(os.path.join(os.environ.get('APP_PATH'), 'site', 'static', 'images', name), 'rb') as f:
+        return f.read()
@@ -0,0 +1,215 @@
+"""
+    Индексы из tables.py - в уже существующую базу, не останавливая сайт: python manage.py migrate.
+    В PostgreSQL индекс строится CREATE INDEX CONCURRENTLY - без блокировки записи в таблицу, пусть и дольше.
+    Перед уникальным индексом ищутся дубли: если они есть, индекс не строится, а дубли выводятся в лог -
+    разобраться с ними надо руками. Неудавшееся построение CONCURRENTLY оставляет невалидный индекс (INVALID):
+    он не используется, но тормозит запись - такой сносится и строится заново.
+    Заодно (fill_anonces) дозаполняются анонсы статей, если их заполнение при старте было прервано.
+    В PostgreSQL migrate ещё заполняет колонку полнотекстового поиска у старых статей и строит по ней GIN-индекс
+    (database.search).
+    python manage.py check-indexes - EXPLAIN каждого запроса из database.queries: идёт ли он по индексу.
+"""
+import time
+import logging
+import datetime
+
+from sqlalchemy import select, update, func, text, inspect
+from sqlalchemy.exc import DBAPIError
+
+from database.tables import users, posts
+from database.services import make_anonce
+from database.search import SEARCH_INDEX, search_query, install, backfill
+from database.queries import (post_by_url_query, posts_page_query, user_by_id_query, user_by_email_query,
+                              avatar_query, users_page_query)
+
+logger = logging.getLogger(__name__)
+
+INDEXED_TABLES = (users, posts)
+DUPLICATES_SHOWN = 10       # сколько групп дублей показать в логе
+
+
+def existing_indexes(engine):
+    """Индексы таблиц INDEXED_TABLES, которые уже есть в базе: {имя: валиден ли}"""
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as conn:
+            rows = conn.execute(text('SELECT i.relname, x.indisvalid FROM pg_index x '
+                                     'JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_class t ON t.oid = x.indrelid '
+                                     'WHERE t.relname = ANY(:tables) AND pg_table_is_visible(t.oid)'),
+                                {'tables': [table.name for table in INDEXED_TABLES]}).all()
+        return {name: valid for name, valid in rows}
+    inspector = inspect(engine)
+    return {index['name']: True for table in INDEXED_TABLES for index in inspector.get_indexes(table.name)}
+
+
+def duplicates(conn, index):
+    """Значения, которые встречаются больше одного раза, - уникальный индекс по ним не построить"""
+    columns = list(index.columns)
+    query = (select(*columns, func.count().label('count')).group_by(*columns)
+             .having(func.count() > 1).order_by(func.count().desc()).limit(DUPLICATES_SHOWN))
+    return conn.execute(query).all()
+
+
+def _create_concurrently(engine, name, table, spec, unique=False, invalid=False):
+    """ CREATE INDEX CONCURRENTLY нельзя в транзакции - соединение в autocommit.
+        spec - всё, что после имени таблицы: (колонки) или USING gin (колонка)
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('SET statement_timeout = 0'))         # на большой таблице это минуты
+        if invalid:
+            logger.warning(f'Index {name} is INVALID (failed concurrent build), rebuilding it')
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {quote(name)}'))
+        try:
+            conn.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX CONCURRENTLY {quote(name)} '
+                              f'ON {quote(table)} {spec}'))
+        except DBAPIError:
+            # дубль, появившийся во время построения, или отмена - индекс остаётся INVALID, убираем его
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {quote(name)}'))
+            raise
+        conn.execute(text(f'ANALYZE {quote(table)}'))
+
+
+def fill_anonces(engine, batch=1000):
+    """Анонсы статей, у которых их нет, пачками по batch строк - каждая своей транзакцией"""
+    filled = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select(posts.c.id, posts.c.text).where(posts.c.anonce.is_(None)).limit(batch)).all()
+            for row in rows:
+                conn.execute(update(posts).where(posts.c.id == row.id).values(anonce=make_anonce(row.text)))
+        filled += len(rows)
+        if len(rows) < batch:
+            break
+    return filled
+
+
+def migrate(engine, dry_run=False):
+    """ Построить недостающие индексы из tables.py
+        :return: имена индексов, которые построить не удалось
+    """
+    postgres = engine.dialect.name == 'postgresql'
+    existing = existing_indexes(engine)
+    failed = []
+    for index in (index for table in INDEXED_TABLES for index in sorted(table.indexes, key=lambda i: i.name)):
+        if existing.get(index.name):
+            logger.info(f'Index {index.name} exists')
+            continue
+        if index.unique:
+            with engine.connect() as conn:
+                dups = duplicates(conn, index)
+            if dups:
+                logger.error(f'Index {index.name} not created: duplicate values in {index.table.name} '
+                             f'(first {len(dups)} groups shown, value - count):'
+                             + ''.join(f'\n\t{tuple(row)[:-1]} - {row.count}' for row in dups))
+                failed.append(index.name)
+                continue
+        if dry_run:
+            logger.info(f'Index {index.name} will be created')
+            continue
+
+        started = time.monotonic()
+        try:
+            if postgres:
+                quote = engine.dialect.identifier_preparer.quote
+                _create_concurrently(engine, index.name, index.table.name,
+                                     f'({", ".join(quote(column.name) for column in index.columns)})',
+                                     unique=index.unique, invalid=index.name in existing)
+            else:
+                index.create(engine)
+        except DBAPIError as e:
+            logger.error(f'Index {index.name} not created: {e.orig}')
+            failed.append(index.name)
+            continue
+        logger.info(f'Index {index.name} created in {time.monotonic() - started:.1f} s')
+
+    if postgres and not _search_index(engine, existing, dry_run):
+        failed.append(SEARCH_INDEX)
+    return failed
+
+
+def _search_index(engine, existing, dry_run):
+    """Колонка поиска у статей, которые были до триггера, и GIN-индекс по ней. False - построить не удалось"""
+    if dry_run:
+        logger.info(f'Posts search will be filled, index {SEARCH_INDEX} '
+                    f'{"exists" if existing.get(SEARCH_INDEX) else "will be created"}')
+        return True
+    install(engine)
+    backfill(engine)
+    if existing.get(SEARCH_INDEX):
+        logger.info(f'Index {SEARCH_INDEX} exists')
+        return True
+    started = time.monotonic()
+    try:
+        _create_concurrently(engine, SEARCH_INDEX, posts.name, 'USING gin (search)',
+                             invalid=SEARCH_INDEX in existing)
+    except DBAPIError as e:
+        logger.error(f'Index {SEARCH_INDEX} not created: {e.orig}')
+        return False
+    logger.info(f'Index {SEARCH_INDEX} created in {time.monotonic() - started:.1f} s')
+    return True
+
+
+def missing_indexes(engine):
+    """Индексы из tables.py, которых в базе нет или которые невалидны - для предупреждения при старте"""
+    existing = existing_indexes(engine)
+    names = [index.name for table in INDEXED_TABLES for index in table.indexes]
+    if engine.dialect.name == 'postgresql':
+        names.append(SEARCH_INDEX)
+    return [name for name in names if not existing.get(name)]
+
+
+# ----------------------------------- проверка планов -----------------------------------------------------------------
+def index_checks(dialect):
+    """ Запросы, которые обязаны идти по индексу, с правдоподобными параметрами.
+        Меню сюда не входит: это крошечная таблица, читаемая целиком и через кэш.
+        Поиск - только в PostgreSQL: в mock-базе это LIKE, полный просмотр по определению.
+    """
+    now = datetime.datetime.now()
+    search = [('search', search_query(dialect, 'индекс', 11, 0))] if dialect == 'postgresql' else []
+    return search + [('getPost', post_by_url_query('python-intro')),
+            ('getPostsAnonce', posts_page_query(21)),
+            ('getPostsAnonce after', posts_page_query(21, (now, 1))),
+            ('getUser', user_by_id_query(1)),
+            ('getUserByEmail', user_by_email_query('u@ya.ru')),
+            ('getAvatar', avatar_query(1)),
+            ('api users/list', users_page_query(100, 0))]
+
+
+def explain(conn, query):
+    """ План запроса строками. В PostgreSQL полный просмотр таблицы запрещён (enable_seqscan = off):
+        на маленькой таблице планировщик его выбирает и при наличии индекса, а так Seq Scan в плане
+        останется, только если подходящего индекса нет вовсе
+    """
+    compiled = query.compile(dialect=conn.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if conn.dialect.name == 'postgresql':
+        with conn.begin():
+            conn.execute(text('SET LOCAL enable_seqscan = off'))
+            rows = conn.exec_driver_sql(f'EXPLAIN {compiled.string}', params).all()
+        return [row[0] for row in rows]
+    return [str(row[-1]) for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled.string}', params).all()]
+
+
+def full_scan(plan, dialect):
+    """Есть ли в плане полный просмотр таблицы"""
+    if dialect == 'postgresql':
+        return any('Seq Scan' in line for line in plan)
+    return any(line.startswith('SCAN ') and ' USING ' not in line for line in plan)     # SQLite: SCAN t без индекса
+
+
+def check_indexes(engine):
+    """ EXPLAIN каждого запроса из index_checks()
+        :return: названия запросов, которые идут полным просмотром таблицы
+    """
+    bad = []
+    with engine.connect() as conn:
+        for name, query in index_checks(engine.dialect.name):
+            plan = explain(conn, query)
+            scan = full_scan(plan, engine.dialect.name)
+            (logger.error if scan else logger.info)(f'{name}: {"FULL SCAN" if scan else "index"}'
+                                                    + ''.join(f'\n\t{line}' for line in plan))
+            if scan:
+                bad.append(name)
+    return bad
@@ -0,0 +1,43 @@
+"""
+    Mock-база: SQLite целиком в памяти процесса, вместо PostgreSQL (db.yml: type: mock).
+    Таблицы те же (tables.py), код сайта и api - тот же (FDataBase, Session), меняется только движок.
+    Нужна, чтобы мерить накладные расходы Flask/cheroot/Jinja без сети и без базы,
+    и гонять нагрузочные тесты там, где Postgres нет.
+    База живёт, пока открыто хоть одно соединение с ней, поэтому одно соединение держим всегда.
+    В prefork-режиме у каждого рабочего процесса своя копия базы: записи одного процесса другие не видят.
+"""
+import logging
+
+from sqlalchemy import URL
+
+logger = logging.getLogger(__name__)
+
+MOCK_PASSWORD = 'mock12345'     # пароль всех синтетических юзеров - для нагрузочных тестов логина
+MOCK_DOMAIN = 'mock.example.com'    # домен их почты; .local валидатор Email формы логина не пропускает
+SEED_BATCH = 1000               # строк в одном INSERT при заливке
+
+_keeper = None                  # соединение, которое не даёт базе в памяти исчезнуть
+
+
+def mock_url(config):
+    """ Именованная база в памяти (VFS memdb): все соединения пула видят одну и ту же базу,
+        а блокировки - обычные файловые, с ожиданием (timeout), а не мгновенной ошибкой, как у shared cache
+    """
+    return URL.create('sqlite', database=f'file:/{config.get_db_name()}', query=dict(vfs='memdb', uri='true'))
+
+
+def keep_alive(engine):
+    """Открыть и не закрывать одно соединение - пока оно есть, база в памяти жива"""
+    global _keeper
+    _keeper = engine.raw_connection()
+    _keeper.detach()        # из пула убираем: пул его не закроет ни при recycle, ни при dispose
+    return _keeper
+
+
+def seed(engine, users_count, posts_count, batch=SEED_BATCH):
+    """ Синтетические юзеры (user<N>@MOCK_DOMAIN, пароль MOCK_PASSWORD) и статьи (mock-<N>) пачками по batch строк.
+        Это тот же генератор, что у manage.py generate, только без аватаров - база в памяти.
+        Зерно случайных чисел фиксированное - от запуска к запуску данные одинаковые.
+    """
+    from database.generate import generate      # генератор берёт константы отсюда - импорт только здесь
+    generate(engine, users_count, posts_count, batch=batch, method='insert', avatars=0)
@@ -0,0 +1,104 @@
+import time
+import threading
+
+from sqlalchemy import exc
+from sqlalchemy.util import queue as sqla_queue
+from sqlalchemy.pool import QueuePool
+
+
+class MeteredQueuePool(QueuePool):
+    """ Обычный QueuePool Алхимии, который дополнительно считает выдачи соединений,
+        время ожидания свободного соединения и отказы по таймауту.
+        Статистика переживает пересоздание пула (engine.dispose()).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        self._nested = threading.local()   # QueuePool._do_get рекурсивен, меряем только внешний вызов
+
+    def _do_get(self):
+        if getattr(self._nested, 'active', False):
+            return super()._do_get()
+
+        self._nested.active = True
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.add_timeout()
+            raise
+        finally:
+            self._nested.active = False
+            self.stats.add_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def resize(self, pool_size, max_overflow, timeout=None, recycle=None, pre_ping=None):
+        """ Поменять размеры пула на ходу, не трогая выданные соединения.
+            Счётчик _overflow у QueuePool - это (открыто соединений - pool_size), его сдвигаем на разницу размеров.
+            Лишние свободные соединения при уменьшении закрываем сразу, выданные - по мере возврата в пул.
+        """
+        with self._overflow_lock:
+            self._overflow += self._pool.maxsize - pool_size
+            self._pool.maxsize = pool_size
+            self._max_overflow = max_overflow
+        if timeout is not None:
+            self._timeout = timeout
+        if recycle is not None:
+            self._recycle = recycle
+        if pre_ping is not None:
+            self._pre_ping = pre_ping
+
+        while self._pool.qsize() > pool_size:
+            try:
+                record = self._pool.get(False)
+            except sqla_queue.Empty:
+                break
+            try:
+                record.close()
+            finally:
+                self._dec_overflow()
+
+    def metrics(self):
+        """Текущее состояние пула и накопленная статистика ожиданий, словарь"""
+        res = dict(
+            pool_size=self.size(),                  # сколько соединений пул держит постоянно (minconn)
+            max_overflow=self._max_overflow,        # сколько можно открыть сверх pool_size (maxconn - minconn)
+            checked_in=self.checkedin(),            # свободные соединения в пуле
+            checked_out=self.checkedout(),          # выданные прямо сейчас
+            overflow=self.overflow(),               # открытые сверх pool_size (может быть < 0, пока пул не набран)
+        )
+        res.update(self.stats.snapshot())
+        return res
+
+
+class PoolStats:
+    """ Счётчики выдачи соединений из пула """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def add_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def add_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                checkouts=self.checkouts,
+                timeouts=self.timeouts,
+                wait_avg_ms=round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                wait_max_ms=round(1000 * self.wait_max, 3),
+            )
@@ -0,0 +1,113 @@
+"""
+    SQL-запросы сайта и api, собранные в одном месте: их используют и роуты, и FDataBase, и всё, что работает
+    с теми же данными, - и проверка планов (python manage.py check-indexes), что каждый из них идёт по индексу.
+"""
+from sqlalchemy import select, insert, func, text, tuple_, literal, exists, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from database.tables import users, posts, counters
+
+USERS_PAGE_DEFAULT = 100    # размер страницы списка юзеров по умолчанию
+USERS_PAGE_MAX = 1000       # и максимальный
+STREAM_BATCH = 1000         # по сколько строк за раз тянуть из серверного курсора в потоковом режиме
+
+
+def users_page_query(limit=None, after=0):
+    """Пользователи по возрастанию id, начиная после id=after; limit=None - все до конца"""
+    query = select(users.c.id, users.c.name, users.c.email).where(users.c.id > after).order_by(users.c.id)
+    return query.limit(limit) if limit else query
+
+
+def users_count_query():
+    """Количество пользователей из счётчика, который ведёт триггер"""
+    return select(counters.c.value).where(counters.c.name == 'users')
+
+
+def users_count_full_query():
+    """Честный count(*) по таблице - запасной вариант, если счётчика нет"""
+    return select(func.count()).select_from(users)
+
+
+def users_estimate_query():
+    """Оценка количества пользователей планировщиком PostgreSQL, -1 если таблицу ещё не анализировали"""
+    return text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass('users')")
+
+
+# ----------------------------------- запросы FDataBase ----------------------------------------------------------------
+USER_COLUMNS = (users.c.id, users.c.name, users.c.email, users.c.avatar_hash)  # всё о юзере, кроме пароля и аватара
+
+
+def post_by_url_query(url):
+    """Статья по её url (алиасу) - уникальный индекс ux_posts_url"""
+    return select(posts.c.title, posts.c.text).where(posts.c.url == url).limit(1)
+
+
+def posts_page_query(limit, key=None):
+    """Страница анонсов от новых к старым, после статьи с ключом key=(time, id) - индекс ix_posts_time_id"""
+    query = (select(posts.c.id, posts.c.title, posts.c.url, posts.c.anonce, posts.c.time)
+             .order_by(posts.c.time.desc(), posts.c.id.desc())
+             .limit(limit))
+    return query.where(tuple_(posts.c.time, posts.c.id) < tuple_(*key)) if key else query
+
+
+def user_by_id_query(user_id):
+    """Юзер по id, без пароля - первичный ключ"""
+    return select(*USER_COLUMNS).where(users.c.id == user_id).limit(1)
+
+
+def user_by_email_query(email):
+    """Юзер по email вместе с хэшем пароля - уникальный индекс ux_users_email"""
+    return select(*USER_COLUMNS, users.c.psw).where(users.c.email == email).limit(1)
+
+
+def avatar_query(user_id):
+    """Картинка аватара юзера - первичный ключ"""
+    return select(users.c.avatar).where(users.c.id == user_id).limit(1)
+
+
+class utcnow(FunctionElement):
+    """ Текущее время UTC без зоны - время базы, а не сервера приложения (колонки time - DateTime без зоны).
+        В PostgreSQL это время начала транзакции, как у now(), в SQLite - время запроса.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kwargs):
+    return "timezone('utc', now())"
+
+
+@compiles(utcnow)
+def _utcnow_sqlite(element, compiler, **kwargs):
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"       # CURRENT_TIMESTAMP в SQLite - только с точностью до секунды
+
+
+def _insert_unique(table, dialect, key, values, unique):
+    """ Вставка строки, если значения колонки key ещё нет; в RETURNING - id, пусто - дубль.
+        unique=True - уникальный индекс по key в базе есть: INSERT ... ON CONFLICT (key) DO NOTHING, без гонок.
+        unique=False - индекса ещё нет (не прогнан manage.py migrate), ON CONFLICT без него дубль не поймает:
+        INSERT ... SELECT ... WHERE NOT EXISTS - та же проверка через SELECT, что и раньше, но одним запросом
+    """
+    if unique:
+        query = ((postgresql if dialect == 'postgresql' else sqlite).insert(table)
+                 .on_conflict_do_nothing(index_elements=[key]).values(**values))
+    else:
+        columns = list(values)
+        row = select(*(values[name] if name == 'time' else literal(values[name], table.c[name].type)
+                       for name in columns))
+        query = insert(table).from_select(columns, row.where(~exists().where(table.c[key] == values[key])))
+    return query.returning(table.c.id)
+
+
+def add_user_query(dialect, name, email, psw, unique=True):
+    """Новый юзер за один запрос; id в ответе - добавлен, пусто - такой email уже есть (ux_users_email)"""
+    return _insert_unique(users, dialect, 'email', dict(name=name, email=email, psw=psw, time=utcnow()), unique)
+
+
+def add_post_query(dialect, title, text, url, anonce, unique=True):
+    """Новая статья за один запрос; id в ответе - добавлена, пусто - такой url уже есть (ux_posts_url)"""
+    return _insert_unique(posts, dialect, 'url', dict(title=title, text=text, url=url, anonce=anonce, time=utcnow()),
+                          unique)
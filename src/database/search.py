@@ -0,0 +1,180 @@
+"""
+    Полнотекстовый поиск по статьям.
+    PostgreSQL: колонка posts.search (tsvector: заголовок с весом A, текст - B), её заполняет триггер при INSERT
+    и при UPDATE заголовка или текста, поиск идёт по GIN-индексу ix_posts_search. Запрос - в синтаксисе
+    websearch_to_tsquery ("фраза в кавычках", -исключить, or), ранжирование ts_rank_cd, подсветка ts_headline -
+    только для строк страницы, после LIMIT.
+    Колонку и триггер ставит upgrade_schema при старте (это быстро), а старые статьи заполняет и индекс строит
+    python manage.py migrate (это долго, и без блокировки записи).
+    Mock-база (SQLite): поиск подстрок через LIKE по всем словам запроса - без индекса, но с тем же ответом.
+    Ответы на популярные запросы держит LRU-кэш; любое изменение статей его сбрасывает (сигнал posts_changed).
+"""
+import re
+import logging
+
+from markupsafe import Markup, escape
+from sqlalchemy import select, func, text, literal, literal_column, and_, or_, case, desc, false, inspect
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from database.tables import posts, DDL_LOCK_TIMEOUT
+from database.cache import LRUCache
+from database.services import posts_changed
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'russian'           # словари и стемминг to_tsvector
+SEARCH_INDEX = 'ix_posts_search'
+SEARCH_PAGE_DEFAULT = 10            # результатов на странице по умолчанию
+SEARCH_PAGE_MAX = 50                # и максимум
+SEARCH_PAGES_MAX = 50               # дальше 50-й страницы не листаем: OFFSET читает и выбрасывает все строки до неё
+QUERY_MAX = 200                     # длиннее запрос обрезается
+SNIPPET_CHARS = 200                 # длина сниппета mock-поиска
+MARK_START, MARK_STOP = '\x02', '\x03'  # границы подсветки в сниппете из базы - потом экранирование и <mark>
+
+SEARCH_COLUMN = "ALTER TABLE posts ADD COLUMN search tsvector"
+SEARCH_VECTOR = (f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({{0}}title, '')), 'A') || "
+                 f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({{0}}text, '')), 'B')")
+SEARCH_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION posts_search_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search := {SEARCH_VECTOR.format('NEW.')};
+    RETURN NEW;
+END $$
+"""
+SEARCH_TRIGGER = ('CREATE TRIGGER posts_search BEFORE INSERT OR UPDATE OF title, text ON posts '
+                  'FOR EACH ROW EXECUTE FUNCTION posts_search_trg()')
+HEADLINE_OPTIONS = f'MaxFragments=2, MaxWords=30, MinWords=12, StartSel={MARK_START}, StopSel={MARK_STOP}'
+
+search_cache = LRUCache(maxsize=1000, ttl=300)     # ответы на запросы (запрос, страница, размер); размер и ttl - из конфига
+
+
+def _on_posts_changed(sender, **kwargs):
+    search_cache.clear()
+
+
+posts_changed.connect(_on_posts_changed)
+
+
+# ----------------------------------- схема (PostgreSQL) --------------------------------------------------------------
+def install(engine, has_column=None):
+    """ Колонка search и триггер, который её заполняет, - если их ещё нет. Старые статьи - backfill().
+        Если всё на месте, ни DDL, ни блокировок: только чтение каталога
+    """
+    if has_column is None:
+        has_column = 'search' in {column['name'] for column in inspect(engine).get_columns('posts')}
+    with engine.begin() as conn:
+        has_trigger = conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname = 'posts_search'")).first()
+        if has_column and has_trigger:
+            return
+        conn.execute(text(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+        if not has_column:
+            conn.execute(text(SEARCH_COLUMN))
+        conn.execute(text(SEARCH_FUNCTION))
+        if not has_trigger:
+            conn.execute(text(SEARCH_TRIGGER))
+        logger.info(f'Posts search column and trigger created')
+
+
+def backfill(engine, batch=1000):
+    """Заполнить search у статей, где её ещё нет, пачками по batch строк - каждая своей короткой транзакцией"""
+    filled = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(f'UPDATE posts SET search = {SEARCH_VECTOR.format("")} WHERE id IN '
+                                     f'(SELECT id FROM posts WHERE search IS NULL LIMIT :batch)'),
+                                {'batch': batch}).rowcount
+        filled += rows
+        if rows < batch:
+            break
+    if filled:
+        logger.info(f'Posts search filled for {filled} posts')
+    return filled
+
+
+# ----------------------------------- запросы -------------------------------------------------------------------------
+def search_query(dialect, q, limit, offset):
+    """Страница результатов поиска: id, title, url, time, rank, snippet; лучшие - первыми"""
+    if dialect == 'postgresql':
+        return _search_query_postgresql(q, limit, offset)
+    return _search_query_like(q, limit, offset)
+
+
+def _search_query_postgresql(q, limit, offset):
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    vector = literal_column('posts.search', TSVECTOR())
+    rank = func.ts_rank_cd(vector, tsquery).label('rank')
+    page = (select(posts.c.id, posts.c.title, posts.c.url, posts.c.text, posts.c.time, rank)
+            .where(vector.op('@@')(tsquery))
+            .order_by(desc('rank'), posts.c.id.desc())
+            .limit(limit).offset(offset)
+            .subquery())
+    plain = func.regexp_replace(page.c.text, '<[^>]+>', ' ', 'g')     # теги статьи в сниппет не нужны
+    return (select(page.c.id, page.c.title, page.c.url, page.c.time, page.c.rank,
+                   func.ts_headline(SEARCH_CONFIG, plain, tsquery, HEADLINE_OPTIONS).label('snippet'))
+            .order_by(page.c.rank.desc(), page.c.id.desc()))
+
+
+def _terms(q):
+    """Слова запроса для LIKE-поиска: буквы, цифры и подчёркивание"""
+    return [term for term in re.findall(r'\w+', q.lower()) if len(term) > 1][:10]
+
+
+def _search_query_like(q, limit, offset):
+    """Mock-поиск: все слова запроса должны встретиться в заголовке или тексте; совпадение в заголовке весит больше"""
+    terms = _terms(q)
+    title, body = func.lower(posts.c.title), func.lower(posts.c.text)
+
+    def has(column, term):
+        return column.contains(term, autoescape=True)       # "_" и "%" в слове - сами символы, а не шаблон
+
+    rank = sum((case((has(title, term), 2), else_=0) + case((has(body, term), 1), else_=0)
+                for term in terms), literal(0)).label('rank')
+    found = and_(*(or_(has(title, term), has(body, term)) for term in terms)) if terms else false()
+    return (select(posts.c.id, posts.c.title, posts.c.url, posts.c.time, rank, posts.c.text.label('snippet'))
+            .where(found)
+            .order_by(desc('rank'), posts.c.time.desc(), posts.c.id.desc())
+            .limit(limit).offset(offset))
+
+
+def _like_snippet(html, q):
+    """Сниппет mock-поиска: кусок текста вокруг первого найденного слова, слова запроса - в границах подсветки"""
+    plain = re.sub(r'\s+', ' ', re.sub(r'<[^>]+>', ' ', html)).strip()
+    terms = _terms(q)
+    lower = plain.lower()
+    first = min((pos for pos in (lower.find(term) for term in terms) if pos >= 0), default=0)
+    start = max(first - SNIPPET_CHARS // 4, 0)
+    snippet = plain[start:start + SNIPPET_CHARS]
+    if terms:
+        snippet = re.sub('|'.join(re.escape(term) for term in terms), lambda m: MARK_START + m.group(0) + MARK_STOP,
+                         snippet, flags=re.IGNORECASE)
+    return ('...' if start else '') + snippet + ('...' if start + SNIPPET_CHARS < len(plain) else '')
+
+
+def highlight(snippet):
+    """Сниппет в безопасный html: текст экранирован, найденное - в <mark>"""
+    return Markup(str(escape(snippet or '')).replace(MARK_START, '<mark>').replace(MARK_STOP, '</mark>'))
+
+
+# ----------------------------------- поиск ---------------------------------------------------------------------------
+def normalize(q):
+    """Запрос как ключ кэша: без лишних пробелов, в нижнем регистре, не длиннее QUERY_MAX"""
+    return ' '.join((q or '').split()).lower()[:QUERY_MAX]
+
+
+def search_posts(db, dialect, q, page=1, limit=SEARCH_PAGE_DEFAULT):
+    """ Поиск статей через кэш. db - соединение или сессия (нужен execute)
+        :return: {'data': [{'title', 'url', 'time', 'rank', 'snippet'}], 'page': N, 'next': N+1 или None}
+    """
+    q = normalize(q)
+    page = min(max(page, 1), SEARCH_PAGES_MAX)
+    limit = min(max(limit, 1), SEARCH_PAGE_MAX)
+    return search_cache.get((q, page, limit), lambda: _search(db, dialect, q, page, limit))
+
+
+def _search(db, dialect, q, page, limit):
+    rows = db.execute(search_query(dialect, q, limit + 1, (page - 1) * limit)).all()  # лишняя строка - есть ли ещё
+    data = [dict(title=row.title, url=row.url, time=row.time.isoformat(), rank=round(float(row.rank), 4),
+                 snippet=str(highlight(row.snippet if dialect == 'postgresql' else _like_snippet(row.snippet, q))))
+            for row in rows[:limit]]
+    next_page = page + 1 if len(rows) > limit and page < SEARCH_PAGES_MAX else None
+    return dict(data=data, page=page, next=next_page)
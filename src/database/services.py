@@ -1,52 +1,119 @@
 import logging
-import psycopg2
-import psycopg2.extras
-import time
+import hashlib
 import re
-import pandas as pd
+import datetime
 from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 from flask import url_for
+from blinker import Namespace
+from markupsafe import Markup
 
-from database.tables import main_menu, posts, users
+from database.tables import main_menu, users
+from database.cache import TTLValue, LRUCache
+from database.queries import (post_by_url_query, posts_page_query, user_by_id_query, user_by_email_query, avatar_query,
+                              add_user_query, add_post_query)
+from database.avatars import DBAvatarStore
 
 
 logger = logging.getLogger(__name__)
 
+_signals = Namespace()
+posts_changed = _signals.signal('posts-changed')    # сигналы об изменениях, на них подписываются кэши выше уровнем
+menu_changed = _signals.signal('menu-changed')
+
+menu_cache = TTLValue(ttl=300)  # меню меняется редко, читаем его из базы не чаще раза в ttl секунд (ttl - из конфига)
+
+
+ANONCE_LEN = 70  # длина анонса статьи на главной, символов
+
+
+user_cache = LRUCache(maxsize=10000, ttl=60)  # юзеры по id для flask-login, размер и ttl - из конфига
+avatar_store = DBAvatarStore()  # где лежат картинки аватаров, заменяется по конфигу через set_avatar_store()
+
+
+def set_avatar_store(store):
+    """Выбор хранилища аватаров"""
+    global avatar_store
+    avatar_store = store
+
+
+UNIQUE_INDEXES = ('ux_users_email', 'ux_posts_url')   # по ним addUser и addPost ловят дубли
+unique_indexes = set(UNIQUE_INDEXES)    # какие из них есть в базе - дубли ловит ON CONFLICT; см. set_unique_indexes()
+
+
+def set_unique_indexes(missing):
+    """ Уникальные индексы, которых в базе нет (missing): для их таблиц дубль ищется через NOT EXISTS.
+        Вызывается при старте, после upgrade_schema
+    """
+    global unique_indexes
+    unique_indexes = set(UNIQUE_INDEXES) - set(missing)
+
+
+def invalidate_menu():
+    """Сбросить кэш меню, вызывать после любой записи в mainmenu"""
+    menu_cache.invalidate()
+    menu_changed.send('mainmenu')
+
+
+def invalidate_user(user_id):
+    """Сбросить юзера из кэша, вызывать после любого изменения его данных в users"""
+    user_cache.invalidate(int(user_id))
+
+
+def make_anonce(text):
+    """Анонс статьи для главной: начало текста без html-тегов"""
+    return Markup(text).striptags()[:ANONCE_LEN]
+
+
+def encode_cursor(row):
+    """Курсор страницы главной - ключ (time, id) последней показанной статьи"""
+    return f"{row.time.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """Разбор курсора страницы, (time, id) или None, если курсор кривой"""
+    try:
+        tm, post_id = cursor.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(tm), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
 
 class FDataBase:
     def __init__(self, db):
         self.__db = db
 
     def getMenu(self):
-        """Получить список словарей с пунктами меню (id, название, url)"""
-        _query = select(main_menu)
+        """Получить список словарей с пунктами меню (id, название, url), через кэш"""
         try:
-            res = self.__db.execute(_query)
-            if res:
-                return res.all()
-
-        except psycopg2.Error as e:
+            return menu_cache.get(self.__loadMenu)
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f"Ошибка чтения из БД: {str(e)}")
         return []
 
+    def __loadMenu(self):
+        """Прочитать меню из БД, кортеж строк - чтобы закэшированное значение никто не поменял"""
+        _query = select(main_menu)
+        return tuple(self.__db.execute(_query).all())
+
     def addPost(self, title, text, url):
-        """Добавляем новую статью, url должен быть уникальным"""
+        """Добавляем новую статью, url должен быть уникальным: проверка и вставка - один запрос"""
         try:
-            _query = select(posts.c.title, posts.c.text).where(posts.c.url == url).limit(1)
-            _res = self.__db.execute(_query)
-            if _res.rowcount > 0:
-                logger.warning(f"Статья '{title}' с таким url={url} уже существует")
-                return False
-
             base = url_for('static', filename='images_html')
             text = re.sub(r"(?P<tag><img\s+[^>]*src=)(?P<quote>[\"'])(?P<url>.+?)(?P=quote)>",
                           "\\g<tag>" + base + "/\\g<url>>", text)
 
-            tm = pd.to_datetime(time.time(), unit='s')
-            _query = posts.insert().values(title=title, text=text, url=url, time=tm)
-            _res = self.__db.execute(_query)
+            _query = add_post_query(self.__db.dialect, title, text, url, make_anonce(text),
+                                    unique='ux_posts_url' in unique_indexes)
+            post_id = self.__db.execute(_query).scalar()
             self.__db.commit()
-        except psycopg2.Error as e:
+            if post_id is None:
+                logger.warning(f"Статья '{title}' с таким url={url} уже существует")
+                return False
+            posts_changed.send('posts')
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f"Ошибка добавления статьи в БД: {str(e)}")
             return False
 
@@ -57,86 +124,134 @@ class FDataBase:
             Возвращает titile Заголовок и text Текст статьи.
         """
         try:
-            _query = select(posts.c.title, posts.c.text).where(posts.c.url == alias).limit(1)
-            _res = self.__db.execute(_query)
-            if _res.rowcount > 0:
-                return _res.all()[0]
+            _query = post_by_url_query(alias)
+            row = self.__db.execute(_query).first()     # rowcount у SELECT знает не каждый драйвер, у SQLite он -1
+            if row:
+                return row
 
-        except psycopg2.Error as e:
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f"Ошибка получения статьи из БД {str(e)}")
 
         return (False, False)
 
-    def getPostsAnonce(self):
-        """Возвращает все статьи с их заголовками"""
+    def getPostsAnonce(self, after=None, limit=20):
+        """ Страница анонсов статей, от новых к старым: заголовок, url и анонс, без полного текста.
+            after - курсор последней статьи предыдущей страницы.
+            Возвращает список статей и курсор следующей страницы (None, если страница последняя).
+        """
         try:
-            _query = select(posts)
-            res = self.__db.execute(_query)
-            if res: return res.all()
-        except psycopg2.Error as e:
+            key = decode_cursor(after) if after else None
+            _query = posts_page_query(limit + 1, key)       # одна лишняя строка - узнать, есть ли следующая страница
+            res = self.__db.execute(_query).all()
+            if len(res) > limit:
+                return res[:limit], encode_cursor(res[limit - 1])
+            return res, None
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f"Ошибка получения статьи из БД {str(e)}")
 
-        return []
+        return [], None
+
+    def searchPosts(self, q, page=1, limit=10):
+        """ Полнотекстовый поиск статей, через кэш ответов.
+            Возвращает {'data': [статьи с html-сниппетами], 'page': N, 'next': номер следующей страницы или None}
+        """
+        from database.search import search_posts     # search импортирует services (сигнал posts_changed)
+        try:
+            return search_posts(self.__db, self.__db.dialect, q, page, limit)
+        except SQLAlchemyError as e:
+            self.__db.rollback()
+            logger.error(f"Ошибка поиска статей в БД {str(e)}")
+
+        return dict(data=[], page=page, next=None)
 
     def addUser(self, name, email, hpsw):
-        """Добавляем пользователя. Электронная почта должна быть уникальной."""
+        """Добавляем пользователя. Электронная почта должна быть уникальной: проверка и вставка - один запрос"""
         try:
-            _query = select(users).where(users.c.email == email).limit(1)
-            _res = self.__db.execute(_query)
-            if _res.rowcount > 0:
+            _query = add_user_query(self.__db.dialect, name, email, hpsw, unique='ux_users_email' in unique_indexes)
+            user_id = self.__db.execute(_query).scalar()
+            self.__db.commit()
+            if user_id is None:
                 logger.info(f"Пользователь с таким email={email} уже существует")
                 return False
-
-            tm = pd.to_datetime(time.time(), unit='s')
-            _query = users.insert().values(name=name, email=email, psw=hpsw, time=tm)
-            _res = self.__db.execute(_query)
-            self.__db.commit()
-        except psycopg2.Error as e:
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f"Ошибка добавления пользователя в БД {str(e)}")
             return False
 
         return True
 
     def getUser(self, user_id):
-        """Получить юзера по его id, юзер - это словарь."""
+        """Получить юзера по его id, юзер - это словарь (без пароля и картинки аватара). Через кэш."""
         try:
-            _query = select(users).where(users.c.id == user_id).limit(1)
-            res = self.__db.execute(_query)
-            if res.rowcount == 0:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            logger.error(f'Некорректный user_id={user_id}')
+            return False
+        return user_cache.get(user_id, lambda: self.__loadUser(user_id))
+
+    def __loadUser(self, user_id):
+        """Прочитать юзера из БД"""
+        try:
+            _query = user_by_id_query(user_id)
+            res = self.__db.execute(_query).mappings().first()     # rowcount у SELECT в SQLite -1, не годится
+            if res is None:
                 logger.error(f'Пользователь не найден user_id={user_id}')
                 return False
-            else:
-                res = res.mappings().all()[0]
             return res
-        except psycopg2.Error as e:
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f'Ошибка получения данных из БД {str(e)}')
         return False
 
     def getUserByEmail(self, email):
-        """Получить юзера по его email"""
+        """Получить юзера по его email, вместе с хэшем пароля - для проверки при входе"""
         try:
-            _query = select(users).where(users.c.email == email).limit(1)
-            res = self.__db.execute(_query)
-            if res.rowcount == 0:
+            _query = user_by_email_query(email)
+            res = self.__db.execute(_query).mappings().first()
+            if res is None:
                 logger.error(f'Пользователь не найден email={email}')
                 return False
-            else:
-                res = res.mappings().all()[0]
             return res
-        except psycopg2.Error as e:
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f'Ошибка получения данных из БД {str(e)}')
 
         return False
 
+    def getAvatar(self, user_id):
+        """Картинка аватара юзера, байты или None"""
+        try:
+            _query = avatar_query(user_id)
+            return self.__db.execute(_query).scalar()
+        except SQLAlchemyError as e:
+            self.__db.rollback()
+            logger.error(f'Ошибка получения аватара из БД {str(e)}')
+        return None
+
     def updateUserAvatar(self, avatar, user_id):
         """Обновить аватар пользователя"""
         if not avatar:
             return False
         try:
-            _query = users.update().where(users.c.id == user_id).values(avatar=avatar)
+            avatar_hash = hashlib.sha256(avatar).hexdigest()
+            if avatar_store.external:           # картинка - в файл, в базе остаётся только её хэш
+                avatar_store.put(avatar_hash, avatar)
+                avatar = None
+            _query = users.update().where(users.c.id == user_id).values(avatar=avatar, avatar_hash=avatar_hash)
             _res = self.__db.execute(_query)
             self.__db.commit()
-        except psycopg2.Error as e:
+            invalidate_user(user_id)
+        except SQLAlchemyError as e:
+            self.__db.rollback()
             logger.error(f'Ошибка обновления аватара в БД: {str(e)}')
             return False
+        except OSError as e:
+            logger.error(f'Ошибка записи аватара в хранилище: {str(e)}')
+            return False
         return True
+
+    def getAvatarFile(self, avatar_hash):
+        """Путь к файлу аватара во внешнем хранилище, None - если аватар хранится не файлом"""
+        return avatar_store.path(avatar_hash)
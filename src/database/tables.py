@@ -1,4 +1,4 @@
-from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime     # , LargeBinary
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, Text, DateTime, Index, LargeBinary
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.dialects import postgresql
 
@@ -18,7 +18,10 @@ posts = Table('posts', metadata,
               Column('title', String(256), nullable=False),
               Column('text', Text, nullable=False),
               Column('url', String(256), nullable=False),
-              Column('time', DateTime, nullable=False)
+              Column('time', DateTime, nullable=False),
+              Column('anonce', String(256), nullable=True),     # анонс для главной, считается при записи статьи
+              Index('ix_posts_time_id', 'time', 'id'),          # для постраничного вывода главной по (time, id)
+              Index('ux_posts_url', 'url', unique=True),        # статья по алиасу; он же не даёт завести дубль
               )
 
 # описание таблицы для Пользователей
@@ -27,11 +30,26 @@ users = Table('users', metadata,
               Column('name', String(128), nullable=False),
               Column('email', String(128), nullable=False),
               Column('psw', String(256), nullable=False),
-              # Column('avatar', LargeBinary, nullable=True),
-              Column('avatar', postgresql.BYTEA, nullable=True),
-              Column('time', DateTime, nullable=False)
+              # в PostgreSQL - BYTEA, как и было; в mock-базе (SQLite) - BLOB
+              Column('avatar', LargeBinary().with_variant(postgresql.BYTEA(), 'postgresql'), nullable=True),
+              Column('avatar_hash', String(64), nullable=True),  # sha256 аватара, он же его ETag
+              Column('time', DateTime, nullable=False),
+              Index('ux_users_email', 'email', unique=True),    # вход по email; он же не даёт завести дубль
               )
 
+# Индексы в уже существующую базу добавляет python manage.py migrate (CREATE INDEX CONCURRENTLY, без блокировки
+# записи), а python manage.py check-indexes проверяет по EXPLAIN, что запросы из database.queries идут по индексам
+DDL_LOCK_TIMEOUT = '5s'     # сколько ALTER TABLE при старте ждёт блокировку, прежде чем сдаться, а не держать очередь
+
+# У posts в PostgreSQL есть ещё колонка search (tsvector) с GIN-индексом - полнотекстовый поиск. Здесь она
+# не описана: её ведёт триггер, а в mock-базе её нет вовсе; см. database.search
+
+# Счётчики строк таблиц, их ведут триггеры (см. database.init.upgrade_schema) - чтобы не делать count(*) по таблице
+counters = Table('counters', metadata,
+                 Column('name', String(64), primary_key=True),
+                 Column('value', BigInteger, nullable=False)
+                 )
+
 # # СПОСОБ 2
 # # объект для ВСЕХ таблиц базы для наследования классов таблиц -------------------------------------------------------
 all_db_tables = declarative_base()
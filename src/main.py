@@ -1,29 +1,189 @@
 """
     Файл запуска приложения.
+    server.workers = 1 (по умолчанию) - один процесс сервера, как раньше;
+    server.workers > 1 - prefork: супервизор запускает N рабочих процессов, каждый со своим cheroot
+    на server.numthreads потоков. Все процессы слушают один порт (SO_REUSEPORT), ядро само раздаёт
+    им соединения, а каждый процесс - это свой GIL, так что работают все ядра.
+    Конфиги перечитываются на ходу раз в reload_settings_period секунд или по kill -HUP (процессу или супервизору).
 """
 import os
 os.environ.setdefault('SRC_PATH', os.path.join(os.getcwd()))            # путь к корню - в переменные окружения
 os.environ.setdefault('APP_PATH', os.path.join(os.getcwd(), 'app'))     # путь к приложению
 
+import sys
+import time
+import signal
+import logging
+
 from cheroot.wsgi import Server as WSGIServer, PathInfoDispatcher       # это продуктовый сервер WSGI
-from app.app_init import app as flask_app, config                       # это приложение Flask и объект с конфигами
+from app.app_init import (app as flask_app, config, password_hasher, engine,   # Flask, конфиги, база
+                          log_pipeline, config_reloader)
 
+logger = logging.getLogger(__name__)
 
 dispatcher = PathInfoDispatcher({'/': flask_app})       #
 host = config.get_app_host()                            # сервер WSGI запустит Flask
 port = config.get_app_port()                            # в продуктовом многопоточном режиме
 num_threads = config.get_threads()                      #
+num_workers = config.get_workers()                      # процессов в prefork-режиме
+SHUTDOWN_TIMEOUT = 4                                    # сколько секунд даём запросам доработать при остановке
 
 
-def main():
+def main(reuse_port=False):
     """Создание продуктового сервера - обёртки вокруг flask-приложения"""
     wsgis_server = WSGIServer((host, port), dispatcher, numthreads=num_threads, max=-1,
-                        request_queue_size=1024, timeout=4, shutdown_timeout=4,
+                        request_queue_size=1024, timeout=4, shutdown_timeout=SHUTDOWN_TIMEOUT,
                         accepted_queue_size=-1, accepted_queue_timeout=4,
-                        peercreds_enabled=False, peercreds_resolve_enabled=False)
+                        peercreds_enabled=False, peercreds_resolve_enabled=False, reuse_port=reuse_port)
     return wsgis_server
 
 
+def watch_config(server):
+    """ Перечитывание конфига в этом процессе (период или SIGHUP); число потоков cheroot тоже меняется на ходу.
+        Вызывать из главного потока - там ставится обработчик SIGHUP.
+    """
+    @config_reloader.on_reload
+    def resize_threads(config, changed):
+        if 'app.server' not in changed:
+            return
+        threads, pool = config.get_threads(), server.requests
+        if threads != pool.min:
+            current, pool.min = pool.min, threads
+            if threads > current:
+                pool.grow(threads - current)
+            else:
+                pool.shrink(current - threads)      # лишние потоки завершатся, доделав свои запросы
+            logger.warning(f'Server threads: {current} -> {threads}')
+        if (config.get_app_host(), config.get_app_port(), config.get_workers()) != (host, port, num_workers):
+            logger.warning(f'server.host, server.port and server.workers are applied only after restart')
+
+    config_reloader.start()
+
+
+def _raise_exit(signum, frame):
+    """SIGTERM превращаем в SystemExit - cheroot на нём корректно останавливается"""
+    raise SystemExit(0)
+
+
+def run_worker():
+    """ Рабочий процесс prefork-режима, запускается сразу после fork.
+        Пул соединений с базой у каждого процесса свой: dispose(close=False) заводит новый пул,
+        не трогая сокеты, унаследованные от родителя.
+    """
+    signal.signal(signal.SIGTERM, _raise_exit)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # Ctrl+C приходит всей группе - останавливает супервизор
+    engine.dispose(close=False)
+    password_hasher.start()
+    server = main(reuse_port=True)
+    watch_config(server)
+    logger.fatal(f'Worker pid={os.getpid()} started, {num_threads} threads')
+    try:
+        server.safe_start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        password_hasher.shutdown()
+        logger.fatal(f'Worker pid={os.getpid()} stopped')
+
+
+class Supervisor:
+    """ Родительский процесс prefork-режима: держит workers рабочих процессов,
+        упавшие перезапускает, по SIGTERM/SIGINT останавливает всех и ждёт, пока они доработают.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.children = dict()          # pid -> время запуска
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:                    # это уже рабочий процесс
+            code = 0
+            log_pipeline.after_fork()   # поток записи лога остался в родителе - заводим свой
+            try:
+                run_worker()
+            except BaseException:
+                logger.exception(f'Worker pid={os.getpid()} crashed')
+                code = 1
+            finally:
+                log_pipeline.stop()     # дописываем очередь лога до выхода
+                logging.shutdown()
+                os._exit(code)          # в ребёнке - никаких atexit-обработчиков родителя
+        self.children[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        if not self.stopping:
+            logger.fatal(f'Supervisor got signal {signum}, stopping {len(self.children)} workers...')
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(self, signum, frame):
+        """SIGHUP супервизору - перечитать конфиг во всех рабочих процессах"""
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.reload)
+        engine.dispose()                # родителю соединения с базой не нужны, дети откроют свои
+
+        for _ in range(self.workers):
+            self.spawn()
+        logger.fatal(f'Supervisor pid={os.getpid()} started {self.workers} workers x {num_threads} threads '
+                     f'on {host}:{port}')
+
+        deadline = None
+        while self.children:
+            if self.stopping and deadline is None:
+                deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 2
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in self.children:
+                    logger.error(f'Worker pid={pid} did not stop in time, killing')
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float('inf')
+
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+
+            started = self.children.pop(pid)
+            if self.stopping:
+                continue
+            logger.error(f'Worker pid={pid} exited with status {status}, restarting')
+            if time.monotonic() - started < 1:      # падает сразу после старта - не перезапускаем в цикле
+                time.sleep(1)
+            self.spawn()
+
+        logger.fatal(f'Supervisor stopped')
+
+
 if __name__ == "__main__":
+    if config.get_db_maxconn() < num_threads:
+        logger.warning(f'maxconn={config.get_db_maxconn()} < numthreads={num_threads}: '
+                       f'under load threads will wait for database connections')
+
+    if num_workers > 1:
+        Supervisor(num_workers).run()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, _raise_exit)     # kill - та же остановка, что и Ctrl+C
     site_server = main()        # создание экземпляра сервера
-    site_server.safe_start()    # запуск экземпляра
+    password_hasher.start()     # процессы хэширования паролей - пока потоков сервера ещё нет
+    watch_config(site_server)   # перечитывание конфига на ходу
+    try:
+        site_server.safe_start()    # запуск экземпляра
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        password_hasher.shutdown()  # иначе процессы пула хэширования остаются сиротами
+        log_pipeline.stop()         # дописываем очередь лога до выхода
@@ -0,0 +1,113 @@
+"""
+    Служебные команды обслуживания базы, запуск: python manage.py <команда> [параметры]
+    Список команд: python manage.py -h
+"""
+import os
+os.environ.setdefault('SRC_PATH', os.path.join(os.getcwd()))            # путь к корню - в переменные окружения
+os.environ.setdefault('APP_PATH', os.path.join(os.getcwd(), 'app'))     # путь к приложению
+
+import sys
+import logging
+import argparse
+
+from app.config.simpl_config import Config
+import database.init
+from database.avatars import FileAvatarStore, migrate_avatars
+from database.generate import generate, BATCH, AVATAR_SHARE
+from database.migrate import migrate, check_indexes, fill_anonces
+from app.profiler import make_token
+
+logger = logging.getLogger(__name__)
+
+
+def cmd_migrate_avatars(config, args):
+    """Перенести картинки аватаров из users.avatar в файловое хранилище"""
+    engine, _all_db_tables, _db_conf = database.init.db_connection(config)
+    store = FileAvatarStore(args.path or config.get_avatar_path(), config.get_avatar_thumb_size())
+    migrate_avatars(engine, store, batch=args.batch)
+    if config.get_avatar_storage() != 'fs':
+        logger.warning(f'avatars.storage is not fs in app.yml - set it, or the site will not see the moved avatars')
+
+
+def cmd_generate(config, args):
+    """Сгенерировать и залить синтетических юзеров и статьи (COPY в PostgreSQL)"""
+    if config.get_db_type() == 'mock':
+        logger.error(f'Mock database lives inside the server process - set mock_users/mock_posts in db.yml instead')
+        sys.exit(1)
+    engine, all_db_tables, _db_conf = database.init.db_connection(config)
+    if database.init.missing_tables(engine):
+        with engine.connect() as conn:
+            database.init.upload_demo(engine, all_db_tables, conn)
+    database.init.upgrade_schema(engine)
+    generate(engine, args.users, args.posts, batch=args.batch, method=args.method, defer_indexes=args.defer_indexes,
+             avatars=args.avatars, seed=args.seed)
+
+
+def cmd_migrate(config, args):
+    """Построить недостающие индексы из tables.py и индекс поиска, в PostgreSQL - CREATE INDEX CONCURRENTLY"""
+    engine, _all_db_tables, _db_conf = database.init.db_connection(config)
+    if not args.dry_run:
+        filled = fill_anonces(engine)
+        if filled:
+            logger.info(f'Post anonces filled: {filled}')
+    failed = migrate(engine, dry_run=args.dry_run)
+    if failed:
+        logger.error(f'Not created: {", ".join(failed)}')
+        sys.exit(1)
+
+
+def cmd_check_indexes(config, args):
+    """Проверить по EXPLAIN, что запросы сайта и api идут по индексам"""
+    engine, _all_db_tables, _db_conf = database.init.db_connection(config)
+    bad = check_indexes(engine)
+    if bad:
+        logger.error(f'Full table scans: {", ".join(bad)} - run python manage.py migrate')
+        sys.exit(1)
+
+
+def cmd_profile_token(config, args):
+    """Выдать токен для заголовка X-Profile: запрос с ним будет профилирован"""
+    secret = (config.get_profiler() or {}).get('secret')
+    if not secret:
+        logger.error(f'profiler.secret is not set in app.yml - header profiling is off')
+        sys.exit(1)
+    print(make_token(secret))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='manage.py', description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('migrate-avatars', help=cmd_migrate_avatars.__doc__)
+    cmd.add_argument('--path', help='каталог хранилища, по умолчанию avatars.path из app.yml')
+    cmd.add_argument('--batch', type=int, default=100, help='сколько юзеров переносить за одну транзакцию')
+    cmd.set_defaults(func=cmd_migrate_avatars)
+
+    cmd = commands.add_parser('generate', help=cmd_generate.__doc__)
+    cmd.add_argument('--users', type=int, default=0, help='сколько юзеров добавить')
+    cmd.add_argument('--posts', type=int, default=0, help='сколько статей добавить')
+    cmd.add_argument('--batch', type=int, default=BATCH, help='строк в одной транзакции')
+    cmd.add_argument('--method', choices=('copy', 'insert'), help='COPY или многострочные INSERT, по умолчанию COPY')
+    cmd.add_argument('--defer-indexes', action='store_true', help='индексы построить после заливки, а не по ходу')
+    cmd.add_argument('--avatars', type=float, default=AVATAR_SHARE, help='доля юзеров с аватаром, 0..1')
+    cmd.add_argument('--seed', type=int, default=1, help='зерно случайных чисел')
+    cmd.set_defaults(func=cmd_generate)
+
+    cmd = commands.add_parser('migrate', help=cmd_migrate.__doc__)
+    cmd.add_argument('--dry-run', action='store_true', help='только показать, что будет построено, и найти дубли')
+    cmd.set_defaults(func=cmd_migrate)
+
+    cmd = commands.add_parser('check-indexes', help=cmd_check_indexes.__doc__)
+    cmd.set_defaults(func=cmd_check_indexes)
+
+    cmd = commands.add_parser('profile-token', help=cmd_profile_token.__doc__)
+    cmd.set_defaults(func=cmd_profile_token)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname).1s: %(filename)s: %(funcName)s: %(message)s",
+                        handlers=[logging.StreamHandler(sys.stderr)])
+    args.func(Config(), args)
+
+
+if __name__ == "__main__":
+    main()